@@ -11,3 +11,42 @@ DEFAULT_SESSION = os.environ.get("CODEX_TMUX_SESSION", "codexctl")
 POLL_INTERVAL_MS = int(os.environ.get("CODEXDASH_POLL_MS", "500"))
 TAIL_INTERVAL_MS = int(os.environ.get("CODEXDASH_TAIL_MS", "200"))
 MAX_EVENT_LINE = int(os.environ.get("CODEXDASH_MAX_EVENT_LINE", "200000"))
+DB_READERS = int(os.environ.get("CODEXDASH_DB_READERS", "4"))
+INGEST_QUEUE_SIZE = int(os.environ.get("CODEXDASH_INGEST_QUEUE", "5000"))
+INGEST_BATCH_SIZE = int(os.environ.get("CODEXDASH_INGEST_BATCH", "200"))
+INGEST_FLUSH_MS = int(os.environ.get("CODEXDASH_INGEST_FLUSH_MS", "50"))
+INGEST_OFFER_TIMEOUT_MS = int(os.environ.get("CODEXDASH_INGEST_OFFER_TIMEOUT_MS", "1000"))
+INGEST_RETRY_MS = int(os.environ.get("CODEXDASH_INGEST_RETRY_MS", "500"))
+JOB_CACHE_SIZE = int(os.environ.get("CODEXDASH_JOB_CACHE", "512"))
+JOB_FLUSH_MS = int(os.environ.get("CODEXDASH_JOB_FLUSH_MS", "1000"))
+CAPTURE_MODE = os.environ.get("CODEXDASH_CAPTURE_MODE", "delta")
+CAPTURE_LINES = int(os.environ.get("CODEXDASH_CAPTURE_LINES", "2000"))
+TMUX_CONTROL = os.environ.get("CODEXDASH_TMUX_CONTROL", "0") == "1"
+CONTROL_TIMEOUT_MS = int(os.environ.get("CODEXDASH_CONTROL_TIMEOUT_MS", "2000"))
+CONTROL_IDLE_MS = int(os.environ.get("CODEXDASH_CONTROL_IDLE_MS", "1000"))
+CONTROL_RETRY_MS = int(os.environ.get("CODEXDASH_CONTROL_RETRY_MS", "5000"))
+AGENT_MAP_TTL_MS = int(os.environ.get("CODEXDASH_AGENT_MAP_TTL_MS", "2000"))
+TOKEN_MEMO_SIZE = int(os.environ.get("CODEXDASH_TOKEN_MEMO", "2048"))
+TOKEN_EXACT_MAX_CHARS = int(os.environ.get("CODEXDASH_TOKEN_EXACT_MAX_CHARS", "16000"))
+TAIL_MODE = os.environ.get("CODEXDASH_TAIL_MODE", "auto")
+BLOB_CACHE_SIZE = int(os.environ.get("CODEXDASH_BLOB_CACHE", "256"))
+BLOB_MIN_COMPRESS = int(os.environ.get("CODEXDASH_BLOB_MIN_COMPRESS", "128"))
+RETENTION_DAYS = float(os.environ.get("CODEXDASH_RETENTION_DAYS", "7"))
+RETENTION_INTERVAL_MS = int(os.environ.get("CODEXDASH_RETENTION_INTERVAL_MS", "3600000"))
+RETENTION_BATCH = int(os.environ.get("CODEXDASH_RETENTION_BATCH", "500"))
+RETENTION_PAUSE_MS = int(os.environ.get("CODEXDASH_RETENTION_PAUSE_MS", "50"))
+RETENTION_VACUUM_PAGES = int(os.environ.get("CODEXDASH_RETENTION_VACUUM_PAGES", "256"))
+ROLLUP_MINUTE_DAYS = float(os.environ.get("CODEXDASH_ROLLUP_MINUTE_DAYS", "90"))
+DB_QUERY_TIMEOUT_MS = int(os.environ.get("CODEXDASH_DB_QUERY_TIMEOUT_MS", "5000"))
+WS_CLIENT_QUEUE = int(os.environ.get("CODEXDASH_WS_CLIENT_QUEUE", "1000"))
+WS_SEND_TIMEOUT_MS = int(os.environ.get("CODEXDASH_WS_SEND_TIMEOUT_MS", "5000"))
+WS_BATCH_MS = int(os.environ.get("CODEXDASH_WS_BATCH_MS", "25"))
+WS_TEXT_INLINE = int(os.environ.get("CODEXDASH_WS_TEXT_INLINE", "4096"))
+WS_REPLAY_MAX = int(os.environ.get("CODEXDASH_WS_REPLAY_MAX", "5000"))
+CODEXDASH_BIN = Path(os.path.expanduser(os.environ.get("CODEXDASH_BIN", str(HOME / "bin" / "codexdash"))))
+DISPATCH_MAX = int(os.environ.get("CODEXDASH_DISPATCH_MAX", "4"))
+DISPATCH_PER_AGENT = int(os.environ.get("CODEXDASH_DISPATCH_PER_AGENT", "1"))
+DISPATCH_QUEUE_SIZE = int(os.environ.get("CODEXDASH_DISPATCH_QUEUE", "500"))
+DISPATCH_MODE = os.environ.get("CODEXDASH_DISPATCH_MODE", "tmux")
+DISPATCH_WAIT_S = int(os.environ.get("CODEXDASH_DISPATCH_WAIT_S", "90"))
+DISPATCH_ENTER_DELAY_MS = int(os.environ.get("CODEXDASH_DISPATCH_ENTER_DELAY_MS", "120"))
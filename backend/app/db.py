@@ -1,15 +1,37 @@
 from __future__ import annotations
 
+import asyncio
+import functools
 import json
+import os
+import queue
 import sqlite3
 import threading
 import time
-from pathlib import Path
-from typing import Any, Dict, Iterable, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, TypeVar
 
-from .config import DB_PATH, CODEXDASH_DIR
+from .config import DB_PATH, CODEXDASH_DIR, DB_QUERY_TIMEOUT_MS, DB_READERS, EVENTS_PATH
+from .services.ndjson_reader import hash_range, last_line
 
-_DB_LOCK = threading.Lock()
+# Serializes access to the single long-lived writer connection. Re-entrant so
+# the insert/upsert helpers can run inside an enclosing write_batch().
+_DB_LOCK = threading.RLock()
+_WRITER: Optional[sqlite3.Connection] = None
+_BATCH_DEPTH = 0
+_BATCH_OWNER: Optional[int] = None
+_READERS: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=DB_READERS)
+# Request handlers read through this pool (see run_read) so a query never
+# runs on the event loop; one thread per pooled reader connection.
+_READ_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_LOCAL = threading.local()
+
+T = TypeVar("T")
+
+
+class QueryTimeout(Exception):
+  pass
 
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS agents (
@@ -40,7 +62,10 @@ CREATE TABLE IF NOT EXISTS jobs (
   total_tokens_exact INTEGER,
   prompt_tokens_est INTEGER,
   completion_tokens_est INTEGER,
-  total_tokens_est INTEGER
+  total_tokens_est INTEGER,
+  parent_job_id TEXT,
+  completion TEXT,
+  children INTEGER
 );
 
 CREATE TABLE IF NOT EXISTS events (
@@ -64,12 +89,49 @@ CREATE TABLE IF NOT EXISTS events (
   total_tokens_exact INTEGER,
   prompt_tokens_est INTEGER,
   completion_tokens_est INTEGER,
-  total_tokens_est INTEGER
+  total_tokens_est INTEGER,
+  event_key TEXT,
+  text_hash TEXT
+);
+
+-- Pane text and prompts, stored once per distinct SHA-256 and referenced by
+-- events.text_hash / events.prompt_hash / jobs.prompt_hash.
+CREATE TABLE IF NOT EXISTS blobs (
+  hash TEXT PRIMARY KEY,
+  codec TEXT,
+  size INTEGER,
+  data BLOB,
+  created_ts INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS tail_state (
+  path TEXT PRIMARY KEY,
+  inode INTEGER,
+  offset INTEGER,
+  line_start INTEGER,
+  line_hash TEXT,
+  updated_ts INTEGER
+);
+
+-- Output events past the retention window, rolled up per job (retention.py).
+CREATE TABLE IF NOT EXISTS transcripts (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  job_id TEXT,
+  agent TEXT,
+  first_ts INTEGER,
+  last_ts INTEGER,
+  events INTEGER,
+  text_hash TEXT
 );
 
 CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts);
-CREATE INDEX IF NOT EXISTS idx_events_job ON events(job_id);
-CREATE INDEX IF NOT EXISTS idx_jobs_agent ON jobs(agent);
+CREATE INDEX IF NOT EXISTS idx_events_job_ts ON events(job_id, ts);
+CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs(updated_ts, job_id);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_updated ON jobs(status, updated_ts, job_id);
+CREATE INDEX IF NOT EXISTS idx_jobs_agent_updated ON jobs(agent, updated_ts, job_id);
+CREATE INDEX IF NOT EXISTS idx_transcripts_job ON transcripts(job_id, first_ts);
+CREATE INDEX IF NOT EXISTS idx_transcripts_text_hash ON transcripts(text_hash);
+CREATE INDEX IF NOT EXISTS idx_jobs_prompt_hash ON jobs(prompt_hash) WHERE prompt_hash IS NOT NULL;
 """
 
 
@@ -81,8 +143,12 @@ def init_db() -> None:
       try:
         conn = _connect()
         try:
+          # Only takes effect on a new database (or after a manual VACUUM);
+          # lets retention hand freed pages back with incremental_vacuum.
+          conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
           conn.execute("PRAGMA journal_mode=WAL;")
           conn.executescript(SCHEMA)
+          _migrate(conn)
           conn.commit()
         finally:
           conn.close()
@@ -94,6 +160,130 @@ def init_db() -> None:
         time.sleep(0.2)
 
 
+# Columns added after the first release; CREATE TABLE IF NOT EXISTS leaves
+# older databases without them.
+_ADDED_COLUMNS = (
+  ("events", "event_key", "TEXT"),
+  ("events", "text_hash", "TEXT"),
+  ("jobs", "parent_job_id", "TEXT"),
+  ("jobs", "completion", "TEXT"),
+  ("jobs", "children", "INTEGER"),
+)
+
+# Event fields kept in the blobs table instead of the row when it has a hash.
+BLOB_FIELDS = {"text": "text_hash", "prompt_text": "prompt_hash"}
+
+
+# Superseded by the composite indexes in SCHEMA.
+_DROPPED_INDEXES = ("idx_events_job", "idx_jobs_agent")
+
+
+_ROLLUP_TABLE = """
+CREATE TABLE token_rollups (
+  bucket TEXT,
+  start INTEGER,
+  agent TEXT,
+  model TEXT,
+  events INTEGER,
+  prompt_tokens_exact INTEGER,
+  completion_tokens_exact INTEGER,
+  total_tokens_exact INTEGER,
+  prompt_tokens_est INTEGER,
+  completion_tokens_est INTEGER,
+  total_tokens_est INTEGER,
+  PRIMARY KEY (bucket, start, agent, model)
+) WITHOUT ROWID
+"""
+
+_ROLLUP_BUCKETS = (("minute", 60_000), ("hour", 3_600_000), ("day", 86_400_000))
+_ROLLUP_COUNTS = (
+  "events",
+  "prompt_tokens_exact", "completion_tokens_exact", "total_tokens_exact",
+  "prompt_tokens_est", "completion_tokens_est", "total_tokens_est",
+)
+_ROLLUP_UPSERT = f"""
+INSERT INTO token_rollups (bucket, start, agent, model, {", ".join(_ROLLUP_COUNTS)})
+{{source}}
+ON CONFLICT(bucket, start, agent, model) DO UPDATE SET
+  {", ".join(f"{col}={col}+excluded.{col}" for col in _ROLLUP_COUNTS)}
+"""
+
+
+def _create_rollups(conn: sqlite3.Connection) -> None:
+  # Token rollups are kept up to date by ingest from here on; seed them from
+  # the events already stored.
+  conn.execute(_ROLLUP_TABLE)
+  sums = ", ".join(f"SUM(COALESCE({col}, 0))" for col in _ROLLUP_COUNTS[1:])
+  for bucket, width in _ROLLUP_BUCKETS:
+    conn.execute(
+      _ROLLUP_UPSERT.format(source=f"""
+        SELECT ?, ts / {width} * {width}, COALESCE(agent, ''), COALESCE(model, ''), COUNT(*), {sums}
+        FROM events WHERE ts IS NOT NULL GROUP BY 2, 3, 4
+      """),
+      (bucket,),
+    )
+
+
+def _seed_tail_state(conn: sqlite3.Connection) -> None:
+  # Events stored before event keys cannot be matched to log lines, and there
+  # is no record of how far the log was read; the Tailer would start from
+  # byte 0 and store (and count the tokens of) every event again. The log up
+  # to its last complete line counts as ingested instead.
+  try:
+    with EVENTS_PATH.open("rb") as f:
+      st = os.fstat(f.fileno())
+      line = last_line(f, st.st_size)
+      if line is None:
+        return
+      line_hash = hash_range(f, *line)
+  except OSError:
+    return
+  conn.execute(
+    """
+    INSERT OR IGNORE INTO tail_state (path, inode, offset, line_start, line_hash, updated_ts)
+    VALUES (?, ?, ?, ?, ?, ?)
+    """,
+    (str(EVENTS_PATH), st.st_ino, line[1], line[0], line_hash, int(time.time() * 1000)),
+  )
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+  for name in _DROPPED_INDEXES:
+    conn.execute(f"DROP INDEX IF EXISTS {name}")
+  keyed = any(row["name"] == "event_key" for row in conn.execute("PRAGMA table_info(events)"))
+  for table, column, decl in _ADDED_COLUMNS:
+    cols = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+      conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+  # Events replayed from the log carry a key; a replay is then a no-op.
+  conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_events_key ON events(event_key)")
+  if not keyed and conn.execute("SELECT 1 FROM events LIMIT 1").fetchone() is not None:
+    _seed_tail_state(conn)
+  # Lets retention tell whether a blob is still referenced.
+  conn.execute("CREATE INDEX IF NOT EXISTS idx_events_text_hash ON events(text_hash)")
+  conn.execute("CREATE INDEX IF NOT EXISTS idx_events_prompt_hash ON events(prompt_hash) WHERE prompt_hash IS NOT NULL")
+  # Fan-out dispatches: a parent job's per-agent children.
+  conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_parent ON jobs(parent_job_id) WHERE parent_job_id IS NOT NULL")
+  if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'token_rollups'").fetchone() is None:
+    _create_rollups(conn)
+
+
+def close_db() -> None:
+  global _WRITER, _READ_EXECUTOR
+  with _DB_LOCK:
+    if _WRITER is not None:
+      _WRITER.close()
+      _WRITER = None
+  if _READ_EXECUTOR is not None:
+    _READ_EXECUTOR.shutdown(wait=True, cancel_futures=True)
+    _READ_EXECUTOR = None
+  while True:
+    try:
+      _READERS.get_nowait().close()
+    except queue.Empty:
+      break
+
+
 def _connect() -> sqlite3.Connection:
   conn = sqlite3.connect(DB_PATH, timeout=5, check_same_thread=False)
   conn.row_factory = sqlite3.Row
@@ -102,152 +292,364 @@ def _connect() -> sqlite3.Connection:
   return conn
 
 
-def insert_event(event: Dict[str, Any]) -> None:
+def _writer() -> sqlite3.Connection:
+  global _WRITER
+  if _WRITER is None:
+    _WRITER = _connect()
+    # Transactions are managed explicitly by write_batch().
+    _WRITER.isolation_level = None
+  return _WRITER
+
+
+@contextmanager
+def write_batch() -> Iterator[sqlite3.Connection]:
+  # One transaction on the writer connection for everything in the block;
+  # nested batches join the outermost one so a poll cycle commits once.
+  global _BATCH_DEPTH, _BATCH_OWNER
   with _DB_LOCK:
-    conn = _connect()
+    conn = _writer()
+    outermost = _BATCH_DEPTH == 0
+    if outermost:
+      conn.execute("BEGIN IMMEDIATE")
+      _BATCH_OWNER = threading.get_ident()
+    _BATCH_DEPTH += 1
     try:
-      conn.execute(
-        """
-        INSERT INTO events (
-          ts, type, session, agent, pane_id, window_name, job_id, payload,
-          prompt_text, prompt_hash, prompt_bytes,
-          output_path, output_bytes, model,
-          prompt_tokens_exact, completion_tokens_exact, total_tokens_exact,
-          prompt_tokens_est, completion_tokens_est, total_tokens_est
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-          event.get("ts"),
-          event.get("type"),
-          event.get("session"),
-          event.get("agent"),
-          event.get("pane_id"),
-          event.get("window_name"),
-          event.get("job_id"),
-          json.dumps(event, ensure_ascii=False),
-          event.get("prompt_text"),
-          event.get("prompt_hash"),
-          event.get("prompt_bytes"),
-          event.get("output_path"),
-          event.get("output_bytes"),
-          event.get("model"),
-          event.get("prompt_tokens_exact"),
-          event.get("completion_tokens_exact"),
-          event.get("total_tokens_exact"),
-          event.get("prompt_tokens_est"),
-          event.get("completion_tokens_est"),
-          event.get("total_tokens_est"),
-        ),
-      )
-      conn.commit()
+      yield conn
+      if outermost:
+        conn.execute("COMMIT")
+    except BaseException:
+      if outermost and conn.in_transaction:
+        # The block failed, or COMMIT did (e.g. SQLITE_BUSY/IOERR).
+        conn.execute("ROLLBACK")
+      raise
     finally:
-      conn.close()
+      _BATCH_DEPTH -= 1
+      if outermost:
+        _BATCH_OWNER = None
 
 
-def upsert_agent(agent: Dict[str, Any]) -> None:
-  with _DB_LOCK:
+@contextmanager
+def _reader() -> Iterator[sqlite3.Connection]:
+  # Reads issued from inside a write batch must see its uncommitted rows.
+  if _BATCH_OWNER == threading.get_ident():
+    yield _writer()
+    return
+  try:
+    conn = _READERS.get_nowait()
+  except queue.Empty:
     conn = _connect()
+  call = getattr(_LOCAL, "call", None)
+  if call is not None:
+    # Lets run_read interrupt this query if its caller gives up.
+    call.attach(conn)
+  try:
+    yield conn
+  finally:
+    if call is not None:
+      call.detach()
     try:
-      conn.execute(
-        """
-        INSERT INTO agents (agent, status, last_seen, pane_id, window_name, session, model)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(agent) DO UPDATE SET
-          status=excluded.status,
-          last_seen=excluded.last_seen,
-          pane_id=excluded.pane_id,
-          window_name=excluded.window_name,
-          session=excluded.session,
-          model=excluded.model
-        """,
-        (
-          agent.get("agent"),
-          agent.get("status"),
-          agent.get("last_seen"),
-          agent.get("pane_id"),
-          agent.get("window_name"),
-          agent.get("session"),
-          agent.get("model"),
-        ),
-      )
-      conn.commit()
-    finally:
+      _READERS.put_nowait(conn)
+    except queue.Full:
       conn.close()
 
 
+def insert_event(event: Dict[str, Any]) -> bool:
+  # False when an event with the same event_key is already stored; otherwise
+  # the new row id is set on event. Text whose hash is set has been written
+  # to blobs and is left out of the row.
+  stored = {
+    key: val for key, val in event.items()
+    if not (key in BLOB_FIELDS and event.get(BLOB_FIELDS[key]))
+  }
+  with write_batch() as conn:
+    cur = conn.execute(
+      """
+      INSERT OR IGNORE INTO events (
+        ts, type, session, agent, pane_id, window_name, job_id, payload,
+        prompt_text, prompt_hash, prompt_bytes,
+        output_path, output_bytes, model,
+        prompt_tokens_exact, completion_tokens_exact, total_tokens_exact,
+        prompt_tokens_est, completion_tokens_est, total_tokens_est,
+        event_key, text_hash
+      ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+      """,
+      (
+        event.get("ts"),
+        event.get("type"),
+        event.get("session"),
+        event.get("agent"),
+        event.get("pane_id"),
+        event.get("window_name"),
+        event.get("job_id"),
+        json.dumps(stored, ensure_ascii=False),
+        stored.get("prompt_text"),
+        event.get("prompt_hash"),
+        event.get("prompt_bytes"),
+        event.get("output_path"),
+        event.get("output_bytes"),
+        event.get("model"),
+        event.get("prompt_tokens_exact"),
+        event.get("completion_tokens_exact"),
+        event.get("total_tokens_exact"),
+        event.get("prompt_tokens_est"),
+        event.get("completion_tokens_est"),
+        event.get("total_tokens_est"),
+        event.get("event_key"),
+        event.get("text_hash"),
+      ),
+    )
+    if cur.rowcount <= 0:
+      return False
+    event["id"] = cur.lastrowid
+    return True
+
+
+def blob_exists(digest: str) -> bool:
+  return fetch_one("SELECT 1 AS found FROM blobs WHERE hash = ?", (digest,)) is not None
+
+
+def insert_blob(digest: str, codec: str, size: int, data: bytes) -> None:
+  with write_batch() as conn:
+    conn.execute(
+      "INSERT OR IGNORE INTO blobs (hash, codec, size, data, created_ts) VALUES (?, ?, ?, ?, ?)",
+      (digest, codec, size, data, int(time.time() * 1000)),
+    )
+
+
+def add_token_rollups(rows: Iterable[tuple]) -> None:
+  # rows: (bucket, start, agent, model, events, *token counts), added to
+  # whatever is already stored for that key.
+  with write_batch() as conn:
+    conn.executemany(
+      _ROLLUP_UPSERT.format(source=f"VALUES ({', '.join('?' for _ in range(4 + len(_ROLLUP_COUNTS)))})"),
+      rows,
+    )
+
+
+def load_tail_state(path: str) -> Optional[Dict[str, Any]]:
+  return fetch_one("SELECT * FROM tail_state WHERE path = ?", (path,))
+
+
+def save_tail_state(state: Dict[str, Any]) -> None:
+  with write_batch() as conn:
+    conn.execute(
+      """
+      INSERT INTO tail_state (path, inode, offset, line_start, line_hash, updated_ts)
+      VALUES (?, ?, ?, ?, ?, ?)
+      ON CONFLICT(path) DO UPDATE SET
+        inode=excluded.inode,
+        offset=excluded.offset,
+        line_start=excluded.line_start,
+        line_hash=excluded.line_hash,
+        updated_ts=excluded.updated_ts
+      """,
+      (
+        state.get("path"),
+        state.get("inode"),
+        state.get("offset"),
+        state.get("line_start"),
+        state.get("line_hash"),
+        int(time.time() * 1000),
+      ),
+    )
+
+
+def upsert_agent(agent: Dict[str, Any]) -> None:
+  with write_batch() as conn:
+    conn.execute(
+      """
+      INSERT INTO agents (agent, status, last_seen, pane_id, window_name, session, model)
+      VALUES (?, ?, ?, ?, ?, ?, ?)
+      ON CONFLICT(agent) DO UPDATE SET
+        status=excluded.status,
+        last_seen=excluded.last_seen,
+        pane_id=excluded.pane_id,
+        window_name=excluded.window_name,
+        session=excluded.session,
+        model=excluded.model
+      """,
+      (
+        agent.get("agent"),
+        agent.get("status"),
+        agent.get("last_seen"),
+        agent.get("pane_id"),
+        agent.get("window_name"),
+        agent.get("session"),
+        agent.get("model"),
+      ),
+    )
+
+
 def upsert_job(job: Dict[str, Any]) -> None:
-  with _DB_LOCK:
-    conn = _connect()
-    try:
-      conn.execute(
-        """
-        INSERT INTO jobs (
-          job_id, agent, status, started_ts, updated_ts, duration_ms,
-          prompt_text, prompt_hash, prompt_bytes,
-          output_path, output_bytes, model,
-          prompt_tokens_exact, completion_tokens_exact, total_tokens_exact,
-          prompt_tokens_est, completion_tokens_est, total_tokens_est
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(job_id) DO UPDATE SET
-          agent=excluded.agent,
-          status=excluded.status,
-          started_ts=COALESCE(jobs.started_ts, excluded.started_ts),
-          updated_ts=excluded.updated_ts,
-          duration_ms=excluded.duration_ms,
-          prompt_text=COALESCE(jobs.prompt_text, excluded.prompt_text),
-          prompt_hash=COALESCE(jobs.prompt_hash, excluded.prompt_hash),
-          prompt_bytes=COALESCE(jobs.prompt_bytes, excluded.prompt_bytes),
-          output_path=COALESCE(jobs.output_path, excluded.output_path),
-          output_bytes=COALESCE(jobs.output_bytes, excluded.output_bytes),
-          model=COALESCE(jobs.model, excluded.model),
-          prompt_tokens_exact=COALESCE(jobs.prompt_tokens_exact, excluded.prompt_tokens_exact),
-          completion_tokens_exact=COALESCE(jobs.completion_tokens_exact, excluded.completion_tokens_exact),
-          total_tokens_exact=COALESCE(jobs.total_tokens_exact, excluded.total_tokens_exact),
-          prompt_tokens_est=COALESCE(jobs.prompt_tokens_est, excluded.prompt_tokens_est),
-          completion_tokens_est=COALESCE(jobs.completion_tokens_est, excluded.completion_tokens_est),
-          total_tokens_est=COALESCE(jobs.total_tokens_est, excluded.total_tokens_est)
-        """,
-        (
-          job.get("job_id"),
-          job.get("agent"),
-          job.get("status"),
-          job.get("started_ts"),
-          job.get("updated_ts"),
-          job.get("duration_ms"),
-          job.get("prompt_text"),
-          job.get("prompt_hash"),
-          job.get("prompt_bytes"),
-          job.get("output_path"),
-          job.get("output_bytes"),
-          job.get("model"),
-          job.get("prompt_tokens_exact"),
-          job.get("completion_tokens_exact"),
-          job.get("total_tokens_exact"),
-          job.get("prompt_tokens_est"),
-          job.get("completion_tokens_est"),
-          job.get("total_tokens_est"),
-        ),
-      )
-      conn.commit()
-    finally:
-      conn.close()
+  with write_batch() as conn:
+    conn.execute(
+      """
+      INSERT INTO jobs (
+        job_id, agent, status, started_ts, updated_ts, duration_ms,
+        prompt_text, prompt_hash, prompt_bytes,
+        output_path, output_bytes, model,
+        prompt_tokens_exact, completion_tokens_exact, total_tokens_exact,
+        prompt_tokens_est, completion_tokens_est, total_tokens_est
+      ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+      ON CONFLICT(job_id) DO UPDATE SET
+        agent=excluded.agent,
+        status=excluded.status,
+        started_ts=COALESCE(jobs.started_ts, excluded.started_ts),
+        updated_ts=excluded.updated_ts,
+        duration_ms=excluded.duration_ms,
+        prompt_text=COALESCE(jobs.prompt_text, excluded.prompt_text),
+        prompt_hash=COALESCE(jobs.prompt_hash, excluded.prompt_hash),
+        prompt_bytes=COALESCE(jobs.prompt_bytes, excluded.prompt_bytes),
+        output_path=COALESCE(jobs.output_path, excluded.output_path),
+        output_bytes=COALESCE(jobs.output_bytes, excluded.output_bytes),
+        model=COALESCE(jobs.model, excluded.model),
+        prompt_tokens_exact=COALESCE(jobs.prompt_tokens_exact, excluded.prompt_tokens_exact),
+        completion_tokens_exact=COALESCE(jobs.completion_tokens_exact, excluded.completion_tokens_exact),
+        total_tokens_exact=COALESCE(jobs.total_tokens_exact, excluded.total_tokens_exact),
+        prompt_tokens_est=COALESCE(jobs.prompt_tokens_est, excluded.prompt_tokens_est),
+        completion_tokens_est=COALESCE(jobs.completion_tokens_est, excluded.completion_tokens_est),
+        total_tokens_est=COALESCE(jobs.total_tokens_est, excluded.total_tokens_est)
+      """,
+      (
+        job.get("job_id"),
+        job.get("agent"),
+        job.get("status"),
+        job.get("started_ts"),
+        job.get("updated_ts"),
+        job.get("duration_ms"),
+        job.get("prompt_text"),
+        job.get("prompt_hash"),
+        job.get("prompt_bytes"),
+        job.get("output_path"),
+        job.get("output_bytes"),
+        job.get("model"),
+        job.get("prompt_tokens_exact"),
+        job.get("completion_tokens_exact"),
+        job.get("total_tokens_exact"),
+        job.get("prompt_tokens_est"),
+        job.get("completion_tokens_est"),
+        job.get("total_tokens_est"),
+      ),
+    )
+
+
+JOB_COLUMNS = (
+  "agent", "status", "started_ts", "updated_ts", "duration_ms",
+  "prompt_text", "prompt_hash", "prompt_bytes",
+  "output_path", "output_bytes", "model",
+  "prompt_tokens_exact", "completion_tokens_exact", "total_tokens_exact",
+  "prompt_tokens_est", "completion_tokens_est", "total_tokens_est",
+  "parent_job_id", "completion", "children",
+)
+
+
+def write_job_changes(job_id: str, changes: Dict[str, Any]) -> None:
+  # Writes only the given columns; creates the row if it doesn't exist yet.
+  cols = [col for col in JOB_COLUMNS if col in changes]
+  if not cols:
+    return
+  placeholders = ", ".join("?" for _ in cols)
+  assignments = ", ".join(f"{col}=excluded.{col}" for col in cols)
+  with write_batch() as conn:
+    conn.execute(
+      f"""
+      INSERT INTO jobs (job_id, {", ".join(cols)}) VALUES (?, {placeholders})
+      ON CONFLICT(job_id) DO UPDATE SET {assignments}
+      """,
+      (job_id, *(changes[col] for col in cols)),
+    )
 
 
 def fetch_all(query: str, params: Iterable[Any] = ()) -> list[Dict[str, Any]]:
-  with _DB_LOCK:
-    conn = _connect()
+  with _reader() as conn:
+    rows = conn.execute(query, params).fetchall()
+    return [dict(row) for row in rows]
+
+
+def iter_rows(query: str, params: Iterable[Any] = (), batch: int = 200) -> Iterator[list[Dict[str, Any]]]:
+  # Batches of rows from one cursor, for results too large to hold at once.
+  # The reader connection (and its read snapshot) is held until exhausted.
+  with _reader() as conn:
+    cur = conn.execute(query, params)
     try:
-      rows = conn.execute(query, params).fetchall()
-      return [dict(row) for row in rows]
+      while True:
+        rows = cur.fetchmany(batch)
+        if not rows:
+          return
+        yield [dict(row) for row in rows]
     finally:
-      conn.close()
+      cur.close()
 
 
 def fetch_one(query: str, params: Iterable[Any] = ()) -> Optional[Dict[str, Any]]:
-  with _DB_LOCK:
-    conn = _connect()
-    try:
-      row = conn.execute(query, params).fetchone()
-      return dict(row) if row else None
-    finally:
-      conn.close()
+  with _reader() as conn:
+    row = conn.execute(query, params).fetchone()
+    return dict(row) if row else None
+
+
+class _ReadCall:
+  # The reader connection a run_read call is using, if any. Attach, detach
+  # and interrupt share a lock so a late interrupt can never land on a
+  # connection that has already gone back to the pool.
+
+  def __init__(self) -> None:
+    self._lock = threading.Lock()
+    self._conn: Optional[sqlite3.Connection] = None
+    self.abandoned = False
+
+  def attach(self, conn: sqlite3.Connection) -> None:
+    with self._lock:
+      self._conn = conn
+
+  def detach(self) -> None:
+    with self._lock:
+      self._conn = None
+
+  def interrupt(self) -> None:
+    with self._lock:
+      self.abandoned = True
+      if self._conn is not None:
+        self._conn.interrupt()
+
+
+def _read_executor() -> ThreadPoolExecutor:
+  global _READ_EXECUTOR
+  if _READ_EXECUTOR is None:
+    _READ_EXECUTOR = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix="codexdash-db")
+  return _READ_EXECUTOR
+
+
+def _run_on_reader(call: _ReadCall, fn: Callable[..., T], args: tuple, kwargs: dict) -> T:
+  if call.abandoned:
+    raise QueryTimeout("query timed out while queued")
+  _LOCAL.call = call
+  try:
+    return fn(*args, **kwargs)
+  finally:
+    _LOCAL.call = None
+
+
+async def run_read(fn: Callable[..., T], *args: Any, timeout_ms: Optional[int] = None, **kwargs: Any) -> T:
+  # Runs a read-only function (fetch_all, a query helper, ...) on the reader
+  # pool. After timeout_ms (<= 0: no limit) the running statement is
+  # interrupted and QueryTimeout raised, so a slow query can't hold a request
+  # or a reader thread for long.
+  timeout_ms = DB_QUERY_TIMEOUT_MS if timeout_ms is None else timeout_ms
+  call = _ReadCall()
+  loop = asyncio.get_running_loop()
+  future = loop.run_in_executor(_read_executor(), functools.partial(_run_on_reader, call, fn, args, kwargs))
+  try:
+    return await asyncio.wait_for(asyncio.shield(future), timeout_ms / 1000.0 if timeout_ms > 0 else None)
+  except asyncio.TimeoutError:
+    call.interrupt()
+    # Nobody awaits the interrupted call any more; consume its error.
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    raise QueryTimeout(f"query exceeded {timeout_ms} ms") from None
+
+
+async def afetch_all(query: str, params: Iterable[Any] = (), timeout_ms: Optional[int] = None) -> list[Dict[str, Any]]:
+  return await run_read(fetch_all, query, params, timeout_ms=timeout_ms)
+
+
+async def afetch_one(query: str, params: Iterable[Any] = (), timeout_ms: Optional[int] = None) -> Optional[Dict[str, Any]]:
+  return await run_read(fetch_one, query, params, timeout_ms=timeout_ms)
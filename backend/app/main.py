@@ -2,19 +2,30 @@ from __future__ import annotations
 
 import asyncio
 import json
-import os
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
-import subprocess
-
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 
-from .config import EVENTS_PATH
-from .db import fetch_all, fetch_one, init_db
+from .db import QueryTimeout, afetch_all, afetch_one, close_db, init_db, run_read
+from .services.blob_store import expand_rows, load_texts
+from .services.dispatch import DispatchQueueFull, DispatchScheduler
 from .services.event_ingest import Tailer, TmuxWatcher
-from .services.tmux_probe import map_agents, pane_is_responsive, capture_pane, detect_auth_needed
+from .services.ingest_queue import IngestPipeline
+from .services.job_cache import job_cache
+from .services.queries import (
+  job_children,
+  list_events,
+  list_jobs,
+  stream_job,
+  stream_job_transcript,
+  token_series,
+)
+from .services.retention import RetentionJob
+from .services.token_estimate import load_encoder
+from .services.ws_broadcast import ConnectionManager, EventFilter
 
 app = FastAPI(title="CodexDash API")
 
@@ -23,47 +34,54 @@ app.add_middleware(
   allow_origins=["*"],
   allow_credentials=True,
   allow_methods=["*"],
-  allow_headers=["*"]
+  allow_headers=["*"],
+  expose_headers=["X-Next-Cursor"],
 )
 
 
-class ConnectionManager:
-  def __init__(self) -> None:
-    self.active: List[WebSocket] = []
-
-  async def connect(self, websocket: WebSocket) -> None:
-    await websocket.accept()
-    self.active.append(websocket)
-
-  def disconnect(self, websocket: WebSocket) -> None:
-    if websocket in self.active:
-      self.active.remove(websocket)
-
-  async def broadcast(self, message: Dict[str, Any]) -> None:
-    if not self.active:
-      return
-    data = json.dumps(message, ensure_ascii=False)
-    for ws in list(self.active):
-      try:
-        await ws.send_text(data)
-      except WebSocketDisconnect:
-        self.disconnect(ws)
-      except Exception:
-        self.disconnect(ws)
+@app.exception_handler(QueryTimeout)
+async def query_timeout(request: Request, exc: QueryTimeout) -> JSONResponse:
+  return JSONResponse(status_code=504, content={"detail": str(exc)})
 
 
 manager = ConnectionManager()
 
 
+pipeline = IngestPipeline(manager.broadcast)
+retention = RetentionJob()
+dispatcher = DispatchScheduler(pipeline.put)
 tailer = Tailer()
 watcher = TmuxWatcher()
 
 
+async def on_pane_output(event: Dict[str, Any]) -> None:
+  # Dispatch completion is read off the same captures that get stored.
+  dispatcher.observe(event)
+  await pipeline.offer(event)
+
+
 @app.on_event("startup")
 async def startup() -> None:
   init_db()
-  asyncio.create_task(tailer.run(manager.broadcast))
-  asyncio.create_task(watcher.run(manager.broadcast))
+  # Loading the tokenizer can take seconds (or a download) on first use;
+  # keep it off the event loop and out of the first ingest batch.
+  asyncio.create_task(asyncio.to_thread(load_encoder))
+  await asyncio.to_thread(job_cache.warm)
+  asyncio.create_task(pipeline.run())
+  asyncio.create_task(tailer.run(pipeline.put))
+  asyncio.create_task(watcher.run(on_pane_output))
+  asyncio.create_task(retention.run())
+  asyncio.create_task(dispatcher.run())
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+  tailer.close()
+  await watcher.close()
+  await dispatcher.close()
+  await pipeline.drain()
+  await manager.close()
+  close_db()
 
 
 @app.get("/api/health")
@@ -71,97 +89,183 @@ async def health() -> Dict[str, Any]:
   return {"ok": True, "ts": int(time.time() * 1000)}
 
 
+@app.get("/api/metrics/ingest")
+async def ingest_metrics() -> Dict[str, Any]:
+  return pipeline.metrics()
+
+
+@app.get("/api/metrics/ws")
+async def ws_metrics() -> Dict[str, Any]:
+  return manager.metrics()
+
+
+@app.get("/api/metrics/retention")
+async def retention_metrics() -> Dict[str, Any]:
+  return retention.metrics()
+
+
+@app.get("/api/metrics/tokens")
+async def token_metrics(
+  bucket: str = "hour",
+  range: Optional[str] = None,
+  until: Optional[int] = None,
+  agent: Optional[str] = None,
+  model: Optional[str] = None,
+  group: str = "agent",
+) -> Dict[str, Any]:
+  try:
+    return await run_read(token_series, bucket, range, until, agent, model, group)
+  except ValueError as exc:
+    raise HTTPException(status_code=400, detail=str(exc))
+
+
 @app.get("/api/agents")
 async def agents() -> List[Dict[str, Any]]:
-  rows = fetch_all("SELECT * FROM agents ORDER BY agent")
-  return rows
+  return await afetch_all("SELECT * FROM agents ORDER BY agent")
 
 
 @app.get("/api/jobs")
-async def jobs(limit: int = 50, status: Optional[str] = None, agent: Optional[str] = None) -> List[Dict[str, Any]]:
-  clauses = []
-  params = []
-  if status:
-    clauses.append("status = ?")
-    params.append(status)
-  if agent:
-    clauses.append("agent = ?")
-    params.append(agent)
-  where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
-  query = f"SELECT * FROM jobs {where} ORDER BY updated_ts DESC LIMIT ?"
-  params.append(limit)
-  rows = fetch_all(query, params)
+async def jobs(
+  response: Response,
+  limit: int = 50,
+  status: Optional[str] = None,
+  agent: Optional[str] = None,
+  cursor: Optional[str] = None,
+  fields: Optional[str] = None,
+  parent_job_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+  try:
+    rows, next_cursor = await run_read(
+      list_jobs, limit=limit, cursor=cursor, status=status, agent=agent, fields=fields,
+      parent_job_id=parent_job_id,
+    )
+  except ValueError as exc:
+    raise HTTPException(status_code=400, detail=str(exc))
+  if next_cursor:
+    response.headers["X-Next-Cursor"] = next_cursor
   return rows
 
 
 @app.get("/api/jobs/{job_id}")
 async def job_detail(job_id: str) -> Dict[str, Any]:
-  job = fetch_one("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
-  events = fetch_all("SELECT * FROM events WHERE job_id = ? ORDER BY ts", (job_id,))
-  return {"job": job, "events": events}
+  job = await afetch_one("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+  events = await afetch_all("SELECT * FROM events WHERE job_id = ? ORDER BY ts", (job_id,))
+  # Output older than the retention window survives only as transcripts.
+  transcripts = await afetch_all("SELECT * FROM transcripts WHERE job_id = ? ORDER BY first_ts", (job_id,))
+  rows = ([job] if job else []) + events + transcripts
+  await run_read(expand_rows, rows)
+  detail = {"job": job, "events": events, "transcripts": transcripts}
+  if job and job.get("children"):
+    # Fan-out parent: per-agent jobs; their output is on their own events.
+    detail["children"], detail["children_tokens"] = await run_read(job_children, job_id)
+  return detail
+
+
+@app.get("/api/jobs/{job_id}/stream")
+async def job_stream(
+  job_id: str,
+  format: str = "ndjson",
+  from_id: Optional[int] = None,
+  to_id: Optional[int] = None,
+  fields: Optional[str] = None,
+) -> StreamingResponse:
+  # Same data as /api/jobs/{job_id} without holding it all in memory:
+  # rows go out as they are read. from_id/to_id restrict to an event id range.
+  # Starlette drains the sync generators on its thread pool; only the first
+  # read (which validates fields=) is bounded by the query timeout.
+  if format == "transcript":
+    return StreamingResponse(
+      stream_job_transcript(job_id, from_id, to_id),
+      media_type="text/plain; charset=utf-8",
+    )
+  if format != "ndjson":
+    raise HTTPException(status_code=400, detail="format must be ndjson or transcript")
+  try:
+    lines = stream_job(job_id, from_id, to_id, fields)
+    first = await run_read(next, lines)
+  except ValueError as exc:
+    raise HTTPException(status_code=400, detail=str(exc))
+
+  def encode() -> Iterator[str]:
+    yield json.dumps(first, ensure_ascii=False) + "\n"
+    for line in lines:
+      yield json.dumps(line, ensure_ascii=False) + "\n"
+
+  return StreamingResponse(encode(), media_type="application/x-ndjson")
+
+
+@app.get("/api/blobs/{digest}")
+async def blob(digest: str) -> Response:
+  # Full text behind a text_hash/prompt_hash; the live stream sends long
+  # text as a tail plus this reference.
+  text = (await run_read(load_texts, [digest])).get(digest)
+  if text is None:
+    raise HTTPException(status_code=404, detail="blob not found")
+  return Response(text, media_type="text/plain; charset=utf-8")
 
 
 @app.get("/api/events")
-async def events(since: Optional[int] = None, limit: int = 200) -> List[Dict[str, Any]]:
-  if since is None:
-    rows = fetch_all("SELECT * FROM events ORDER BY ts DESC LIMIT ?", (limit,))
-  else:
-    rows = fetch_all("SELECT * FROM events WHERE ts >= ? ORDER BY ts DESC LIMIT ?", (since, limit))
+async def events(
+  response: Response,
+  since: Optional[int] = None,
+  limit: int = 200,
+  cursor: Optional[str] = None,
+  job_id: Optional[str] = None,
+  agent: Optional[str] = None,
+  type: Optional[str] = None,
+  fields: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+  try:
+    rows, next_cursor = await run_read(
+      list_events,
+      limit=limit, cursor=cursor, since=since, job_id=job_id, agent=agent, type=type, fields=fields,
+    )
+  except ValueError as exc:
+    raise HTTPException(status_code=400, detail=str(exc))
+  if next_cursor:
+    response.headers["X-Next-Cursor"] = next_cursor
   return rows
 
 
 @app.get("/api/doctor")
 async def doctor() -> Dict[str, Any]:
-  mapping = map_agents()
-  status = {}
-  for agent, info in mapping.items():
-    pane_id = info.get("pane_id")
-    responsive = pane_is_responsive(pane_id) if pane_id else False
-    pane_text = capture_pane(pane_id, lines=30) if pane_id else ""
-    status[agent] = {
-      "pane_id": pane_id,
-      "window_name": info.get("window_name"),
-      "responsive": responsive,
-      "auth_needed": detect_auth_needed(pane_text),
-      "mode": info.get("mode"),
-    }
-  return {"agents": status}
+  # Served from what the tmux watcher last captured; sampled_ts/age_ms say
+  # how fresh that is. No tmux calls per request.
+  return watcher.health.snapshot()
 
 
 @app.post("/api/dispatch")
 async def dispatch(payload: Dict[str, Any]) -> Dict[str, Any]:
-  targets = payload.get("targets") or []
-  prompt = payload.get("prompt") or ""
-  parallel = payload.get("parallel")
-  wait = payload.get("wait")
-  outdir = payload.get("outdir")
-  job_id = payload.get("job_id") or None
-
-  cmd = ["/home/chaithupi5/bin/codexdash", "send"]
-  if isinstance(targets, list):
-    cmd.extend([f"@{t}" for t in targets])
-  if parallel is not None:
-    cmd.extend(["--parallel", str(int(bool(parallel)))])
-  if wait is not None:
-    cmd.extend(["--wait", str(int(bool(wait)))])
-  if outdir:
-    cmd.extend(["--outdir", str(outdir)])
-  if prompt:
-    cmd.extend(["--prompt", prompt])
-
-  env = dict(**os.environ)
-  if job_id:
-    env["CODEXDASH_JOB_ID"] = str(job_id)
-
-  proc = subprocess.Popen(cmd, env=env)
-  return {"ok": True, "pid": proc.pid, "job_id": job_id}
+  # Queued, not run inline: see /api/dispatch/queue for progress. The exit
+  # code arrives as a dispatch_done event.
+  try:
+    return dispatcher.submit(payload)
+  except DispatchQueueFull as exc:
+    raise HTTPException(status_code=429, detail=str(exc))
+  except ValueError as exc:
+    raise HTTPException(status_code=400, detail=str(exc))
+
+
+@app.get("/api/dispatch/queue")
+async def dispatch_queue() -> Dict[str, Any]:
+  return dispatcher.status()
 
 
 @app.websocket("/ws/events")
-async def ws_events(websocket: WebSocket) -> None:
-  await manager.connect(websocket)
+async def ws_events(
+  websocket: WebSocket,
+  agents: Optional[str] = None,
+  job_ids: Optional[str] = None,
+  types: Optional[str] = None,
+  after: Optional[int] = None,
+) -> None:
+  # Comma-separated agents/job_ids/types restrict what this client receives;
+  # after=<event id> first replays the stored events it missed.
+  await manager.connect(websocket, EventFilter.parse(agents, job_ids, types), after)
   try:
     while True:
       await websocket.receive_text()
   except WebSocketDisconnect:
+    pass
+  finally:
     manager.disconnect(websocket)
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .tmux_probe import detect_auth_needed
+
+# Trailing screen lines checked for a sign-in/approval prompt, as the old
+# per-request doctor capture did.
+AUTH_TAIL_LINES = 30
+
+
+def _now_ms() -> int:
+  return int(time.time() * 1000)
+
+
+class AgentHealth:
+  # Latest per-agent health, filled in by TmuxWatcher from the captures it
+  # takes anyway, so /api/doctor never has to touch tmux. Written from the
+  # watcher's poll thread, read from request handlers.
+
+  def __init__(self) -> None:
+    self._lock = threading.Lock()
+    self._agents: Dict[str, Dict[str, Any]] = {}
+    self._sampled_ts: Optional[int] = None
+
+  def record(
+    self,
+    mapping: Dict[str, dict],
+    captured: Dict[str, Optional[str]],
+    new_text: Dict[str, str],
+    latency_ms: float,
+    now: Optional[int] = None,
+  ) -> None:
+    # mapping is the watcher's agent map; captured holds the screen tail of
+    # every pane this poll tried to capture (None when that failed), and
+    # new_text what each of them wrote since. Agents not tried this time
+    # (control mode only captures panes that wrote) keep their last sample.
+    now = now or _now_ms()
+    with self._lock:
+      for agent in list(self._agents):
+        if agent not in mapping:
+          del self._agents[agent]
+      for agent, info in mapping.items():
+        pane_id = info.get("pane_id")
+        prev = self._agents.get(agent)
+        if prev is not None and prev["pane_id"] != pane_id:
+          prev = None
+        if pane_id not in captured:
+          continue
+        tail = captured.get(pane_id)
+        health = {
+          "pane_id": pane_id,
+          "window_name": info.get("window_name"),
+          "mode": info.get("mode"),
+          "responsive": bool(tail and tail.strip()),
+          "auth_needed": prev["auth_needed"] if prev else False,
+          "last_output_ts": prev["last_output_ts"] if prev else None,
+          "checked_ts": now,
+          "capture_ms": round(latency_ms, 1),
+        }
+        if tail is not None and (prev is None or new_text.get(pane_id)):
+          # Only re-scanned when the pane changed.
+          health["auth_needed"] = detect_auth_needed(tail)
+        if new_text.get(pane_id):
+          health["last_output_ts"] = now
+        self._agents[agent] = health
+      self._sampled_ts = now
+
+  def snapshot(self) -> Dict[str, Any]:
+    now = _now_ms()
+    with self._lock:
+      agents = {agent: dict(health) for agent, health in self._agents.items()}
+      sampled_ts = self._sampled_ts
+    for health in agents.values():
+      last = health["last_output_ts"]
+      health["last_output_age_ms"] = now - last if last is not None else None
+    return {
+      "agents": agents,
+      "sampled_ts": sampled_ts,
+      "age_ms": now - sampled_ts if sampled_ts is not None else None,
+    }
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+from ..config import BLOB_CACHE_SIZE, BLOB_MIN_COMPRESS
+from ..db import blob_exists, fetch_all, insert_blob
+
+try:
+  import zstandard  # type: ignore
+except Exception:  # pragma: no cover
+  zstandard = None
+
+_ZSTD_LEVEL = 3
+_ZLIB_LEVEL = 6
+
+_CACHE: OrderedDict[str, str] = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+
+def text_hash(text: str) -> str:
+  # Same digest bin/codexdash uses for prompts, so a prompt_hash is also the
+  # key of the prompt's blob.
+  return hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
+
+
+def _compressor():
+  # zstandard (de)compressor objects are not thread-safe; keep one per thread.
+  comp = getattr(_LOCAL, "compressor", None)
+  if comp is None:
+    comp = _LOCAL.compressor = zstandard.ZstdCompressor(level=_ZSTD_LEVEL)
+  return comp
+
+
+def _decompressor():
+  dec = getattr(_LOCAL, "decompressor", None)
+  if dec is None:
+    dec = _LOCAL.decompressor = zstandard.ZstdDecompressor()
+  return dec
+
+
+def _encode(raw: bytes) -> tuple[str, bytes]:
+  if len(raw) < BLOB_MIN_COMPRESS:
+    return "raw", raw
+  if zstandard is not None:
+    data, codec = _compressor().compress(raw), "zstd"
+  else:
+    data, codec = zlib.compress(raw, _ZLIB_LEVEL), "zlib"
+  if len(data) >= len(raw):
+    return "raw", raw
+  return codec, data
+
+
+def _decode(codec: str, data: bytes) -> Optional[bytes]:
+  if codec == "raw":
+    return data
+  if codec == "zlib":
+    return zlib.decompress(data)
+  if codec == "zstd" and zstandard is not None:
+    return _decompressor().decompress(data)
+  return None
+
+
+def _remember(digest: str, text: str) -> None:
+  with _CACHE_LOCK:
+    _CACHE[digest] = text
+    _CACHE.move_to_end(digest)
+    while len(_CACHE) > BLOB_CACHE_SIZE:
+      _CACHE.popitem(last=False)
+
+
+def store_text(text: str, digest: Optional[str] = None) -> str:
+  # Stores text once under its SHA-256 and returns the digest. Must run in a
+  # write batch; repeats of the same text are a no-op insert.
+  digest = digest or text_hash(text)
+  if not blob_exists(digest):
+    raw = text.encode("utf-8", errors="ignore")
+    codec, data = _encode(raw)
+    insert_blob(digest, codec, len(raw), data)
+  return digest
+
+
+def load_texts(digests: Iterable[Optional[str]]) -> Dict[str, str]:
+  wanted = {d for d in digests if d}
+  found: Dict[str, str] = {}
+  with _CACHE_LOCK:
+    for digest in wanted:
+      text = _CACHE.get(digest)
+      if text is not None:
+        found[digest] = text
+  missing = list(wanted - found.keys())
+  for start in range(0, len(missing), 500):
+    chunk = missing[start:start + 500]
+    marks = ", ".join("?" for _ in chunk)
+    for row in fetch_all(f"SELECT hash, codec, data FROM blobs WHERE hash IN ({marks})", chunk):
+      raw = _decode(row["codec"], row["data"])
+      if raw is None:
+        continue
+      text = raw.decode("utf-8", errors="replace")
+      found[row["hash"]] = text
+      _remember(row["hash"], text)
+  return found
+
+
+def expand_rows(rows: list[Dict[str, Any]]) -> list[Dict[str, Any]]:
+  # Fills text/prompt_text on event and job rows from the blobs they
+  # reference; only the rows being returned are decompressed.
+  texts = load_texts(
+    [row.get("text_hash") for row in rows] + [row.get("prompt_hash") for row in rows if not row.get("prompt_text")]
+  )
+  for row in rows:
+    if row.get("text_hash") and "text" not in row:
+      row["text"] = texts.get(row["text_hash"])
+    if not row.get("prompt_text") and row.get("prompt_hash") in texts:
+      row["prompt_text"] = texts[row["prompt_hash"]]
+  return rows
@@ -0,0 +1,443 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+import uuid
+from collections import deque
+from functools import partial
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from .event_ingest import enrich_output_event, normalize_event
+from .tmux_dispatch import TmuxDispatcher, TmuxDispatchError
+from .tmux_probe import AGENTS
+from ..config import (
+  CODEXDASH_BIN,
+  DISPATCH_MAX,
+  DISPATCH_MODE,
+  DISPATCH_PER_AGENT,
+  DISPATCH_QUEUE_SIZE,
+  DISPATCH_WAIT_S,
+)
+
+# Finished dispatches kept for /api/dispatch/queue.
+_RECENT = 50
+
+# Bytes of a failed child's stderr kept on its dispatch_done event.
+_STDERR_TAIL = 2000
+
+# How long shutdown waits for running dispatches before cancelling them.
+_SHUTDOWN_GRACE_S = 10.0
+
+# When a fan-out dispatch's parent job counts as done: once every agent,
+# the first one, or a quorum of them (by default a majority) has finished.
+COMPLETIONS = ("all", "first", "quorum")
+
+
+class DispatchQueueFull(Exception):
+  pass
+
+
+def _now_ms() -> int:
+  return int(time.time() * 1000)
+
+
+class _Dispatch:
+  __slots__ = (
+    "id", "job_id", "targets", "cmd", "prompt", "wait_s", "outdir", "priority", "seq",
+    "queued_ts", "started_ts", "finished_ts", "pid", "exit_code", "status", "error", "panes",
+    "completion", "quorum", "children", "needed", "agents_done", "reported",
+  )
+
+  def __init__(self, job_id: str, targets: List[str], payload: Dict[str, Any], priority: int, seq: int) -> None:
+    self.id = uuid.uuid4().hex[:12]
+    self.job_id = job_id
+    self.targets = targets
+    self.cmd, _ = build_command(payload)
+    self.prompt = str(payload.get("prompt") or "")
+    self.wait_s = _wait_seconds(payload.get("wait"))
+    self.outdir = str(payload["outdir"]) if payload.get("outdir") else None
+    self.completion, self.quorum = _completion(payload)
+    self.priority = priority
+    self.seq = seq
+    self.queued_ts = _now_ms()
+    self.started_ts: Optional[int] = None
+    self.finished_ts: Optional[int] = None
+    self.pid: Optional[int] = None
+    self.exit_code: Optional[int] = None
+    self.status: Optional[str] = None
+    self.error: Optional[str] = None
+    self.panes: Optional[Dict[str, Any]] = None
+    # Fan-out (more than one agent): child job id per agent, how many must
+    # finish for the parent to be done, and which have so far.
+    self.children: Dict[str, str] = {}
+    self.needed: Optional[int] = None
+    self.agents_done: List[str] = []
+    # Whether the dispatch_done for job_id has been emitted already.
+    self.reported = False
+
+  @property
+  def slots(self) -> List[str]:
+    # Concurrency is limited per target; a dispatch to all agents (no
+    # explicit target) needs every agent's slot.
+    return self.targets or list(AGENTS)
+
+  @property
+  def completion_label(self) -> Optional[str]:
+    if not self.children:
+      return None
+    return f"quorum:{self.needed}" if self.completion == "quorum" else self.completion
+
+  def __lt__(self, other: "_Dispatch") -> bool:
+    # Higher priority first, then first come first served.
+    return (-self.priority, self.seq) < (-other.priority, other.seq)
+
+  def describe(self) -> Dict[str, Any]:
+    return {
+      "dispatch_id": self.id,
+      "job_id": self.job_id,
+      "targets": self.targets,
+      "priority": self.priority,
+      "queued_ts": self.queued_ts,
+      "started_ts": self.started_ts,
+      "finished_ts": self.finished_ts,
+      "pid": self.pid,
+      "exit_code": self.exit_code,
+      "status": self.status,
+      "error": self.error,
+      "panes": self.panes,
+      "children": self.children or None,
+      "completion": self.completion_label,
+      "agents_done": self.agents_done if self.children else None,
+    }
+
+
+def _wait_seconds(value: Any) -> float:
+  # wait: seconds to wait for completion (as codexctl --wait), false or 0 to
+  # return once the prompt is submitted; a bare true means the default.
+  if value is None or value is True:
+    return float(DISPATCH_WAIT_S)
+  try:
+    return max(float(value), 0.0)
+  except (TypeError, ValueError):
+    raise ValueError("wait must be a number of seconds") from None
+
+
+def _completion(payload: Dict[str, Any]) -> tuple[str, Optional[int]]:
+  completion = str(payload.get("completion") or "all")
+  if completion not in COMPLETIONS:
+    raise ValueError(f"completion must be one of {', '.join(COMPLETIONS)}")
+  if payload.get("quorum") is None:
+    return completion, None
+  try:
+    quorum = int(payload["quorum"])
+  except (TypeError, ValueError):
+    raise ValueError("quorum must be an integer") from None
+  if quorum < 1:
+    raise ValueError("quorum must be at least 1")
+  return completion, quorum
+
+
+def _needed(completion: str, quorum: Optional[int], total: int) -> int:
+  if completion == "first":
+    return 1
+  if completion == "quorum":
+    return min(quorum or total // 2 + 1, total)
+  return total
+
+
+def _target(target: str) -> str:
+  # The target forms codexctl send takes: an agent name, with or without @,
+  # @N for the Nth agent (from 1), a tmux pane id (%N), or all. Agents come
+  # back as their name, pane ids as they are.
+  if target == "all" or target.startswith("%"):
+    return target
+  name = target[1:] if target.startswith("@") else target
+  if name.isdigit():
+    if not 1 <= int(name) <= len(AGENTS):
+      raise ValueError(f"no agent {target}")
+    return AGENTS[int(name) - 1]
+  if name not in AGENTS:
+    raise ValueError(f"unknown target {target}")
+  return name
+
+
+def build_command(payload: Dict[str, Any]) -> tuple[List[str], List[str]]:
+  # The codexdash argv for a /api/dispatch payload, and its targets; all
+  # comes back as no targets, i.e. every agent.
+  targets = payload.get("targets") or []
+  if not isinstance(targets, list):
+    targets = []
+  targets = [_target(str(t)) for t in targets]
+  if "all" in targets:
+    targets = []
+  cmd = [str(CODEXDASH_BIN), "send"]
+  cmd.extend(t if t.startswith("%") else f"@{t}" for t in targets)
+  if payload.get("parallel") is not None:
+    cmd.extend(["--parallel", str(int(bool(payload["parallel"])))])
+  if payload.get("wait") is not None:
+    cmd.extend(["--wait", str(int(bool(payload["wait"])))])
+  if payload.get("outdir"):
+    cmd.extend(["--outdir", str(payload["outdir"])])
+  if payload.get("prompt"):
+    cmd.extend(["--prompt", str(payload["prompt"])])
+  return cmd, targets
+
+
+class DispatchScheduler:
+  # Runs dispatches from a priority queue, at most DISPATCH_MAX at once and
+  # DISPATCH_PER_AGENT per target. In "tmux" mode the prompt is sent to the
+  # panes in process (TmuxDispatcher) and a dispatch holds its slots until
+  # the agents finish; in "exec" mode it runs codexdash as a subprocess,
+  # which is awaited (so reaped). Either way the outcome is recorded as a
+  # dispatch_done event through emit, i.e. the ingest pipeline.
+
+  def __init__(self, emit: Callable[[Dict[str, Any]], Awaitable[Any]], mode: str = DISPATCH_MODE) -> None:
+    self._emit = emit
+    self._mode = mode
+    self._tmux = TmuxDispatcher()
+    self._queue: List[_Dispatch] = []
+    self._running: Dict[str, _Dispatch] = {}
+    self._busy: Dict[str, int] = {}
+    self._recent: Deque[_Dispatch] = deque(maxlen=_RECENT)
+    self._seq = itertools.count()
+    self._wake = asyncio.Event()
+    self._tasks: set[asyncio.Task] = set()
+    self._closed = False
+    self._totals = {"submitted": 0, "started": 0, "succeeded": 0, "failed": 0}
+
+  def submit(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+    if len(self._queue) >= DISPATCH_QUEUE_SIZE:
+      raise DispatchQueueFull(f"dispatch queue is full ({DISPATCH_QUEUE_SIZE})")
+    _, targets = build_command(payload)
+    job_id = str(payload.get("job_id") or uuid.uuid4())
+    try:
+      priority = int(payload.get("priority") or 0)
+    except (TypeError, ValueError):
+      raise ValueError("priority must be an integer") from None
+    if self._mode == "tmux" and not str(payload.get("prompt") or "").strip():
+      raise ValueError("prompt is required")
+    item = _Dispatch(job_id, targets, payload, priority, next(self._seq))
+    heapq.heappush(self._queue, item)
+    self._totals["submitted"] += 1
+    self._wake.set()
+    return {"ok": True, **item.describe(), "status": "queued", "queued": len(self._queue)}
+
+  async def run(self) -> None:
+    while not self._closed:
+      await self._wake.wait()
+      self._wake.clear()
+      self._start_ready()
+
+  def _start_ready(self) -> None:
+    # Starts, in priority order, every queued dispatch whose targets all
+    # have a free slot; one blocked on a busy agent doesn't hold up others.
+    waiting: List[_Dispatch] = []
+    while self._queue and len(self._running) < DISPATCH_MAX:
+      item = heapq.heappop(self._queue)
+      if all(self._busy.get(slot, 0) < DISPATCH_PER_AGENT for slot in item.slots):
+        self._start(item)
+      else:
+        waiting.append(item)
+    for item in waiting:
+      heapq.heappush(self._queue, item)
+
+  def _start(self, item: _Dispatch) -> None:
+    for slot in item.slots:
+      self._busy[slot] = self._busy.get(slot, 0) + 1
+    self._running[item.id] = item
+    item.started_ts = _now_ms()
+    self._totals["started"] += 1
+    task = asyncio.create_task(self._execute(item))
+    self._tasks.add(task)
+    task.add_done_callback(self._tasks.discard)
+
+  def observe(self, event: Dict[str, Any]) -> None:
+    # Pane captures, for completion of in-process dispatches.
+    self._tmux.observe(event)
+
+  async def _execute(self, item: _Dispatch) -> None:
+    try:
+      if self._mode == "tmux":
+        await self._send(item)
+      else:
+        await self._exec(item)
+    finally:
+      item.finished_ts = _now_ms()
+      self._running.pop(item.id, None)
+      for slot in item.slots:
+        self._busy[slot] -= 1
+      self._recent.append(item)
+      self._wake.set()
+    self._totals["failed" if item.status in ("error", "timeout") else "succeeded"] += 1
+    if not item.reported:
+      item.reported = True
+      await self._emit(self._done_event(item))
+
+  async def _send(self, item: _Dispatch) -> None:
+    try:
+      panes = await self._tmux.resolve(item.targets)
+    except TmuxDispatchError as exc:
+      item.status, item.error = "error", str(exc)
+      return
+    item.panes = {agent: {"pane_id": info["pane_id"]} for agent, info in panes.items()}
+    if len(panes) > 1:
+      # Fan-out: one child job per agent under the dispatch's job, each
+      # with its own [JOB:] marker so it completes (and is billed) alone.
+      item.children = {agent: str(uuid.uuid4()) for agent in panes}
+      item.needed = _needed(item.completion, item.quorum, len(panes))
+    # codexdash used to log this; it starts the job (and its children).
+    # Built off the loop: estimating the prompt's tokens can load the
+    # tokenizer and encode a long prompt.
+    await self._emit(await asyncio.to_thread(self._start_event, item, panes))
+    jobs = item.children or {agent: item.job_id for agent in panes}
+    on_done = partial(self._child_done, item) if item.children else None
+    try:
+      item.panes = await self._tmux.dispatch(jobs, panes, item.prompt, item.wait_s, item.outdir, on_done)
+    except (TmuxDispatchError, OSError) as exc:
+      item.status, item.error = "error", str(exc)
+    # Agents the completion policy did not see finish: timed out, or never
+    # sent. Without a wait nothing was expected of them, so the output
+    # decides as for a single agent.
+    unfinished = "error" if item.error else "timeout" if item.wait_s > 0 else None
+    for agent in item.children:
+      if agent not in item.agents_done:
+        await self._emit(self._child_event(item, agent, unfinished, _now_ms()))
+    if item.children and not item.reported:
+      # The policy was not met in time, which ends the parent as well.
+      item.status = unfinished
+    if item.status is None and not item.children:
+      if item.wait_s > 0 and all(p["completed"] for p in item.panes.values()):
+        item.status = "done"
+
+  async def _child_done(self, item: _Dispatch, agent: str, done_ts: Optional[int]) -> None:
+    done_ts = done_ts or _now_ms()
+    item.agents_done.append(agent)
+    await self._emit(self._child_event(item, agent, "done", done_ts))
+    if not item.reported and len(item.agents_done) >= (item.needed or 0):
+      # The aggregate signal: the parent is done as soon as its completion
+      # policy is met, while the dispatch goes on waiting for the rest.
+      item.status = "done"
+      item.reported = True
+      await self._emit(self._done_event(item, done_ts))
+
+  async def _exec(self, item: _Dispatch) -> None:
+    env = dict(os.environ)
+    env["CODEXDASH_JOB_ID"] = item.job_id
+    # Tells codexdash the scheduler records the exit (dispatch_done).
+    env["CODEXDASH_DISPATCH_ID"] = item.id
+    stderr = b""
+    try:
+      proc = await asyncio.create_subprocess_exec(
+        *item.cmd,
+        env=env,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+      )
+      item.pid = proc.pid
+      _, stderr = await proc.communicate()
+      item.exit_code = proc.returncode
+    except OSError as exc:
+      item.exit_code = 127
+      item.error = str(exc)
+    if item.exit_code != 0:
+      # A non-zero exit means the dispatch itself failed; success only
+      # means the prompt was delivered, so it leaves the job status alone.
+      item.status = "error"
+      if item.error is None:
+        item.error = stderr.decode("utf-8", errors="replace")[-_STDERR_TAIL:].strip() or None
+
+  def _start_event(self, item: _Dispatch, panes: Dict[str, dict]) -> Dict[str, Any]:
+    single = next(iter(panes.values())) if len(panes) == 1 else {}
+    event = {
+      "ts": item.started_ts,
+      "type": "dispatch",
+      "session": None,
+      "agent": next(iter(panes)) if len(panes) == 1 else None,
+      "pane_id": single.get("pane_id"),
+      "window_name": single.get("window_name"),
+      "job_id": item.job_id,
+      "prompt_text": item.prompt,
+      "output_path": item.outdir,
+      "output_bytes": None,
+      "model": None,
+      "targets": list(panes),
+      "children": item.children or None,
+      "completion": item.completion_label,
+      "dispatch_id": item.id,
+      "event_key": f"dispatch:{item.id}:start",
+    }
+    return enrich_output_event(normalize_event(event))
+
+  def _child_event(self, item: _Dispatch, agent: str, status: Optional[str], ts: int) -> Dict[str, Any]:
+    return {
+      "ts": ts,
+      "type": "dispatch_done",
+      "session": None,
+      "agent": agent,
+      "pane_id": (item.panes or {}).get(agent, {}).get("pane_id"),
+      "window_name": None,
+      "job_id": item.children[agent],
+      "parent_job_id": item.job_id,
+      "status": status,
+      "error": item.error if status == "error" else None,
+      "dispatch_id": item.id,
+      # This agent's own latency, from the dispatch starting; None when it
+      # was not waited for.
+      "run_ms": ts - (item.started_ts or ts) if status is not None else None,
+      "event_key": f"dispatch:{item.id}:done:{agent}",
+    }
+
+  def _done_event(self, item: _Dispatch, ts: Optional[int] = None) -> Dict[str, Any]:
+    ts = ts or item.finished_ts
+    return {
+      "ts": ts,
+      "type": "dispatch_done",
+      "session": None,
+      "agent": item.targets[0] if len(item.targets) == 1 else None,
+      "pane_id": None,
+      "window_name": None,
+      "job_id": item.job_id,
+      # "done" only when the agent was seen to finish (tmux mode), or for a
+      # fan-out when its completion policy was met ("timeout" when it was
+      # not in time); a single agent's timed-out wait leaves the job status
+      # to the output.
+      "status": item.status,
+      "exit_code": item.exit_code,
+      "error": item.error,
+      "panes": item.panes,
+      "completion": item.completion_label,
+      "agents_done": item.agents_done if item.children else None,
+      "dispatch_id": item.id,
+      "queued_ms": (item.started_ts or ts) - item.queued_ts,
+      # With wait=0 the dispatch ends once the prompt is handed over, which
+      # says nothing about how long the job runs.
+      "run_ms": ts - (item.started_ts or ts) if item.wait_s > 0 else None,
+      "event_key": f"dispatch:{item.id}:done",
+    }
+
+  async def close(self) -> None:
+    # Queued dispatches are abandoned. Running ones get a grace period to
+    # exit and be recorded; asyncio kills whatever is still running when
+    # the loop shuts down.
+    self._closed = True
+    self._wake.set()
+    if self._tasks:
+      _, pending = await asyncio.wait(set(self._tasks), timeout=_SHUTDOWN_GRACE_S)
+      for task in pending:
+        task.cancel()
+
+  def status(self) -> Dict[str, Any]:
+    return {
+      "mode": self._mode,
+      "limits": {"max": DISPATCH_MAX, "per_agent": DISPATCH_PER_AGENT, "queue": DISPATCH_QUEUE_SIZE},
+      "busy": {slot: n for slot, n in self._busy.items() if n},
+      "queued": [item.describe() for item in sorted(self._queue)],
+      "running": [item.describe() for item in self._running.values()],
+      "recent": [item.describe() for item in reversed(self._recent)],
+      "totals": dict(self._totals),
+      "waiting_on_panes": self._tmux.status(),
+    }
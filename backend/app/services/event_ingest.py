@@ -1,68 +1,51 @@
 from __future__ import annotations
 
 import asyncio
-import hashlib
-import json
-import re
+import os
 import time
-from pathlib import Path
 from typing import Any, Dict, Optional
 
+from .agent_health import AUTH_TAIL_LINES, AgentHealth
+from .blob_store import store_text, text_hash
+from .file_watch import FileWatch
+from .job_cache import job_cache
+from .ndjson_reader import hash_range, parse_record, read_records
+from .output_scan import scan_output
+from .pane_delta import PaneDeltaTracker
 from .token_estimate import estimate_tokens
-from .tmux_probe import AGENTS, capture_pane, detect_auth_needed, map_agents
-from ..config import EVENTS_PATH, TAIL_INTERVAL_MS, MAX_EVENT_LINE
-from ..db import insert_event, upsert_agent, upsert_job, fetch_one
-
-TOKEN_REGEX = re.compile(r"(prompt|completion|total)\s*tokens\s*[:=]\s*(\d+)", re.I)
-MODEL_REGEX = re.compile(r"model\s*[:=]\s*([\w\-\.]+)", re.I)
-SUB_AGENT_REGEX = re.compile(r"(sub-?agent|tool|thread)\s*[:#]\s*([\w\-\.]+)", re.I)
-JOB_REGEX = re.compile(r"\[JOB:([a-f0-9\\-]{8,})\]", re.I)
-DONE_REGEX = re.compile(r"\b(done|completed|success|finished)\b", re.I)
-ERROR_REGEX = re.compile(r"\b(error|failed|traceback|exception)\b", re.I)
-
-
-def _hash_text(text: str) -> str:
-  return hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
-
-
-def parse_tokens(text: str) -> dict[str, Optional[int]]:
-  found = {"prompt": None, "completion": None, "total": None}
-  for key, val in TOKEN_REGEX.findall(text):
-    found[key.lower()] = int(val)
-  return found
-
-
-def detect_model(text: str) -> Optional[str]:
-  match = MODEL_REGEX.search(text)
-  return match.group(1) if match else None
-
-
-def detect_subagent(text: str) -> Optional[str]:
-  match = SUB_AGENT_REGEX.search(text)
-  if match:
-    return match.group(2)
-  return None
-
-
-def classify_status(text: str) -> Optional[str]:
-  if not text:
-    return None
-  if ERROR_REGEX.search(text):
-    return "error"
-  if detect_auth_needed(text):
-    return "blocked"
-  if DONE_REGEX.search(text):
-    return "done"
-  return None
+from .token_rollup import TokenRollup
+from .tmux_control import TmuxControlClient
+from .tmux_probe import (
+  capture_panes,
+  detect_session,
+  invalidate_agent_map,
+  map_agents,
+  set_control_client,
+)
+from ..config import (
+  CAPTURE_LINES,
+  CAPTURE_MODE,
+  CONTROL_IDLE_MS,
+  CONTROL_RETRY_MS,
+  EVENTS_PATH,
+  MAX_EVENT_LINE,
+  TAIL_INTERVAL_MS,
+  TAIL_MODE,
+  TMUX_CONTROL,
+)
+from ..db import insert_event, load_tail_state, save_tail_state, upsert_agent, write_batch
+
+# Private key on the last event of a Tailer read carrying the log position
+# after it; persist_events stores it with the events and strips it.
+TAIL_CHECKPOINT = "_tail_checkpoint"
 
 
 def normalize_event(event: Dict[str, Any]) -> Dict[str, Any]:
+  # The prompt is kept whatever its size: persist_events stores it once in
+  # blobs under prompt_hash, and only the hash goes in the row.
   prompt_text = event.get("prompt_text") or ""
-  if prompt_text and len(prompt_text) > 10000:
-    event["prompt_hash"] = _hash_text(prompt_text)
-    event["prompt_text"] = None
-  elif prompt_text:
-    event["prompt_hash"] = _hash_text(prompt_text)
+  if prompt_text:
+    event["prompt_hash"] = text_hash(prompt_text)
 
   if "prompt_bytes" not in event or event.get("prompt_bytes") is None:
     event["prompt_bytes"] = len(prompt_text.encode("utf-8")) if prompt_text else 0
@@ -81,6 +64,10 @@ def update_job_from_event(event: Dict[str, Any]) -> None:
     status = "running"
   if status is None and event.get("type") in {"pane_output", "controller_output"}:
     status = "running"
+  if status is None and event.get("type") == "dispatch_done":
+    # The dispatch ended without an outcome of its own (no wait, or it timed
+    # out): the status stays whatever the output made it.
+    status = job_cache.get(job_id).get("status")
 
   tokens_exact = {
     "prompt": event.get("prompt_tokens_exact"),
@@ -101,7 +88,8 @@ def update_job_from_event(event: Dict[str, Any]) -> None:
     "started_ts": event.get("ts") if event.get("type") == "dispatch" else None,
     "updated_ts": now,
     "duration_ms": None,
-    "prompt_text": event.get("prompt_text"),
+    # The prompt itself lives in blobs under prompt_hash.
+    "prompt_text": None,
     "prompt_hash": event.get("prompt_hash"),
     "prompt_bytes": event.get("prompt_bytes"),
     "output_path": event.get("output_path"),
@@ -113,14 +101,28 @@ def update_job_from_event(event: Dict[str, Any]) -> None:
     "prompt_tokens_est": tokens_est.get("prompt"),
     "completion_tokens_est": tokens_est.get("completion"),
     "total_tokens_est": tokens_est.get("total"),
+    "parent_job_id": event.get("parent_job_id"),
+    "completion": event.get("completion"),
+    "children": len(event["children"]) if event.get("children") else None,
   }
 
-  existing = fetch_one("SELECT started_ts FROM jobs WHERE job_id = ?", (job_id,))
-  started_ts = existing.get("started_ts") if existing else None
-  if started_ts and status in {"done", "error", "blocked"}:
+  started_ts = job_cache.get(job_id).get("started_ts")
+  if started_ts and status in {"done", "error", "blocked", "timeout"}:
     job["duration_ms"] = now - int(started_ts)
 
-  upsert_job(job)
+  job_cache.apply(job)
+  if event.get("type") == "dispatch" and event.get("children"):
+    # A fan-out dispatch creates one child job per agent along with the
+    # parent; they reach SQLite in the same job cache flush.
+    for child_agent, child_id in event["children"].items():
+      job_cache.apply({
+        **job,
+        "job_id": child_id,
+        "agent": child_agent,
+        "parent_job_id": job_id,
+        "completion": None,
+        "children": None,
+      })
 
   agent = {
     "agent": event.get("agent"),
@@ -135,22 +137,71 @@ def update_job_from_event(event: Dict[str, Any]) -> None:
     upsert_agent(agent)
 
 
+def persist_events(events: list[Dict[str, Any]]) -> list[Dict[str, Any]]:
+  # Returns the events that were actually stored, i.e. not replays. If it
+  # raises, nothing was kept, in SQLite or the job cache, and events are left
+  # as they came so the batch can be tried again.
+  stored: list[Dict[str, Any]] = []
+  checkpoint = None
+  carriers: list[tuple[Dict[str, Any], Dict[str, Any]]] = []
+  rollup = TokenRollup()
+  try:
+    with job_cache.transaction(), write_batch():
+      for event in events:
+        carried = event.pop(TAIL_CHECKPOINT, None)
+        if carried is not None:
+          checkpoint = carried
+          carriers.append((event, carried))
+        if event.get("text"):
+          event["text_hash"] = store_text(event["text"])
+        if event.get("prompt_text"):
+          store_text(event["prompt_text"], event.get("prompt_hash"))
+        if not insert_event(event):
+          # Replayed from the log after a restart; already accounted for.
+          continue
+        stored.append(event)
+        rollup.add(event)
+        update_job_from_event(event)
+        if event.get("type") == "pane_output" and event.get("auth_needed"):
+          upsert_agent({
+            "agent": event.get("agent"),
+            "status": "blocked",
+            "last_seen": event.get("ts"),
+            "pane_id": event.get("pane_id"),
+            "window_name": event.get("window_name"),
+            "session": None,
+            "model": event.get("model"),
+          })
+      rollup.flush()
+      if checkpoint is not None:
+        # The checkpoint promises everything before it is fully applied, so
+        # the job state those events produced commits with it.
+        save_tail_state(checkpoint)
+        job_cache.flush()
+      elif job_cache.flush_due():
+        job_cache.flush()
+  except Exception:
+    for event, carried in carriers:
+      event[TAIL_CHECKPOINT] = carried
+    raise
+  return stored
+
+
 def enrich_output_event(event: Dict[str, Any]) -> Dict[str, Any]:
   text = event.get("text", "")
-  if not event.get("job_id") and text:
-    match = JOB_REGEX.search(text)
-    if match:
-      event["job_id"] = match.group(1)
-  tokens = parse_tokens(text)
-  event["prompt_tokens_exact"] = tokens.get("prompt")
-  event["completion_tokens_exact"] = tokens.get("completion")
-  event["total_tokens_exact"] = tokens.get("total")
+  scan = scan_output(text)
+  if not event.get("job_id") and scan.job_id:
+    event["job_id"] = scan.job_id
+  event["prompt_tokens_exact"] = scan.tokens.get("prompt")
+  event["completion_tokens_exact"] = scan.tokens.get("completion")
+  event["total_tokens_exact"] = scan.tokens.get("total")
   if not event.get("model"):
-    event["model"] = detect_model(text)
+    event["model"] = scan.model
 
-  status = classify_status(text)
-  if status:
-    event["status"] = status
+  if scan.status:
+    event["status"] = scan.status
+  if scan.auth_needed:
+    event["auth_needed"] = True
 
   if event.get("prompt_text"):
     event["prompt_tokens_est"] = estimate_tokens(event["prompt_text"])
@@ -160,47 +211,130 @@ def enrich_output_event(event: Dict[str, Any]) -> Dict[str, Any]:
     if event.get("prompt_tokens_est") is not None:
       event["total_tokens_est"] = event["prompt_tokens_est"] + event["completion_tokens_est"]
 
-  sub_agent = detect_subagent(text)
-  if sub_agent:
-    event["sub_agent"] = sub_agent
+  if scan.sub_agent:
+    event["sub_agent"] = scan.sub_agent
 
   return event
 
 
+def _same_line(f, start: int, end: int, line_hash: Optional[str]) -> bool:
+  # Whether the line the read position sits after is still the one we read.
+  if line_hash is None:
+    return True
+  return hash_range(f, start, end) == line_hash
+
+
 class Tailer:
-  def __init__(self) -> None:
+  # Follows events.ndjson. The read position is checkpointed in tail_state in
+  # the same transaction as the events read up to it (see persist_events), so
+  # a restart resumes where the last commit left off instead of at byte 0.
+
+  def __init__(self, mode: str = TAIL_MODE) -> None:
+    self._mode = mode
+    self._watch: Optional[FileWatch] = None
     self._offset = 0
+    self._inode: Optional[int] = None
+    self._line_start = 0
+    self._line_hash: Optional[str] = None
+    self._resumed = False
 
   async def run(self, on_event) -> None:
     EVENTS_PATH.parent.mkdir(parents=True, exist_ok=True)
     EVENTS_PATH.touch(exist_ok=True)
+    await asyncio.to_thread(self._resume)
+    if self._mode != "poll":
+      self._watch = FileWatch(EVENTS_PATH)
+      if not self._watch.start():
+        self._watch = None
     while True:
+      if self._watch is not None:
+        # Cleared before reading, so writes that land during the read
+        # wake the next wait instead of being missed.
+        self._watch.changed.clear()
       events = await asyncio.to_thread(self._process_events)
       for event in events:
         await on_event(event)
-      await asyncio.sleep(TAIL_INTERVAL_MS / 1000.0)
+      await self._wait()
+
+  async def _wait(self) -> None:
+    if self._watch is not None and self._watch.active:
+      # Idle until the file is written to or replaced: no reads at all.
+      await self._watch.changed.wait()
+      return
+    await asyncio.sleep(TAIL_INTERVAL_MS / 1000.0)
+
+  def close(self) -> None:
+    if self._watch is not None:
+      self._watch.close()
+      self._watch = None
+
+  def _resume(self) -> None:
+    # Trust the checkpoint only if it still describes this file: same inode,
+    # long enough, and the line it ends on hashes the same. Anything else
+    # means the log was rotated or rewritten; start over and let the event
+    # keys drop whatever was already stored.
+    if self._resumed:
+      return
+    self._resumed = True
+    state = load_tail_state(str(EVENTS_PATH))
+    if not state:
+      return
+    try:
+      st = EVENTS_PATH.stat()
+      if st.st_ino != state["inode"] or st.st_size < state["offset"]:
+        return
+      with EVENTS_PATH.open("rb") as f:
+        if not _same_line(f, state["line_start"], state["offset"], state["line_hash"]):
+          return
+    except (OSError, TypeError):
+      return
+    self._inode = state["inode"]
+    self._offset = state["offset"]
+    self._line_start = state["line_start"]
+    self._line_hash = state["line_hash"]
+
+  def _checkpoint(self) -> Dict[str, Any]:
+    return {
+      "path": str(EVENTS_PATH),
+      "inode": self._inode,
+      "offset": self._offset,
+      "line_start": self._line_start,
+      "line_hash": self._line_hash,
+    }
 
   def _process_events(self) -> list[Dict[str, Any]]:
     if not EVENTS_PATH.exists():
       return []
     processed: list[Dict[str, Any]] = []
-    with EVENTS_PATH.open("r", encoding="utf-8", errors="ignore") as f:
-      f.seek(self._offset)
-      for line in f:
-        if not line.strip():
-          continue
-        if len(line) > MAX_EVENT_LINE:
+    with EVENTS_PATH.open("rb") as f:
+      st = os.fstat(f.fileno())
+      if (
+        st.st_ino != self._inode
+        or st.st_size < self._offset
+        or (st.st_size > self._offset and not _same_line(f, self._line_start, self._offset, self._line_hash))
+      ):
+        # Rotated (new inode), or truncated/rewritten in place (copytruncate).
+        self._inode = st.st_ino
+        self._offset = 0
+        self._line_start = 0
+        self._line_hash = None
+      for record in read_records(f, self._offset, MAX_EVENT_LINE):
+        self._offset = record.end
+        self._line_start = record.start
+        self._line_hash = record.digest
+        if record.data is None or not record.data.strip():
           continue
-        try:
-          event = json.loads(line)
-        except json.JSONDecodeError:
+        event = parse_record(record.data)
+        if not isinstance(event, dict):
           continue
+        # Same line at the same position is the same event, whichever file
+        # generation or process lifetime it is read in.
+        event["event_key"] = f"log:{record.start}:{record.digest}"
         event = normalize_event(event)
         event = enrich_output_event(event)
-        insert_event(event)
-        update_job_from_event(event)
         processed.append(event)
-      self._offset = f.tell()
+    if processed:
+      processed[-1][TAIL_CHECKPOINT] = self._checkpoint()
     return processed
 
 
@@ -208,31 +342,85 @@ class TmuxWatcher:
   def __init__(self) -> None:
     self._last_seen: dict[str, int] = {}
     self._last_text: dict[str, str] = {}
+    self._deltas = PaneDeltaTracker()
+    self._control = TmuxControlClient() if TMUX_CONTROL else None
+    # Per-agent health from the same captures, for /api/doctor.
+    self.health = AgentHealth()
+    self._control_retry_at = 0.0
+    self._layout_version = 0
 
   async def run(self, on_event) -> None:
+    only: Optional[set[str]] = None
     while True:
-      events = await asyncio.to_thread(self._poll)
+      await self._ensure_control()
+      events = await asyncio.to_thread(self._poll, only)
       for event in events:
         await on_event(event)
+      only = await self._wait()
+
+  async def close(self) -> None:
+    if self._control is not None:
+      set_control_client(None)
+      await self._control.close()
+
+  async def _ensure_control(self) -> None:
+    control = self._control
+    if control is None or control.connected:
+      return
+    now = time.monotonic()
+    if now < self._control_retry_at:
+      return
+    self._control_retry_at = now + CONTROL_RETRY_MS / 1000.0
+    if await control.start(detect_session()):
+      set_control_client(control)
+      self._layout_version = control.layout_version
+
+  async def _wait(self) -> Optional[set[str]]:
+    # Returns the panes to capture next, or None for all of them. Without a
+    # control client this is plain interval polling; with one, %output
+    # notifications wake us as soon as a watched pane writes.
+    control = self._control
+    if control is None or not control.connected:
       await asyncio.sleep(TAIL_INTERVAL_MS / 1000.0)
-
-  def _poll(self) -> list[Dict[str, Any]]:
+      return None
+    try:
+      await asyncio.wait_for(control.changed.wait(), CONTROL_IDLE_MS / 1000.0)
+    except asyncio.TimeoutError:
+      return None
+    # Let a burst of output land before capturing it.
+    await asyncio.sleep(0.02)
+    dirty = control.take_dirty()
+    if not control.connected or control.layout_version != self._layout_version:
+      # tmux reported a layout change: re-resolve agent panes right away.
+      self._layout_version = control.layout_version
+      invalidate_agent_map()
+      return None
+    return dirty
+
+  def _poll(self, only: Optional[set[str]] = None) -> list[Dict[str, Any]]:
     mapping = map_agents()
     now = int(time.time() * 1000)
     emitted: list[Dict[str, Any]] = []
-    for agent, info in mapping.items():
-      pane_id = info.get("pane_id")
-      if not pane_id:
-        continue
-      text = capture_pane(pane_id, lines=2000)
-      if not text:
-        continue
-      prev = self._last_text.get(pane_id, "")
-      if text == prev:
-        continue
-      self._last_text[pane_id] = text
-      new_text = text[len(prev):] if text.startswith(prev) else text
-      new_text = new_text.strip("\n")
+    self._deltas.retain(info.get("pane_id") for info in mapping.values())
+    if self._control is not None:
+      self._control.watch(info.get("pane_id") for info in mapping.values())
+    targets = {
+      agent: info
+      for agent, info in mapping.items()
+      if info.get("pane_id") and (only is None or info["pane_id"] in only)
+    }
+    pane_ids = [info["pane_id"] for info in targets.values()]
+    started = time.perf_counter()
+    if CAPTURE_MODE == "delta":
+      new_texts = self._capture_delta(pane_ids)
+    else:
+      new_texts = self._capture_full(pane_ids)
+    latency_ms = (time.perf_counter() - started) * 1000
+    tails = {pane_id: self._tail(pane_id) if pane_id in new_texts else None for pane_id in pane_ids}
+    self.health.record(mapping, tails, new_texts, latency_ms, now)
+    for agent, info in targets.items():
+      pane_id = info["pane_id"]
+      new_text = new_texts.get(pane_id)
       if not new_text:
         continue
       event = {
@@ -245,19 +433,41 @@ class TmuxWatcher:
         "job_id": None,
         "text": new_text,
       }
-      event = enrich_output_event(event)
-      insert_event(event)
-      update_job_from_event(event)
-      emitted.append(event)
-
-      if detect_auth_needed(new_text):
-        upsert_agent({
-          "agent": agent,
-          "status": "blocked",
-          "last_seen": now,
-          "pane_id": pane_id,
-          "window_name": info.get("window_name"),
-          "session": None,
-          "model": event.get("model"),
-        })
+      emitted.append(enrich_output_event(event))
     return emitted
+
+  def _tail(self, pane_id: str) -> str:
+    if CAPTURE_MODE == "delta":
+      return self._deltas.tail(pane_id, AUTH_TAIL_LINES) or ""
+    return "\n".join(self._last_text.get(pane_id, "").split("\n")[-AUTH_TAIL_LINES:])
+
+  def _capture_full(self, pane_ids: list[str]) -> Dict[str, str]:
+    # Every pane captured gets an entry, "" when nothing changed.
+    new_texts: Dict[str, str] = {}
+    for pane_id, capture in capture_panes(pane_ids, lines=CAPTURE_LINES).items():
+      text = capture["text"].strip()
+      new_texts[pane_id] = ""
+      if not text:
+        continue
+      prev = self._last_text.get(pane_id, "")
+      if text == prev:
+        continue
+      self._last_text[pane_id] = text
+      new_text = text[len(prev):] if text.startswith(prev) else text
+      new_texts[pane_id] = new_text.strip("\n")
+    return new_texts
+
+  def _capture_delta(self, pane_ids: list[str]) -> Dict[str, str]:
+    starts = {pane_id: self._deltas.window(pane_id) for pane_id in pane_ids}
+    new_texts: Dict[str, str] = {}
+    resync: list[str] = []
+    for pane_id, capture in capture_panes(pane_ids, starts=starts).items():
+      start = starts[pane_id]
+      new_text = self._deltas.update(pane_id, capture, start, capture["text"], final=start <= -CAPTURE_LINES)
+      if new_text is None:
+        resync.append(pane_id)
+      else:
+        new_texts[pane_id] = new_text
+    for pane_id, capture in capture_panes(resync, lines=CAPTURE_LINES).items():
+      new_texts[pane_id] = self._deltas.update(pane_id, capture, -CAPTURE_LINES, capture["text"], final=True) or ""
+    return new_texts
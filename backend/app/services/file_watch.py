@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+from pathlib import Path
+from typing import Optional
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT = struct.Struct("iIII")
+
+# The file itself reports appends and truncation; its directory reports the
+# file being replaced (rotation, delete, recreate), which needs a new watch.
+_FILE_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE
+_DIR_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+
+
+class FileWatch:
+  # Wakes `changed` when a single file is written to or replaced, using Linux
+  # inotify through libc so there is no extra dependency. start() returns
+  # False where inotify isn't available and callers should poll instead.
+
+  def __init__(self, path: Path) -> None:
+    self._path = path
+    self._name = os.fsencode(path.name)
+    self._libc = None
+    self._fd: Optional[int] = None
+    self._file_wd: Optional[int] = None
+    self._loop: Optional[asyncio.AbstractEventLoop] = None
+    self.changed = asyncio.Event()
+
+  @property
+  def active(self) -> bool:
+    return self._fd is not None
+
+  def start(self) -> bool:
+    try:
+      libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+      init = libc.inotify_init1
+    except (OSError, AttributeError):
+      return False
+    fd = init(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+      return False
+    self._libc = libc
+    self._fd = fd
+    if self._add_watch(self._path.parent, _DIR_MASK) < 0:
+      self.close()
+      return False
+    self._watch_file()
+    self._loop = asyncio.get_running_loop()
+    self._loop.add_reader(fd, self._on_readable)
+    return True
+
+  def close(self) -> None:
+    fd, self._fd = self._fd, None
+    if fd is None:
+      return
+    if self._loop is not None:
+      self._loop.remove_reader(fd)
+    os.close(fd)
+
+  def _add_watch(self, path: Path, mask: int) -> int:
+    return self._libc.inotify_add_watch(self._fd, os.fsencode(str(path)), mask)
+
+  def _watch_file(self) -> None:
+    # Adding a watch for an inode that is already watched returns the same
+    # descriptor, so this is safe to repeat whenever the directory changes.
+    wd = self._add_watch(self._path, _FILE_MASK)
+    if self._file_wd is not None and wd != self._file_wd:
+      # The old inode was rotated away; stop following it.
+      self._libc.inotify_rm_watch(self._fd, self._file_wd)
+    self._file_wd = wd if wd >= 0 else None
+
+  def _on_readable(self) -> None:
+    wake = False
+    while True:
+      try:
+        data = os.read(self._fd, 64 * 1024)
+      except (BlockingIOError, InterruptedError):
+        break
+      except OSError:
+        self.close()
+        wake = True
+        break
+      if not data:
+        break
+      pos = 0
+      while pos + _EVENT.size <= len(data):
+        wd, mask, _, length = _EVENT.unpack_from(data, pos)
+        name = data[pos + _EVENT.size:pos + _EVENT.size + length].rstrip(b"\0")
+        pos += _EVENT.size + length
+        if mask & IN_Q_OVERFLOW:
+          wake = True
+        elif wd == self._file_wd:
+          wake = True
+        elif name == self._name:
+          self._watch_file()
+          wake = True
+    if wake:
+      self.changed.set()
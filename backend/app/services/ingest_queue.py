@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .event_ingest import persist_events
+from .job_cache import job_cache
+from ..config import (
+  INGEST_BATCH_SIZE,
+  INGEST_FLUSH_MS,
+  INGEST_OFFER_TIMEOUT_MS,
+  INGEST_QUEUE_SIZE,
+  INGEST_RETRY_MS,
+  JOB_FLUSH_MS,
+)
+
+# Tries a failed batch of live captures only gets before it is dropped, and
+# the longest wait between tries of any batch.
+_LOSSY_ATTEMPTS = 3
+_RETRY_MAX_S = 10.0
+
+
+class IngestPipeline:
+  # Producers (Tailer, TmuxWatcher) push parsed events onto a bounded queue;
+  # a single writer task drains it in batches, commits each batch in one
+  # transaction and only then hands the events to on_commit (the broadcaster).
+
+  def __init__(self, on_commit: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+    self._on_commit = on_commit
+    self._queue: asyncio.Queue[Dict[str, Any]] = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+    self._max_depth = 0
+    self._batches = 0
+    self._events = 0
+    self._dropped = 0
+    self._replayed = 0
+    self._errors = 0
+    self._retries = 0
+    self._last_batch_size = 0
+    self._last_flush_ms = 0.0
+    self._max_flush_ms = 0.0
+    self._total_flush_ms = 0.0
+    self._last_flush_ts: int | None = None
+    # Event log lines, from the writer's ts to the end of their broadcast.
+    self._log_events = 0
+    self._last_log_latency_ms = 0
+    self._max_log_latency_ms = 0
+    self._total_log_latency_ms = 0
+
+  async def put(self, event: Dict[str, Any]) -> None:
+    # Lossless: waits for room. Used for the event log, whose reader simply
+    # stops advancing while ingest is behind.
+    await self._queue.put(event)
+    self._track_depth()
+
+  async def offer(self, event: Dict[str, Any]) -> bool:
+    # Lossy: waits briefly for room, then drops. Used for live pane captures
+    # so a stalled writer can't back up the tmux poll loop indefinitely.
+    try:
+      self._queue.put_nowait(event)
+    except asyncio.QueueFull:
+      try:
+        await asyncio.wait_for(self._queue.put(event), INGEST_OFFER_TIMEOUT_MS / 1000.0)
+      except asyncio.TimeoutError:
+        self._dropped += 1
+        return False
+    self._track_depth()
+    return True
+
+  def _track_depth(self) -> None:
+    depth = self._queue.qsize()
+    if depth > self._max_depth:
+      self._max_depth = depth
+
+  async def run(self) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+      try:
+        first = await asyncio.wait_for(self._queue.get(), JOB_FLUSH_MS / 1000.0)
+      except asyncio.TimeoutError:
+        # Idle: write back job state merged in memory since the last flush.
+        if job_cache.pending():
+          await self._flush_jobs()
+        continue
+      batch = [first]
+      deadline = loop.time() + INGEST_FLUSH_MS / 1000.0
+      while len(batch) < INGEST_BATCH_SIZE:
+        try:
+          batch.append(self._queue.get_nowait())
+          continue
+        except asyncio.QueueEmpty:
+          pass
+        # A lone event on an idle queue goes out at once; only a burst
+        # already in progress is worth waiting on to fill the batch.
+        remaining = deadline - loop.time()
+        if remaining <= 0 or len(batch) == 1:
+          break
+        try:
+          batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+        except asyncio.TimeoutError:
+          break
+      await self._flush(batch)
+
+  async def drain(self) -> None:
+    batch: list[Dict[str, Any]] = []
+    while True:
+      try:
+        batch.append(self._queue.get_nowait())
+      except asyncio.QueueEmpty:
+        break
+    if batch:
+      # Shutting down: log lines that still fail are read again next start.
+      await self._flush(batch, draining=True)
+    await self._flush_jobs()
+
+  async def _flush_jobs(self) -> None:
+    try:
+      await asyncio.to_thread(job_cache.flush)
+    except Exception:
+      self._errors += 1
+
+  async def _flush(self, batch: list[Dict[str, Any]], draining: bool = False) -> None:
+    started = time.perf_counter()
+    stored = await self._persist(batch, draining)
+    if stored is None:
+      return
+    elapsed_ms = (time.perf_counter() - started) * 1000.0
+    self._batches += 1
+    self._events += len(batch)
+    self._last_batch_size = len(batch)
+    self._last_flush_ms = elapsed_ms
+    self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+    self._total_flush_ms += elapsed_ms
+    self._last_flush_ts = int(time.time() * 1000)
+    self._replayed += len(batch) - len(stored)
+    for event in stored:
+      await self._on_commit(event)
+      if event.get("event_key") and isinstance(event.get("ts"), int):
+        self._track_log_latency(int(time.time() * 1000) - event["ts"])
+
+  async def _persist(self, batch: list[Dict[str, Any]], draining: bool) -> Optional[list[Dict[str, Any]]]:
+    # A failed batch left nothing behind, so it is simply tried again.
+    # Batches with keyed events (log lines, dispatches) are retried until
+    # they commit: the tail checkpoint must not move past them, and the
+    # Tailer waits on the full queue meanwhile. Live captures alone are lossy
+    # anyway and are dropped after a few tries.
+    keep = not draining and any(event.get("event_key") for event in batch)
+    delay = INGEST_RETRY_MS / 1000.0
+    attempts = 0
+    while True:
+      try:
+        return await asyncio.to_thread(persist_events, batch)
+      except Exception:
+        self._errors += 1
+        attempts += 1
+      if not keep and attempts >= _LOSSY_ATTEMPTS:
+        self._dropped += len(batch)
+        return None
+      self._retries += 1
+      await asyncio.sleep(delay)
+      delay = min(delay * 2, _RETRY_MAX_S)
+
+  def _track_log_latency(self, latency_ms: int) -> None:
+    self._log_events += 1
+    self._last_log_latency_ms = latency_ms
+    self._max_log_latency_ms = max(self._max_log_latency_ms, latency_ms)
+    self._total_log_latency_ms += latency_ms
+
+  def metrics(self) -> Dict[str, Any]:
+    return {
+      "queue_depth": self._queue.qsize(),
+      "queue_capacity": INGEST_QUEUE_SIZE,
+      "max_depth": self._max_depth,
+      "batches": self._batches,
+      "events": self._events,
+      "dropped": self._dropped,
+      "replayed": self._replayed,
+      "errors": self._errors,
+      "retries": self._retries,
+      "last_batch_size": self._last_batch_size,
+      "last_flush_ms": round(self._last_flush_ms, 3),
+      "max_flush_ms": round(self._max_flush_ms, 3),
+      "avg_flush_ms": round(self._total_flush_ms / self._batches, 3) if self._batches else 0.0,
+      "last_flush_ts": self._last_flush_ts,
+      "log_events": self._log_events,
+      "last_log_latency_ms": self._last_log_latency_ms,
+      "max_log_latency_ms": self._max_log_latency_ms,
+      "avg_log_latency_ms": round(self._total_log_latency_ms / self._log_events, 3) if self._log_events else 0.0,
+    }
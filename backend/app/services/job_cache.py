@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from ..config import JOB_CACHE_SIZE, JOB_FLUSH_MS
+from ..db import JOB_COLUMNS, fetch_all, fetch_one, write_batch, write_job_changes
+
+# Same merge rules as db.upsert_job: these follow the latest event, every
+# other column keeps the first non-null value it sees.
+_LATEST_WINS = {"agent", "status", "updated_ts", "duration_ms"}
+# Each output event estimates only its own chunk, so the job keeps a running
+# sum rather than re-tokenizing its transcript; the total follows from it.
+_ACCUMULATE = {"completion_tokens_est"}
+_DERIVED = {"total_tokens_est"}
+
+
+class JobStateCache:
+  # LRU-bounded in-process copy of the jobs table. Events are merged in memory
+  # and only the columns that actually changed are written back on flush().
+
+  def __init__(self, capacity: int = JOB_CACHE_SIZE) -> None:
+    self._capacity = capacity
+    self._jobs: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+    self._dirty: Dict[str, Dict[str, Any]] = {}
+    self._lock = threading.Lock()
+    self._last_flush = time.monotonic()
+    # State of each job before its first change in the open transaction().
+    self._undo: Optional[Dict[str, Dict[str, Any]]] = None
+
+  def warm(self) -> None:
+    rows = fetch_all("SELECT * FROM jobs ORDER BY updated_ts DESC LIMIT ?", (self._capacity,))
+    with self._lock:
+      for row in reversed(rows):
+        self._remember(row["job_id"], row)
+
+  def clear(self) -> None:
+    with self._lock:
+      self._jobs.clear()
+      self._dirty.clear()
+
+  def get(self, job_id: str) -> Dict[str, Any]:
+    with self._lock:
+      return dict(self._state(job_id))
+
+  def apply(self, job: Dict[str, Any]) -> Dict[str, Any]:
+    job_id = job["job_id"]
+    with self._lock:
+      state = self._state(job_id)
+      changes: Dict[str, Any] = {}
+      for col in JOB_COLUMNS:
+        val = job.get(col)
+        if col in _DERIVED:
+          continue
+        if col in _ACCUMULATE:
+          if val:
+            changes[col] = (state.get(col) or 0) + val
+        elif col in _LATEST_WINS:
+          if val != state.get(col):
+            changes[col] = val
+        elif state.get(col) is None and val is not None:
+          changes[col] = val
+      prompt_est = changes.get("prompt_tokens_est", state.get("prompt_tokens_est"))
+      completion_est = changes.get("completion_tokens_est", state.get("completion_tokens_est"))
+      if prompt_est is not None and completion_est is not None:
+        total_est = prompt_est + completion_est
+        if total_est != state.get("total_tokens_est"):
+          changes["total_tokens_est"] = total_est
+      if changes:
+        if self._undo is not None and job_id not in self._undo:
+          self._undo[job_id] = dict(state)
+        state.update(changes)
+        self._dirty.setdefault(job_id, {}).update(changes)
+      return dict(state)
+
+  @contextmanager
+  def transaction(self) -> Iterator[None]:
+    # For a write batch that applies (and may flush) job changes: if the
+    # block raises, the batch rolled back, so merged state and pending
+    # changes go back to what they were before it.
+    with self._lock:
+      dirty = {job_id: dict(changes) for job_id, changes in self._dirty.items()}
+      self._undo = {}
+    try:
+      yield
+    except BaseException:
+      with self._lock:
+        for job_id, state in self._undo.items():
+          # An evicted job reloads from the rolled-back row plus _dirty.
+          if job_id in self._jobs:
+            self._jobs[job_id] = state
+        self._dirty = dirty
+      raise
+    finally:
+      self._undo = None
+
+  def _state(self, job_id: str) -> Dict[str, Any]:
+    state = self._jobs.get(job_id)
+    if state is not None:
+      self._jobs.move_to_end(job_id)
+      return state
+    row = fetch_one("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+    state = row or {"job_id": job_id, **{col: None for col in JOB_COLUMNS}}
+    # An evicted job may still have changes waiting for the next flush.
+    state.update(self._dirty.get(job_id, {}))
+    self._remember(job_id, state)
+    return state
+
+  def _remember(self, job_id: str, state: Dict[str, Any]) -> None:
+    self._jobs[job_id] = state
+    self._jobs.move_to_end(job_id)
+    while len(self._jobs) > self._capacity:
+      self._jobs.popitem(last=False)
+
+  def pending(self) -> int:
+    return len(self._dirty)
+
+  def flush_due(self) -> bool:
+    return bool(self._dirty) and (time.monotonic() - self._last_flush) * 1000 >= JOB_FLUSH_MS
+
+  def flush(self) -> int:
+    with self._lock:
+      dirty, self._dirty = self._dirty, {}
+      self._last_flush = time.monotonic()
+    if not dirty:
+      return 0
+    try:
+      with write_batch():
+        for job_id, changes in dirty.items():
+          write_job_changes(job_id, changes)
+    except Exception:
+      with self._lock:
+        for job_id, changes in dirty.items():
+          self._dirty[job_id] = {**changes, **self._dirty.get(job_id, {})}
+      raise
+    return len(dirty)
+
+
+job_cache = JobStateCache()
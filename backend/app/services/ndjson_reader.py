@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Any, BinaryIO, Iterator, NamedTuple, Optional
+
+try:
+  import orjson  # type: ignore
+except Exception:  # pragma: no cover
+  orjson = None
+
+# Bytes read per call; records are split out of these without copying the
+# rest of the file into memory.
+READ_CHUNK = 1 << 20
+
+
+class Record(NamedTuple):
+  start: int
+  end: int
+  # None when the record is longer than the limit; it was hashed while
+  # streaming past it but never held in memory as a whole.
+  data: Optional[bytes]
+  digest: str
+
+
+def _digest(hasher: Any) -> str:
+  return hasher.hexdigest()[:32]
+
+
+def record_hash(data: bytes) -> str:
+  return _digest(hashlib.sha256(data))
+
+
+def hash_range(f: BinaryIO, start: int, end: int) -> str:
+  hasher = hashlib.sha256()
+  f.seek(start)
+  remaining = end - start
+  while remaining > 0:
+    chunk = f.read(min(READ_CHUNK, remaining))
+    if not chunk:
+      break
+    hasher.update(chunk)
+    remaining -= len(chunk)
+  return _digest(hasher)
+
+
+def _rfind_newline(f: BinaryIO, end: int) -> int:
+  pos = end
+  while pos > 0:
+    start = max(0, pos - READ_CHUNK)
+    f.seek(start)
+    at = f.read(pos - start).rfind(b"\n")
+    if at >= 0:
+      return start + at
+    pos = start
+  return -1
+
+
+def last_line(f: BinaryIO, size: int) -> Optional[tuple[int, int]]:
+  # Start and end of the last newline-terminated record before size, found
+  # by reading backwards from there; None when there is none.
+  nl = _rfind_newline(f, size)
+  if nl < 0:
+    return None
+  return _rfind_newline(f, nl) + 1, nl + 1
+
+
+def read_records(f: BinaryIO, offset: int, max_record: int) -> Iterator[Record]:
+  # Newline-terminated records from offset on. A trailing record without its
+  # newline is still being written and is not returned, so callers can
+  # advance their offset to the end of the last record they received.
+  f.seek(offset)
+  base = offset
+  buf = b""
+  skipping = None
+  while True:
+    chunk = f.read(READ_CHUNK)
+    if not chunk:
+      return
+    if skipping is not None:
+      nl = chunk.find(b"\n")
+      if nl < 0:
+        skipping.update(chunk)
+        base += len(chunk)
+        continue
+      skipping.update(chunk[:nl + 1])
+      end = base + nl + 1
+      yield Record(skip_start, end, None, _digest(skipping))
+      skipping = None
+      chunk = chunk[nl + 1:]
+      base = end
+    buf = buf + chunk if buf else chunk
+    pos = 0
+    while True:
+      nl = buf.find(b"\n", pos)
+      if nl < 0:
+        break
+      data = buf[pos:nl + 1]
+      yield Record(base + pos, base + nl + 1, data if len(data) <= max_record else None, record_hash(data))
+      pos = nl + 1
+    base += pos
+    buf = buf[pos:]
+    if len(buf) > max_record:
+      # Already too long to keep; hash the rest of it as it streams by.
+      skipping = hashlib.sha256(buf)
+      skip_start = base
+      base += len(buf)
+      buf = b""
+
+
+def parse_record(data: bytes) -> Optional[Any]:
+  if orjson is not None:
+    try:
+      return orjson.loads(data)
+    except ValueError:
+      pass
+  try:
+    return json.loads(data.decode("utf-8", errors="ignore"))
+  except ValueError:
+    return None
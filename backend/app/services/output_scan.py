@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import re
+from typing import Dict, Optional
+
+# Every keyword that can start a match of one of the patterns enrich_output_event
+# used to run as separate searches (TOKEN, MODEL, SUB_AGENT, JOB, DONE, ERROR
+# and the phrases from detect_auth_needed), mapped to what it signals.
+KEYWORDS = {
+  "prompt": "tokens",
+  "completion": "tokens",
+  "total": "tokens",
+  "model": "model",
+  "subagent": "sub",
+  "sub-agent": "sub",
+  "tool": "sub",
+  "thread": "sub",
+  "[job:": "job",
+  "error": "error",
+  "failed": "error",
+  "traceback": "error",
+  "exception": "error",
+  "done": "done",
+  "completed": "done",
+  "success": "done",
+  "finished": "done",
+  "sign in": "auth",
+  "log in": "auth",
+  "authenticate": "auth",
+  "approval": "auth",
+  "openai": "openai",
+  "browser": "browser",
+}
+
+# A plain literal alternation is the cheapest thing sre can run over a long
+# capture, so the text is scanned once for keywords (lowercased, so the scan
+# itself can be case-sensitive) and the full patterns are only tried, anchored,
+# where a keyword was found.
+_ALTERNATION = "|".join(re.escape(k) for k in sorted(KEYWORDS, key=len, reverse=True))
+KEYWORD_REGEX = re.compile(_ALTERNATION)
+KEYWORD_REGEX_I = re.compile(_ALTERNATION, re.I)
+
+TOKEN_AT = re.compile(r"(prompt|completion|total)\s*tokens\s*[:=]\s*(\d+)", re.I)
+MODEL_AT = re.compile(r"model\s*[:=]\s*([\w\-\.]+)", re.I)
+SUB_AGENT_AT = re.compile(r"(?:sub-?agent|tool|thread)\s*[:#]\s*([\w\-\.]+)", re.I)
+JOB_AT = re.compile(r"\[JOB:([a-f0-9\\-]{8,})\]", re.I)
+WORD_AT = re.compile(r"\b\w+\b")
+
+
+class OutputScanner:
+  # Accumulates classification state over one or more chunks of output, so a
+  # stream can be fed line by line and the result read at any point. Results
+  # match the separate searches: first model/sub-agent/job id, last value of
+  # each token count, and error > blocked > done for the status.
+
+  def __init__(self) -> None:
+    self.job_id: Optional[str] = None
+    self.model: Optional[str] = None
+    self.sub_agent: Optional[str] = None
+    self.tokens: Dict[str, Optional[int]] = {"prompt": None, "completion": None, "total": None}
+    self.error = False
+    self.done = False
+    self._auth = False
+    self._openai = False
+    self._browser = False
+
+  def feed(self, text: str) -> "OutputScanner":
+    if not text:
+      return self
+    lowered = text.lower()
+    if len(lowered) == len(text):
+      subject, keywords = lowered, KEYWORD_REGEX
+    else:
+      # A few characters change length when lowercased, which would shift
+      # the offsets used below; scan the original text instead.
+      subject, keywords = text, KEYWORD_REGEX_I
+
+    # search() from start + 1 rather than finditer so keywords that overlap
+    # (e.g. "total" and "log in" in "totalog in") are all seen.
+    match = keywords.search(subject)
+    while match is not None:
+      pos = match.start()
+      kind = KEYWORDS[match.group().lower()]
+      if kind == "tokens":
+        found = TOKEN_AT.match(text, pos)
+        if found:
+          self.tokens[found.group(1).lower()] = int(found.group(2))
+      elif kind == "model":
+        if self.model is None:
+          found = MODEL_AT.match(text, pos)
+          if found:
+            self.model = found.group(1)
+      elif kind == "sub":
+        if self.sub_agent is None:
+          found = SUB_AGENT_AT.match(text, pos)
+          if found:
+            self.sub_agent = found.group(1)
+      elif kind == "job":
+        if self.job_id is None:
+          found = JOB_AT.match(text, pos)
+          if found:
+            self.job_id = found.group(1)
+      elif kind == "error" or kind == "done":
+        # Whole words only, like the \b...\b patterns these replace.
+        found = WORD_AT.match(subject, pos)
+        if found and found.end() == match.end():
+          if kind == "error":
+            self.error = True
+          else:
+            self.done = True
+      elif kind == "auth":
+        self._auth = True
+      elif kind == "openai":
+        self._openai = True
+      else:
+        self._browser = True
+      match = keywords.search(subject, pos + 1)
+    return self
+
+  @property
+  def auth_needed(self) -> bool:
+    return self._auth or (self._openai and self._browser)
+
+  @property
+  def status(self) -> Optional[str]:
+    if self.error:
+      return "error"
+    if self.auth_needed:
+      return "blocked"
+    if self.done:
+      return "done"
+    return None
+
+
+def scan_output(text: str) -> OutputScanner:
+  return OutputScanner().feed(text)
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, Optional
+
+from ..config import CAPTURE_LINES
+
+# Number of lines at the top of the overlap between two captures that must be
+# identical before they are considered aligned.
+ANCHOR_LINES = 8
+
+
+def _diff(prev: list[str], prev_top: int, lines: list[str], top: int) -> Optional[str]:
+  if not prev:
+    return "\n".join(lines).strip("\n")
+
+  # lines[i] is expected to be prev[i + offset]. Try the offset implied by the
+  # absolute line numbers first, then widen outwards; it drifts when tmux
+  # drops history at history-limit or output scrolls between tmux calls.
+  # The anchor must come from settled lines: the last previous line may still
+  # be being written. With nothing settled yet, trust the line numbers.
+  expected = top - prev_top
+  need = min(ANCHOR_LINES, len(prev) - 1, len(lines))
+  if need == 0:
+    offsets = [expected]
+  else:
+    offsets = sorted(range(-len(lines) + 1, len(prev)), key=lambda o: abs(o - expected))
+  for offset in offsets:
+    lo = max(0, -offset)
+    hi = min(len(lines), len(prev) - offset)
+    if need and (lo + offset + need >= len(prev) or hi - lo < need):
+      continue
+    if lines[lo:lo + need] != prev[lo + offset:lo + offset + need]:
+      continue
+    first = lo + need
+    while first < hi and lines[first] == prev[first + offset]:
+      first += 1
+    out = lines[first:]
+    if first < hi and out[0].startswith(prev[first + offset]):
+      out[0] = out[0][len(prev[first + offset]):]
+    return "\n".join(out).strip("\n")
+  return None
+
+
+class PaneDeltaTracker:
+  # Remembers the last captured window of each pane in absolute line numbers
+  # (0 = oldest history line) so the next capture only has to cover the tail
+  # of the previous one plus whatever was written since.
+
+  def __init__(self) -> None:
+    self._panes: Dict[str, dict] = {}
+
+  def retain(self, pane_ids: Iterable[str]) -> None:
+    keep = set(pane_ids)
+    for pane_id in list(self._panes):
+      if pane_id not in keep:
+        del self._panes[pane_id]
+
+  def window(self, pane_id: str) -> int:
+    # Relative -S line for the next capture of this pane. It is computed from
+    # the previous capture's metrics, so two screens of slack cover output
+    # that scrolled since then (or history tmux dropped at history-limit).
+    state = self._panes.get(pane_id)
+    if state is None:
+      return -CAPTURE_LINES
+    last = min(state["top"] + len(state["lines"]) - 1, state["cursor"])
+    start = last - ANCHOR_LINES - 2 * state["height"] - state["history"]
+    return max(start, -CAPTURE_LINES)
+
+  def tail(self, pane_id: str, lines: int) -> Optional[str]:
+    # The last lines of the pane's latest capture.
+    state = self._panes.get(pane_id)
+    if state is None:
+      return None
+    return "\n".join(state["lines"][-lines:])
+
+  def update(self, pane_id: str, meta: dict, start: int, text: str, final: bool = False) -> Optional[str]:
+    # Returns the newly written text, or None when the capture could not be
+    # aligned with the previous one and a full capture should be taken.
+    lines = text.split("\n")
+    while lines and not lines[-1].strip():
+      lines.pop()
+    history = meta["history_size"]
+    top = history + max(start, -history)
+
+    state = self._panes.get(pane_id)
+    if state is None:
+      out = text.strip("\n")
+    else:
+      out = _diff(state["lines"], state["top"], lines, top)
+      if out is None:
+        if not final:
+          return None
+        out = "\n".join(lines).strip("\n")
+
+    self._panes[pane_id] = {
+      "top": top,
+      "lines": lines,
+      "cursor": history + meta["cursor_y"],
+      "history": history,
+      "height": meta["pane_height"],
+    }
+    return out
@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import json
+import re
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .blob_store import expand_rows
+from .token_rollup import BUCKETS, TOKEN_COLUMNS
+from .transcript import TranscriptAssembler
+from ..db import BLOB_FIELDS, fetch_all, fetch_one, iter_rows
+
+MAX_PAGE = 1000
+
+_COLUMNS: Dict[str, Tuple[str, ...]] = {}
+
+
+def _columns(table: str) -> Tuple[str, ...]:
+  cols = _COLUMNS.get(table)
+  if cols is None:
+    cols = _COLUMNS[table] = tuple(row["name"] for row in fetch_all(f"PRAGMA table_info({table})"))
+  return cols
+
+
+def _projection(table: str, fields: Optional[str], keys: Iterable[str]) -> Tuple[List[str], Optional[set]]:
+  # SELECT list for a comma-separated fields= value, plus the set of fields to
+  # return (None = everything). Keyset columns are always selected so the
+  # next cursor can be built.
+  columns = _columns(table)
+  if not fields:
+    return list(columns), None
+  wanted = {f.strip() for f in fields.split(",") if f.strip()}
+  unknown = wanted - set(columns) - set(BLOB_FIELDS)
+  if unknown:
+    raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+  select = set(keys) | (wanted & set(columns))
+  for field, ref in BLOB_FIELDS.items():
+    if field in wanted and ref in columns:
+      select.add(ref)
+  return [col for col in columns if col in select], wanted
+
+
+def _shape(rows: List[Dict[str, Any]], wanted: Optional[set]) -> List[Dict[str, Any]]:
+  if wanted is None or wanted & set(BLOB_FIELDS):
+    expand_rows(rows)
+  if wanted is None:
+    return rows
+  return [{key: row.get(key) for key in wanted} for row in rows]
+
+
+def _page(limit: int) -> int:
+  return max(1, min(limit, MAX_PAGE))
+
+
+def list_events(
+  limit: int = 200,
+  cursor: Optional[str] = None,
+  since: Optional[int] = None,
+  job_id: Optional[str] = None,
+  agent: Optional[str] = None,
+  type: Optional[str] = None,
+  fields: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+  # Newest first, keyset-paginated on (ts, id): the cursor is the "ts:id"
+  # of the last row of the previous page.
+  select, wanted = _projection("events", fields, ("ts", "id"))
+  clauses, params = [], []
+  if cursor:
+    try:
+      ts, row_id = (int(part) for part in cursor.split(":", 1))
+    except ValueError:
+      raise ValueError("cursor must be <ts>:<id>") from None
+    clauses.append("(ts, id) < (?, ?)")
+    params += [ts, row_id]
+  if since is not None:
+    clauses.append("ts >= ?")
+    params.append(since)
+  for col, val in (("job_id", job_id), ("agent", agent), ("type", type)):
+    if val:
+      clauses.append(f"{col} = ?")
+      params.append(val)
+  where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+  limit = _page(limit)
+  rows = fetch_all(
+    f"SELECT {', '.join(select)} FROM events {where} ORDER BY ts DESC, id DESC LIMIT ?",
+    (*params, limit),
+  )
+  next_cursor = f"{rows[-1]['ts']}:{rows[-1]['id']}" if len(rows) == limit else None
+  return _shape(rows, wanted), next_cursor
+
+
+def list_jobs(
+  limit: int = 50,
+  cursor: Optional[str] = None,
+  status: Optional[str] = None,
+  agent: Optional[str] = None,
+  fields: Optional[str] = None,
+  parent_job_id: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+  # Most recently updated first, keyset-paginated on (updated_ts, job_id).
+  select, wanted = _projection("jobs", fields, ("updated_ts", "job_id"))
+  clauses, params = ["updated_ts IS NOT NULL"], []
+  if cursor:
+    ts, _, job_id = cursor.partition(":")
+    try:
+      params += [int(ts), job_id]
+    except ValueError:
+      raise ValueError("cursor must be <updated_ts>:<job_id>") from None
+    clauses.append("(updated_ts, job_id) < (?, ?)")
+  if status:
+    clauses.append("status = ?")
+    params.append(status)
+  for col, val in (("agent", agent), ("parent_job_id", parent_job_id)):
+    if val:
+      clauses.append(f"{col} = ?")
+      params.append(val)
+  limit = _page(limit)
+  rows = fetch_all(
+    f"SELECT {', '.join(select)} FROM jobs WHERE {' AND '.join(clauses)} "
+    "ORDER BY updated_ts DESC, job_id DESC LIMIT ?",
+    (*params, limit),
+  )
+  next_cursor = f"{rows[-1]['updated_ts']}:{rows[-1]['job_id']}" if len(rows) == limit else None
+  return _shape(rows, wanted), next_cursor
+
+
+def job_children(job_id: str) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+  # The per-agent child jobs of a fan-out dispatch, and their token counts
+  # summed for the parent.
+  rows = fetch_all("SELECT * FROM jobs WHERE parent_job_id = ? ORDER BY agent", (job_id,))
+  totals = {col: sum(row[col] or 0 for row in rows) for col in TOKEN_COLUMNS}
+  return rows, totals
+
+
+def replay_events(
+  after_id: int,
+  agents: Iterable[str] = (),
+  job_ids: Iterable[str] = (),
+  types: Iterable[str] = (),
+  limit: int = 500,
+) -> List[Dict[str, Any]]:
+  # Events stored after after_id, oldest first, for a live stream client
+  # catching up on what it missed. Empty filters match everything.
+  clauses, params = ["id > ?"], [after_id]
+  for col, vals in (("agent", agents), ("job_id", job_ids), ("type", types)):
+    vals = list(vals)
+    if vals:
+      clauses.append(f"{col} IN ({', '.join('?' for _ in vals)})")
+      params += vals
+  rows = fetch_all(
+    f"SELECT * FROM events WHERE {' AND '.join(clauses)} ORDER BY id LIMIT ?",
+    (*params, _page(limit)),
+  )
+  return expand_rows(rows)
+
+
+# Default span of a token series per bucket, and the most buckets one
+# request may cover.
+_TOKEN_RANGES = {"minute": 60 * 60_000, "hour": 24 * 3_600_000, "day": 30 * 86_400_000}
+MAX_TOKEN_BUCKETS = 2000
+
+_RANGE = re.compile(r"^(\d+)([mhd])$")
+_RANGE_UNITS = {"m": 60_000, "h": 3_600_000, "d": 86_400_000}
+_TOKEN_GROUPS = {"none": (), "agent": ("agent",), "model": ("model",), "agent_model": ("agent", "model")}
+
+
+def token_series(
+  bucket: str = "hour",
+  range: Optional[str] = None,
+  until: Optional[int] = None,
+  agent: Optional[str] = None,
+  model: Optional[str] = None,
+  group: str = "agent",
+) -> Dict[str, Any]:
+  # Token usage per bucket from token_rollups: one PRIMARY KEY range scan,
+  # reading agents x models rows per bucket however many events they hold.
+  # range is e.g. "90m", "24h", "7d"; the series ends at until (default now).
+  width = BUCKETS.get(bucket)
+  if width is None:
+    raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+  keys = _TOKEN_GROUPS.get(group)
+  if keys is None:
+    raise ValueError(f"group must be one of {', '.join(_TOKEN_GROUPS)}")
+  span = _TOKEN_RANGES[bucket]
+  if range:
+    match = _RANGE.match(range.strip())
+    if not match:
+      raise ValueError("range must look like 90m, 24h or 7d")
+    span = int(match.group(1)) * _RANGE_UNITS[match.group(2)]
+  if span // width > MAX_TOKEN_BUCKETS:
+    raise ValueError(f"range covers more than {MAX_TOKEN_BUCKETS} {bucket} buckets")
+  end = (until if until is not None else int(time.time() * 1000)) // width * width + width
+  start = end - max(span // width, 1) * width
+  clauses, params = ["bucket = ?", "start >= ?", "start < ?"], [bucket, start, end]
+  for col, val in (("agent", agent), ("model", model)):
+    if val is not None:
+      clauses.append(f"{col} = ?")
+      params.append(val)
+  cols = ", ".join(("start", *keys))
+  sums = ", ".join(f"SUM({col}) AS {col}" for col in ("events", *TOKEN_COLUMNS))
+  rows = fetch_all(
+    f"SELECT {cols}, {sums} FROM token_rollups WHERE {' AND '.join(clauses)} GROUP BY {cols} ORDER BY {cols}",
+    params,
+  )
+  return {"bucket": bucket, "bucket_ms": width, "from": start, "to": end, "group": group, "series": rows}
+
+
+def _job_range(job_id: str, from_id: Optional[int], to_id: Optional[int]) -> Tuple[str, list]:
+  clauses, params = ["job_id = ?"], [job_id]
+  if from_id is not None:
+    clauses.append("id >= ?")
+    params.append(from_id)
+  if to_id is not None:
+    clauses.append("id <= ?")
+    params.append(to_id)
+  return " AND ".join(clauses), params
+
+
+def stream_job(
+  job_id: str,
+  from_id: Optional[int] = None,
+  to_id: Optional[int] = None,
+  fields: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+  # {"job": ...}, then {"transcript": ...} for output already rolled up by
+  # retention (whole stream only), then one {"event": ...} per event in
+  # (ts, id) order, read from a single cursor a batch at a time.
+  select, wanted = _projection("events", fields, ("ts", "id"))
+  job = fetch_one("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+  if job:
+    expand_rows([job])
+  yield {"job": job}
+  if from_id is None and to_id is None:
+    for rows in iter_rows("SELECT * FROM transcripts WHERE job_id = ? ORDER BY first_ts", (job_id,)):
+      for row in expand_rows(rows):
+        yield {"transcript": row}
+  where, params = _job_range(job_id, from_id, to_id)
+  for rows in iter_rows(f"SELECT {', '.join(select)} FROM events WHERE {where} ORDER BY ts, id", params):
+    for row in _shape(rows, wanted):
+      yield {"event": row}
+
+
+def stream_job_transcript(
+  job_id: str,
+  from_id: Optional[int] = None,
+  to_id: Optional[int] = None,
+) -> Iterator[str]:
+  # The job's output as plain text, with repeated chunks and re-captured
+  # pane content removed.
+  assembler = TranscriptAssembler()
+  if from_id is None and to_id is None:
+    for rows in iter_rows("SELECT text_hash FROM transcripts WHERE job_id = ? ORDER BY first_ts", (job_id,)):
+      for row in expand_rows(rows):
+        text = assembler.feed(row.get("text"), row.get("text_hash"))
+        if text:
+          yield text + "\n"
+  where, params = _job_range(job_id, from_id, to_id)
+  for rows in iter_rows(f"SELECT id, ts, text_hash, payload FROM events WHERE {where} ORDER BY ts, id", params):
+    for row in expand_rows(rows):
+      text = row.get("text")
+      if text is None and not row.get("text_hash"):
+        text = inline_text(row.get("payload"))
+      text = assembler.feed(text, row.get("text_hash"))
+      if text:
+        yield text + "\n"
+
+
+def inline_text(payload: Optional[str]) -> Optional[str]:
+  # Rows written before the blob table kept their text in the payload.
+  try:
+    return json.loads(payload or "{}").get("text")
+  except (ValueError, AttributeError):
+    return None
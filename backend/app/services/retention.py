@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from .blob_store import load_texts, store_text
+from .queries import inline_text
+from .token_rollup import BUCKETS
+from ..config import (
+  RETENTION_BATCH,
+  RETENTION_DAYS,
+  RETENTION_INTERVAL_MS,
+  RETENTION_PAUSE_MS,
+  RETENTION_VACUUM_PAGES,
+  ROLLUP_MINUTE_DAYS,
+)
+from ..db import fetch_one, write_batch
+
+# Raw events of these types are rolled up once they age out; everything else
+# (dispatch, dispatch_done, ...) is small and kept as the job's history.
+ROLLUP_TYPES = ("pane_output", "controller_output")
+
+_DAY_MS = 86_400_000
+
+# A blob may be shared by any of these references.
+_BLOB_REFS = (
+  "SELECT 1 FROM events WHERE text_hash = ? LIMIT 1",
+  "SELECT 1 FROM events WHERE prompt_hash = ? LIMIT 1",
+  "SELECT 1 FROM jobs WHERE prompt_hash = ? LIMIT 1",
+  "SELECT 1 FROM transcripts WHERE text_hash = ? LIMIT 1",
+)
+
+
+def _file_pages() -> Dict[str, int]:
+  row = fetch_one(
+    "SELECT * FROM pragma_page_count(), pragma_freelist_count(), pragma_page_size(), pragma_auto_vacuum()"
+  ) or {}
+  return {
+    "pages": row.get("page_count", 0),
+    "free": row.get("freelist_count", 0),
+    "page_size": row.get("page_size", 0),
+    "auto_vacuum": row.get("auto_vacuum", 0),
+  }
+
+
+class RetentionJob:
+  # Periodically rolls output events older than RETENTION_DAYS into per-job
+  # (or, without a job, per-agent-day) transcripts, deletes them, drops blobs nothing references any more,
+  # prunes per-minute token rollups older than ROLLUP_MINUTE_DAYS (hourly
+  # and daily ones are kept) and returns freed pages to the filesystem.
+  # Works in RETENTION_BATCH-sized transactions with pauses in between so
+  # the ingest writer is never held up for long.
+
+  def __init__(self) -> None:
+    self._last: Dict[str, Any] = {}
+    self._totals = {"runs": 0, "events_deleted": 0, "blobs_deleted": 0, "bytes_freed": 0, "bytes_reclaimed": 0}
+
+  async def run(self) -> None:
+    if RETENTION_DAYS <= 0:
+      return
+    while True:
+      try:
+        await self.run_once()
+      except Exception as exc:
+        self._last = {**self._last, "error": str(exc)}
+      await asyncio.sleep(RETENTION_INTERVAL_MS / 1000.0)
+
+  async def run_once(self) -> Dict[str, Any]:
+    started = time.time()
+    cutoff = int((started - RETENTION_DAYS * 86400) * 1000)
+    before = await asyncio.to_thread(_file_pages)
+    report = {
+      "cutoff_ts": cutoff,
+      "events_deleted": 0,
+      "transcripts_written": 0,
+      "blobs_deleted": 0,
+      "bytes_freed": 0,
+    }
+    after_id: Optional[tuple[int, int]] = None
+    while True:
+      step = await asyncio.to_thread(self._roll_batch, cutoff, after_id)
+      if step is None:
+        break
+      after_id = step.pop("after")
+      for key, val in step.items():
+        report[key] += val
+      await asyncio.sleep(RETENTION_PAUSE_MS / 1000.0)
+    report["rollups_deleted"] = 0
+    if ROLLUP_MINUTE_DAYS > 0:
+      # On a horizon of their own: minute-level token history is meant to
+      # outlive the raw events.
+      rollup_cutoff = int((started - ROLLUP_MINUTE_DAYS * 86400) * 1000)
+      report["rollups_deleted"] = await asyncio.to_thread(self._prune_rollups, rollup_cutoff)
+    while await asyncio.to_thread(self._vacuum_step):
+      await asyncio.sleep(RETENTION_PAUSE_MS / 1000.0)
+
+    after = await asyncio.to_thread(_file_pages)
+    report["bytes_reclaimed"] = max(0, before["pages"] - after["pages"]) * after["page_size"]
+    report["file_bytes"] = after["pages"] * after["page_size"]
+    report["free_bytes"] = after["free"] * after["page_size"]
+    # 2 = incremental. Older databases need one manual VACUUM to switch.
+    report["incremental_vacuum"] = after["auto_vacuum"] == 2
+    report["duration_ms"] = int((time.time() - started) * 1000)
+    report["ts"] = int(time.time() * 1000)
+    self._last = report
+    self._totals["runs"] += 1
+    for key in ("events_deleted", "blobs_deleted", "bytes_freed", "bytes_reclaimed"):
+      self._totals[key] += report[key]
+    return report
+
+  def _roll_batch(self, cutoff: int, after: Optional[tuple[int, int]]) -> Optional[Dict[str, Any]]:
+    ts0, id0 = after or (-1, -1)
+    marks = ", ".join("?" for _ in ROLLUP_TYPES)
+    with write_batch() as conn:
+      rows = conn.execute(
+        f"""
+        SELECT id, ts, agent, job_id, text_hash, payload, length(payload) AS payload_bytes
+        FROM events
+        WHERE ts < ? AND (ts > ? OR (ts = ? AND id > ?)) AND type IN ({marks})
+        ORDER BY ts, id
+        LIMIT ?
+        """,
+        (cutoff, ts0, ts0, id0, *ROLLUP_TYPES, RETENTION_BATCH),
+      ).fetchall()
+      if not rows:
+        return None
+
+      texts = load_texts(row["text_hash"] for row in rows)
+      # One transcript per job; output with no job id goes into one per
+      # agent and day (job_id NULL) so its text is archived too.
+      transcripts: Dict[tuple, Dict[str, Any]] = {}
+      for row in rows:
+        text = texts.get(row["text_hash"]) if row["text_hash"] else inline_text(row["payload"])
+        key = (row["job_id"],) if row["job_id"] else (None, row["agent"], row["ts"] // _DAY_MS)
+        part = transcripts.setdefault(key, {
+          "agent": row["agent"], "first_ts": row["ts"], "last_ts": row["ts"], "events": 0, "texts": [],
+        })
+        part["last_ts"] = row["ts"]
+        part["events"] += 1
+        if text:
+          part["texts"].append(text)
+
+      for key, part in transcripts.items():
+        text_hash = store_text("\n".join(part["texts"])) if part["texts"] else None
+        conn.execute(
+          "INSERT INTO transcripts (job_id, agent, first_ts, last_ts, events, text_hash) VALUES (?, ?, ?, ?, ?, ?)",
+          (key[0], part["agent"], part["first_ts"], part["last_ts"], part["events"], text_hash),
+        )
+
+      ids = [row["id"] for row in rows]
+      conn.execute(f"DELETE FROM events WHERE id IN ({', '.join('?' for _ in ids)})", ids)
+
+      freed = sum(row["payload_bytes"] or 0 for row in rows)
+      blobs_deleted = 0
+      for text_hash in {row["text_hash"] for row in rows if row["text_hash"]}:
+        if any(conn.execute(sql, (text_hash,)).fetchone() for sql in _BLOB_REFS):
+          continue
+        blob = conn.execute("SELECT length(data) AS n FROM blobs WHERE hash = ?", (text_hash,)).fetchone()
+        if blob is None:
+          continue
+        conn.execute("DELETE FROM blobs WHERE hash = ?", (text_hash,))
+        blobs_deleted += 1
+        freed += blob["n"] or 0
+
+    return {
+      "after": (rows[-1]["ts"], rows[-1]["id"]),
+      "events_deleted": len(rows),
+      "transcripts_written": len(transcripts),
+      "blobs_deleted": blobs_deleted,
+      "bytes_freed": freed,
+    }
+
+  def _prune_rollups(self, cutoff: int) -> int:
+    # Token totals stay available at hour and day resolution.
+    with write_batch() as conn:
+      return conn.execute(
+        "DELETE FROM token_rollups WHERE bucket = 'minute' AND start < ?",
+        (cutoff // BUCKETS["minute"] * BUCKETS["minute"],),
+      ).rowcount
+
+  def _vacuum_step(self) -> bool:
+    # True while there are free pages left to hand back.
+    with write_batch() as conn:
+      if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return False
+      conn.execute(f"PRAGMA incremental_vacuum({RETENTION_VACUUM_PAGES})").fetchall()
+      return conn.execute("PRAGMA freelist_count").fetchone()[0] > 0
+
+  def metrics(self) -> Dict[str, Any]:
+    return {
+      "enabled": RETENTION_DAYS > 0,
+      "retention_days": RETENTION_DAYS,
+      "last_run": self._last,
+      "totals": dict(self._totals),
+    }
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import deque
+from typing import Deque, Iterable, Optional
+
+from ..config import CONTROL_TIMEOUT_MS
+
+# Notifications that mean panes/windows may have moved under the agent mapping.
+LAYOUT_NOTIFICATIONS = {
+  "%layout-change",
+  "%window-add",
+  "%window-close",
+  "%window-renamed",
+  "%unlinked-window-add",
+  "%unlinked-window-close",
+  "%session-changed",
+  "%sessions-changed",
+}
+
+
+def _quote(arg: str) -> str:
+  if arg == ";":
+    return arg
+  return "'" + arg.replace("'", "'\\''") + "'"
+
+
+class _Request:
+  def __init__(self, commands: int, future: asyncio.Future) -> None:
+    self.commands = commands
+    self.future = future
+    self.blocks = 0
+    self.ok = True
+    self.lines: list[str] = []
+
+
+class TmuxControlClient:
+  # Persistent `tmux -C` client. Commands are written to its stdin and answered
+  # in %begin/%end blocks (one per command in a `;` chain), so queries cost no
+  # fork. %output notifications mark watched panes dirty and wake the watcher.
+
+  def __init__(self) -> None:
+    self._proc: Optional[asyncio.subprocess.Process] = None
+    self._loop: Optional[asyncio.AbstractEventLoop] = None
+    self._loop_thread: Optional[int] = None
+    self._reader: Optional[asyncio.Task] = None
+    self._pending: Deque[_Request] = deque()
+    self._block: Optional[_Request] = None
+    self._in_block = False
+    # (time, command number) of the open %begin; only the %end/%error with
+    # the same pair closes it, so pane text that looks like one does not.
+    self._block_tag: Optional[tuple[str, str]] = None
+    self._watched: set[str] = set()
+    self._dirty: set[str] = set()
+    self.changed = asyncio.Event()
+    self.layout_version = 0
+
+  @property
+  def connected(self) -> bool:
+    return self._proc is not None and self._proc.returncode is None and self._reader is not None and not self._reader.done()
+
+  async def start(self, session: str) -> bool:
+    try:
+      self._proc = await asyncio.create_subprocess_exec(
+        "tmux", "-C", "attach-session", "-t", session, "-f", "ignore-size",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+        # %output lines carry raw pane output and can be long.
+        limit=1 << 24,
+      )
+    except (FileNotFoundError, OSError):
+      self._proc = None
+      return False
+    self._in_block = False
+    self._block = None
+    self._block_tag = None
+    self._loop = asyncio.get_running_loop()
+    self._loop_thread = threading.get_ident()
+    self._reader = asyncio.create_task(self._read())
+    try:
+      ok, _ = await self.command(["display-message", "-p", "#{session_id}"])
+    except ConnectionError:
+      ok = False
+    if not ok:
+      await self.close()
+    return ok
+
+  async def close(self) -> None:
+    proc, self._proc = self._proc, None
+    if proc is not None and proc.returncode is None:
+      try:
+        proc.stdin.close()
+        await asyncio.wait_for(proc.wait(), 1.0)
+      except Exception:
+        proc.kill()
+    if self._reader is not None:
+      self._reader.cancel()
+      self._reader = None
+    self._fail_pending()
+
+  def watch(self, pane_ids: Iterable[str]) -> None:
+    self._watched = {p for p in pane_ids if p}
+
+  def take_dirty(self) -> set[str]:
+    dirty, self._dirty = self._dirty, set()
+    self.changed.clear()
+    return dirty
+
+  async def command(self, args: list[str]) -> tuple[bool, str]:
+    # (ok, output) for the command chain; raises ConnectionError when the
+    # control client itself is unusable so callers can fall back to forking.
+    if not self.connected:
+      raise ConnectionError("tmux control client is not connected")
+    future = asyncio.get_running_loop().create_future()
+    request = _Request(args.count(";") + 1, future)
+    self._pending.append(request)
+    try:
+      self._proc.stdin.write((" ".join(_quote(a) for a in args) + "\n").encode("utf-8"))
+      await self._proc.stdin.drain()
+      return await asyncio.wait_for(asyncio.shield(future), CONTROL_TIMEOUT_MS / 1000.0)
+    except (asyncio.TimeoutError, OSError) as exc:
+      # A lost reply would desynchronize every later request; start over.
+      await self.close()
+      if future.done():
+        future.exception()
+      raise ConnectionError("tmux control client stopped responding") from exc
+
+  def run_sync(self, args: list[str]) -> tuple[bool, str]:
+    # For worker threads (asyncio.to_thread). Never call from the loop thread.
+    if self._loop is None or threading.get_ident() == self._loop_thread:
+      raise RuntimeError("control client is not usable from this thread")
+    future = asyncio.run_coroutine_threadsafe(self.command(args), self._loop)
+    return future.result(CONTROL_TIMEOUT_MS / 1000.0 + 1.0)
+
+  async def _read(self) -> None:
+    assert self._proc is not None and self._proc.stdout is not None
+    stdout = self._proc.stdout
+    try:
+      while True:
+        raw = await stdout.readline()
+        if not raw:
+          break
+        self._handle(raw.decode("utf-8", errors="replace").rstrip("\r\n"))
+    finally:
+      self._fail_pending()
+      self.changed.set()
+
+  def _handle(self, line: str) -> None:
+    if self._in_block:
+      kind, _, rest = line.partition(" ")
+      if kind in {"%end", "%error"} and tuple(rest.split()[:2]) == self._block_tag:
+        self._finish_block(line)
+      elif self._block is not None:
+        self._block.lines.append(line)
+      return
+
+    kind, _, rest = line.partition(" ")
+    if kind == "%begin":
+      self._in_block = True
+      # flags bit 0 marks blocks answering commands written by this client.
+      parts = rest.split()
+      self._block_tag = tuple(parts[:2])
+      ours = len(parts) >= 3 and int(parts[2]) & 1
+      self._block = self._pending[0] if ours and self._pending else None
+    elif kind in {"%output", "%extended-output"}:
+      pane_id = rest.split(" ", 1)[0]
+      if pane_id in self._watched:
+        self._dirty.add(pane_id)
+        self.changed.set()
+    elif kind in LAYOUT_NOTIFICATIONS:
+      self.layout_version += 1
+      self.changed.set()
+    elif kind == "%exit":
+      self._fail_pending()
+
+  def _finish_block(self, line: str) -> None:
+    self._in_block = False
+    self._block_tag = None
+    request, self._block = self._block, None
+    if request is None:
+      return
+    request.blocks += 1
+    if line.startswith("%error "):
+      request.ok = False
+    # A failing command aborts the rest of its chain, so no more blocks follow.
+    if request.blocks >= request.commands or not request.ok:
+      self._pending.popleft()
+      if not request.future.done():
+        request.future.set_result((request.ok, "\n".join(request.lines)))
+
+  def _fail_pending(self) -> None:
+    while self._pending:
+      request = self._pending.popleft()
+      if not request.future.done():
+        request.future.set_exception(ConnectionError("tmux control client exited"))
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .tmux_probe import capture_pane, map_agents, pane_exists, send_prompt, submit_prompt
+from ..config import DISPATCH_ENTER_DELAY_MS
+
+# Line Codex prints once a turn has produced its answer.
+COMPLETION_BANNER = "Worked for"
+
+# Scrollback lines written to outdir per pane, as codexctl --tail does.
+_OUTDIR_TAIL = 260
+
+
+class TmuxDispatchError(Exception):
+  pass
+
+
+def job_marker(job_id: str) -> str:
+  return f"[JOB:{job_id}]"
+
+
+class _PaneWait:
+  # One prompt in flight on one pane. Complete once its [JOB:<id>] line has
+  # been seen and a Worked for banner follows on a later line.
+
+  __slots__ = ("job_id", "agent", "pane_id", "marker", "seen", "done", "done_ts")
+
+  def __init__(self, job_id: str, agent: str, pane_id: str) -> None:
+    self.job_id = job_id
+    self.agent = agent
+    self.pane_id = pane_id
+    self.marker = job_marker(job_id)
+    self.seen = False
+    self.done = asyncio.get_running_loop().create_future()
+    self.done_ts: Optional[int] = None
+
+  def feed(self, text: str) -> bool:
+    if not self.seen:
+      at = text.find(self.marker)
+      if at < 0:
+        return False
+      self.seen = True
+      # The banner has to come after the marker's own line, which holds the
+      # prompt text.
+      eol = text.find("\n", at)
+      text = text[eol + 1:] if eol >= 0 else ""
+    return COMPLETION_BANNER in text
+
+
+class TmuxDispatcher:
+  # Dispatches in process: agents are resolved to panes with map_agents, the
+  # prompt is typed with the RFC send protocol (send_prompt, then a separate
+  # submit_prompt), and completion is read off the pane captures TmuxWatcher
+  # already takes, passed in through observe. No codexdash/codexctl fork and
+  # no scrollback polling loop of its own.
+
+  def __init__(self) -> None:
+    self._waits: Dict[str, List[_PaneWait]] = {}
+
+  def observe(self, event: Dict[str, Any]) -> None:
+    # Called with every pane_output event before it is stored. Output that
+    # follows a dispatched prompt is attributed to its job.
+    if event.get("type") != "pane_output":
+      return
+    waits = self._waits.get(event.get("pane_id"))
+    if not waits:
+      return
+    text = event.get("text") or ""
+    for wait in waits:
+      if wait.done.done():
+        continue
+      finished = wait.feed(text)
+      if wait.seen and not event.get("job_id"):
+        event["job_id"] = wait.job_id
+      if finished:
+        # The capture's time, not when the dispatch gets round to it.
+        wait.done_ts = event.get("ts")
+        wait.done.set_result(True)
+
+  async def resolve(self, targets: List[str]) -> Dict[str, dict]:
+    # {agent: pane info} for the targets (agent names or pane ids), or every
+    # mapped agent for none. A pane id stands for the agent mapped to it,
+    # and for itself if there is none.
+    mapping = await asyncio.to_thread(map_agents)
+    if not targets:
+      if not mapping:
+        raise TmuxDispatchError("no agent panes found")
+      return mapping
+    by_pane = {info.get("pane_id"): agent for agent, info in mapping.items()}
+    resolved: Dict[str, dict] = {}
+    missing = []
+    for target in targets:
+      agent = by_pane.get(target, target)
+      if mapping.get(agent, {}).get("pane_id"):
+        resolved[agent] = mapping[agent]
+      elif target.startswith("%") and await asyncio.to_thread(pane_exists, target):
+        resolved[target] = {"pane_id": target, "window_name": None, "mode": "pane"}
+      else:
+        missing.append(target)
+    if missing:
+      raise TmuxDispatchError(f"no pane for {', '.join(missing)}")
+    return resolved
+
+  async def dispatch(
+    self,
+    jobs: Dict[str, str],
+    panes: Dict[str, dict],
+    prompt: str,
+    wait_s: float,
+    outdir: Optional[str] = None,
+    on_done: Optional[Callable[[str, Optional[int]], Awaitable[Any]]] = None,
+  ) -> Dict[str, Dict[str, Any]]:
+    # Sends "[JOB:<id>] <prompt>" to every pane at once, with the job id
+    # jobs gives for its agent, then waits up to wait_s (0: not at all) for
+    # them to finish; on_done(agent, done_ts) is awaited as each one does.
+    # Per agent: pane_id, job_id, whether it completed and when and, with
+    # outdir, the file its output tail went to.
+    waits = [_PaneWait(jobs[agent], agent, info["pane_id"]) for agent, info in panes.items()]
+    for wait in waits:
+      # Registered before typing so no capture of the prompt is missed.
+      self._waits.setdefault(wait.pane_id, []).append(wait)
+    try:
+      sent = await asyncio.gather(*(
+        asyncio.to_thread(send_prompt, w.pane_id, f"{w.marker} {prompt}") for w in waits
+      ))
+      failed = [w.agent for w, ok in zip(waits, sent) if not ok]
+      if failed:
+        raise TmuxDispatchError(f"send-keys failed for {', '.join(failed)}")
+      # The Codex input treats keys arriving right behind a paste as part of
+      # it; give it a moment before Enter, as codexctl does.
+      await asyncio.sleep(DISPATCH_ENTER_DELAY_MS / 1000.0)
+      submitted = await asyncio.gather(*(asyncio.to_thread(submit_prompt, w.pane_id) for w in waits))
+      failed = [w.agent for w, ok in zip(waits, submitted) if not ok]
+      if failed:
+        raise TmuxDispatchError(f"Enter failed for {', '.join(failed)}")
+      if wait_s > 0:
+        await self._wait(waits, wait_s, on_done)
+      results = {
+        w.agent: {"pane_id": w.pane_id, "job_id": w.job_id, "completed": w.done.done(), "done_ts": w.done_ts}
+        for w in waits
+      }
+      if outdir:
+        for w in waits:
+          results[w.agent]["output_path"] = await asyncio.to_thread(self._save_tail, w, outdir)
+      return results
+    finally:
+      for wait in waits:
+        if not wait.done.done():
+          wait.done.cancel()
+        pane_waits = self._waits.get(wait.pane_id, [])
+        if wait in pane_waits:
+          pane_waits.remove(wait)
+        if not pane_waits:
+          self._waits.pop(wait.pane_id, None)
+
+  async def _wait(
+    self,
+    waits: List[_PaneWait],
+    wait_s: float,
+    on_done: Optional[Callable[[str, Optional[int]], Awaitable[Any]]],
+  ) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait_s
+    by_future = {w.done: w for w in waits}
+    pending = set(by_future)
+    while pending:
+      done, pending = await asyncio.wait(
+        pending, timeout=max(deadline - loop.time(), 0), return_when=asyncio.FIRST_COMPLETED,
+      )
+      if not done:
+        return
+      if on_done is not None:
+        for future in sorted(done, key=lambda f: by_future[f].done_ts or 0):
+          await on_done(by_future[future].agent, by_future[future].done_ts)
+
+  def _save_tail(self, wait: _PaneWait, outdir: str) -> str:
+    path = Path(outdir).expanduser() / f"pane_{wait.pane_id.lstrip('%')}_{wait.job_id}.txt"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(capture_pane(wait.pane_id, lines=_OUTDIR_TAIL) + "\n", encoding="utf-8")
+    return str(path)
+
+  def status(self) -> Dict[str, Any]:
+    return {
+      pane_id: [{"job_id": w.job_id, "agent": w.agent, "seen": w.seen} for w in waits]
+      for pane_id, waits in self._waits.items()
+    }
@@ -2,38 +2,59 @@ from __future__ import annotations
 
 import os
 import subprocess
-from typing import Dict, List, Optional
+import threading
+import time
+from typing import Dict, Iterable, Optional
 
-from ..config import DEFAULT_SESSION
+from ..config import AGENT_MAP_TTL_MS, DEFAULT_SESSION
 
 AGENTS = ["fast", "deep", "test", "sec"]
 
+# Optional persistent `tmux -C` client; when connected, commands are sent
+# through it instead of forking a tmux process per call.
+_CONTROL = None
 
-def _run_tmux(args: list[str]) -> str:
-  result = subprocess.run(["tmux", *args], capture_output=True, text=True)
+
+def set_control_client(client) -> None:
+  global _CONTROL
+  _CONTROL = client
+
+
+def _run_tmux(args: list[str], strip: bool = True) -> str:
+  ok, out = _run_tmux_status(args, strip)
+  return out if ok else ""
+
+
+def _run_tmux_status(args: list[str], strip: bool = True) -> tuple[bool, str]:
+  control = _CONTROL
+  if control is not None and control.connected:
+    try:
+      ok, out = control.run_sync(args)
+    except Exception:
+      pass
+    else:
+      return ok, out.strip() if strip else out.rstrip("\n")
+  result = subprocess.run(["tmux", *_argv(args)], capture_output=True, text=True)
   if result.returncode != 0:
-    return ""
-  return result.stdout.strip()
+    return False, ""
+  return True, result.stdout.strip() if strip else result.stdout.rstrip("\n")
 
 
-def detect_session() -> str:
-  return os.environ.get("CODEX_TMUX_SESSION", DEFAULT_SESSION)
+def _argv(args: list[str]) -> list[str]:
+  # On the command line tmux also splits commands at an argument that ends
+  # in ";"; escape those so they mean the same as over the control client.
+  return [a[:-1] + "\\;" if a != ";" and a.endswith(";") else a for a in args]
 
 
-def list_windows(session: str) -> list[dict]:
-  out = _run_tmux(["list-windows", "-t", session, "-F", "#{window_index}::#{window_name}"])
-  windows = []
-  for line in out.splitlines():
-    if not line:
-      continue
-    idx, name = line.split("::", 1)
-    windows.append({"index": idx, "name": name})
-  return windows
+def detect_session() -> str:
+  return os.environ.get("CODEX_TMUX_SESSION", DEFAULT_SESSION)
 
 
 def list_panes(session: str) -> list[dict]:
+  # -s: every pane in the session, not just the current window's.
   out = _run_tmux([
     "list-panes",
+    "-s",
     "-t",
     session,
     "-F",
@@ -51,19 +72,65 @@ def list_panes(session: str) -> list[dict]:
   return panes
 
 
-def _get_option(session: str, name: str) -> str:
-  return _run_tmux(["show-option", "-gqv", name])
+def _get_options() -> Dict[str, str]:
+  # All global options in one call instead of one show-option per agent.
+  options: Dict[str, str] = {}
+  for line in _run_tmux(["show-options", "-g"]).splitlines():
+    name, _, value = line.partition(" ")
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+      value = value[1:-1]
+    options[name] = value
+  return options
+
+
+_MAP_LOCK = threading.Lock()
+_MAP_CACHE: Dict[str, dict] = {}
+
+
+def invalidate_agent_map() -> None:
+  with _MAP_LOCK:
+    _MAP_CACHE.clear()
 
 
 def map_agents(session: Optional[str] = None) -> Dict[str, dict]:
+  # Cached for AGENT_MAP_TTL_MS. After that everything the mapping is built
+  # from is fingerprinted: pane ids, window names, titles and commands from
+  # one list-panes call, plus the @codexctl_pane_* options unless window
+  # names decide. The mapping is only rebuilt when that changed, or while
+  # some agents are still unmapped.
   session = session or detect_session()
+  now = time.monotonic()
+  with _MAP_LOCK:
+    cached = _MAP_CACHE.get(session)
+    if cached and now - cached["ts"] < AGENT_MAP_TTL_MS / 1000.0:
+      return {agent: dict(info) for agent, info in cached["mapping"].items()}
+
+  panes = list_panes(session)
+  options = {} if _windows_mode(panes) else _get_options()
+  fingerprint = (
+    tuple((p["pane_id"], p["window"], p["title"], p["cmd"]) for p in panes),
+    tuple(sorted((k, v) for k, v in options.items() if k.startswith("@codexctl_pane_"))),
+  )
+  if cached and cached["fingerprint"] == fingerprint and len(cached["mapping"]) == len(AGENTS):
+    mapping = cached["mapping"]
+  else:
+    mapping = _build_mapping(panes, options)
+  with _MAP_LOCK:
+    _MAP_CACHE[session] = {"ts": now, "fingerprint": fingerprint, "mapping": mapping}
+  return {agent: dict(info) for agent, info in mapping.items()}
+
+
+def _windows_mode(panes: list[dict]) -> bool:
+  # Every agent has a window named after it.
+  window_names = {p["window"] for p in panes}
+  return all(agent in window_names for agent in AGENTS)
+
+
+def _build_mapping(panes: list[dict], options: Dict[str, str]) -> Dict[str, dict]:
   mapping: Dict[str, dict] = {}
 
   # windows mode: window names are agent names
-  windows = list_windows(session)
-  window_names = {w["name"]: w for w in windows}
-  if all(agent in window_names for agent in AGENTS):
-    panes = list_panes(session)
+  if _windows_mode(panes):
     for agent in AGENTS:
       pane = next((p for p in panes if p["window"] == agent), None)
       if pane:
@@ -75,9 +142,8 @@ def map_agents(session: Optional[str] = None) -> Dict[str, dict]:
     return mapping
 
   # pane mode: use tmux options @codexctl_pane_* if present
-  panes = list_panes(session)
   for agent in AGENTS:
-    opt = _get_option(session, f"@codexctl_pane_{agent}")
+    opt = options.get(f"@codexctl_pane_{agent}")
     if opt:
       pane = next((p for p in panes if p["pane_id"] == opt or p["window"] == opt), None)
       if pane:
@@ -105,13 +171,92 @@ def map_agents(session: Optional[str] = None) -> Dict[str, dict]:
   return mapping
 
 
+def pane_exists(pane_id: str) -> bool:
+  ok, out = _run_tmux_status(["display-message", "-p", "-t", pane_id, "#{pane_id}"])
+  return ok and out == pane_id
+
+
 def capture_pane(pane_id: str, lines: int = 2000) -> str:
   return _run_tmux(["capture-pane", "-p", "-t", pane_id, "-S", f"-{lines}"])
 
 
-def pane_is_responsive(pane_id: str) -> bool:
-  out = _run_tmux(["capture-pane", "-p", "-t", pane_id, "-S", "-10"])
-  return bool(out)
+_CAPTURE_MARK = "::codexdash-pane::"
+_CAPTURE_META = "#{pane_id}::#{history_size}::#{history_limit}::#{cursor_y}::#{pane_height}"
+
+
+def capture_panes(
+  pane_ids: Iterable[str],
+  lines: int = 2000,
+  starts: Optional[Dict[str, int]] = None,
+) -> Dict[str, dict]:
+  # Captures several panes, plus their scrollback metrics, in one tmux command
+  # chain: per pane a display-message header line followed by capture-pane
+  # output. starts optionally overrides the -S line per pane.
+  pane_ids = list(pane_ids)
+  args: list[str] = []
+  for pane_id in pane_ids:
+    start = starts.get(pane_id, -lines) if starts else -lines
+    if args:
+      args.append(";")
+    args.extend(["display-message", "-p", "-t", pane_id, _CAPTURE_MARK + _CAPTURE_META])
+    args.extend([";", "capture-pane", "-p", "-t", pane_id, "-S", str(start)])
+  if not args:
+    return {}
+  # Leading blank lines are kept so line positions stay aligned with -S.
+  out = _run_tmux(args, strip=False)
+  if not out and len(pane_ids) > 1:
+    # A vanished pane aborts the whole chain; the mapping is probably stale.
+    invalidate_agent_map()
+    captures: Dict[str, dict] = {}
+    for pane_id in pane_ids:
+      captures.update(capture_panes([pane_id], lines=lines, starts=starts))
+    return captures
+  captures = {}
+  current: Optional[dict] = None
+  for line in out.split("\n"):
+    if line.startswith(_CAPTURE_MARK):
+      parts = line[len(_CAPTURE_MARK):].split("::")
+      if len(parts) != 5 or not all(p.isdigit() for p in parts[1:]):
+        current = None
+        continue
+      current = {
+        "pane_id": parts[0],
+        "history_size": int(parts[1]),
+        "history_limit": int(parts[2]),
+        "cursor_y": int(parts[3]),
+        "pane_height": int(parts[4]),
+        "lines": [],
+      }
+      captures[parts[0]] = current
+    elif current is not None:
+      current["lines"].append(line)
+  for capture in captures.values():
+    capture["text"] = "\n".join(capture.pop("lines"))
+  return captures
+
+
+def send_prompt(pane_id: str, text: str) -> bool:
+  # The RFC-safe send, as one tmux command chain: Home C-k clears whatever
+  # is prefilled in the input, then each line is typed literally (-l) with
+  # C-j between lines. Enter is not part of it; see submit_prompt.
+  args = ["send-keys", "-t", pane_id, "Home", "C-k"]
+  for i, line in enumerate(text.replace("\r", "").split("\n")):
+    if i:
+      args.extend([";", "send-keys", "-t", pane_id, "C-j"])
+    if line == ";":
+      # A bare ";" argument would end the command; send its byte instead.
+      args.extend([";", "send-keys", "-t", pane_id, "-H", "3b"])
+    elif line:
+      args.extend([";", "send-keys", "-t", pane_id, "-l", "--", line])
+  ok, _ = _run_tmux_status(args)
+  return ok
+
+
+def submit_prompt(pane_id: str) -> bool:
+  # Enter in a send-keys of its own: with -l it would be typed as text, and
+  # C-m/C-j only insert a newline in the Codex input.
+  ok, _ = _run_tmux_status(["send-keys", "-t", pane_id, "Enter"])
+  return ok
 
 
 def detect_auth_needed(text: str) -> bool:
@@ -1,20 +1,96 @@
 from __future__ import annotations
 
+import hashlib
 import math
+import threading
+from collections import OrderedDict
+
+from ..config import TOKEN_EXACT_MAX_CHARS, TOKEN_MEMO_SIZE
 
 try:
   import tiktoken  # type: ignore
 except Exception:  # pragma: no cover
   tiktoken = None
 
+# Prior for the fast path until exact encodes have been seen; also the
+# estimate used when tiktoken is unavailable.
+_CHARS_PER_TOKEN = 4.0
+# Exact encodes shorter than this say little about the ratio of real output.
+_CALIBRATION_MIN_CHARS = 256
+
+_ENCODER = None
+_ENCODER_FAILED = False
+_ENCODER_LOCK = threading.Lock()
+
+_MEMO: OrderedDict[bytes, int] = OrderedDict()
+_MEMO_LOCK = threading.Lock()
+
+_calibration_chars = 0
+_calibration_tokens = 0
+
+
+def load_encoder():
+  # get_encoding parses (and on first use downloads) the BPE ranks, so it is
+  # done once and from a worker thread; see main.startup.
+  global _ENCODER, _ENCODER_FAILED
+  if _ENCODER is not None or _ENCODER_FAILED or tiktoken is None:
+    return _ENCODER
+  with _ENCODER_LOCK:
+    if _ENCODER is None and not _ENCODER_FAILED:
+      try:
+        _ENCODER = tiktoken.get_encoding("cl100k_base")
+      except Exception:
+        _ENCODER_FAILED = True
+  return _ENCODER
+
+
+def _tokens_per_char() -> float:
+  if _calibration_chars == 0:
+    return 1.0 / _CHARS_PER_TOKEN
+  return _calibration_tokens / _calibration_chars
+
+
+def _calibrate(chars: int, tokens: int) -> None:
+  global _calibration_chars, _calibration_tokens
+  if chars < _CALIBRATION_MIN_CHARS:
+    return
+  _calibration_chars += chars
+  _calibration_tokens += tokens
+  # Halve the history once it is large so the ratio follows recent output.
+  if _calibration_chars > 50 * TOKEN_EXACT_MAX_CHARS:
+    _calibration_chars //= 2
+    _calibration_tokens //= 2
+
+
+def _count(text: str) -> int:
+  enc = load_encoder()
+  if enc is None:
+    return int(math.ceil(len(text) / _CHARS_PER_TOKEN))
+  if len(text) > TOKEN_EXACT_MAX_CHARS:
+    # Large captures are estimated from the ratio observed on exact encodes
+    # instead of paying for a full BPE pass.
+    return int(math.ceil(len(text) * _tokens_per_char()))
+  try:
+    tokens = len(enc.encode(text, disallowed_special=()))
+  except Exception:
+    return int(math.ceil(len(text) / _CHARS_PER_TOKEN))
+  with _MEMO_LOCK:
+    _calibrate(len(text), tokens)
+  return tokens
+
 
 def estimate_tokens(text: str) -> int:
   if not text:
     return 0
-  if tiktoken is not None:
-    try:
-      enc = tiktoken.get_encoding("cl100k_base")
-      return len(enc.encode(text))
-    except Exception:
-      pass
-  return int(math.ceil(len(text) / 4))
+  key = hashlib.blake2b(text.encode("utf-8", errors="ignore"), digest_size=16).digest()
+  with _MEMO_LOCK:
+    cached = _MEMO.get(key)
+    if cached is not None:
+      _MEMO.move_to_end(key)
+      return cached
+  tokens = _count(text)
+  with _MEMO_LOCK:
+    _MEMO[key] = tokens
+    while len(_MEMO) > TOKEN_MEMO_SIZE:
+      _MEMO.popitem(last=False)
+  return tokens
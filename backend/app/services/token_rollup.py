@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+from ..db import add_token_rollups
+
+# Rollup granularities and their width in ms. Buckets start on UTC
+# boundaries (ts // width * width).
+BUCKETS = {"minute": 60_000, "hour": 3_600_000, "day": 86_400_000}
+
+TOKEN_COLUMNS = (
+  "prompt_tokens_exact", "completion_tokens_exact", "total_tokens_exact",
+  "prompt_tokens_est", "completion_tokens_est", "total_tokens_est",
+)
+
+
+class TokenRollup:
+  # Token counts of one write batch, summed in memory per bucket, agent and
+  # model and added to token_rollups with one upsert per touched row. Runs
+  # inside the batch that stores the events, so a replayed (skipped) event
+  # is never counted twice.
+
+  def __init__(self) -> None:
+    self._rows: Dict[tuple, List[int]] = {}
+
+  def add(self, event: Dict[str, Any]) -> None:
+    ts = event.get("ts")
+    if not isinstance(ts, int):
+      return
+    values = [event.get(col) or 0 for col in TOKEN_COLUMNS]
+    agent = event.get("agent") or ""
+    model = event.get("model") or ""
+    for bucket, width in BUCKETS.items():
+      key = (bucket, ts // width * width, agent, model)
+      row = self._rows.get(key)
+      if row is None:
+        row = self._rows[key] = [0] * (1 + len(TOKEN_COLUMNS))
+      row[0] += 1
+      for i, value in enumerate(values, 1):
+        row[i] += value
+
+  def flush(self) -> int:
+    if not self._rows:
+      return 0
+    rows = [(*key, *values) for key, values in self._rows.items()]
+    add_token_rollups(rows)
+    self._rows.clear()
+    return len(rows)
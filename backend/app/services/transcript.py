@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+from typing import Optional
+
+from .pane_delta import ANCHOR_LINES
+
+
+class TranscriptAssembler:
+  # Joins a job's output chunks into one transcript, dropping repeats: exact
+  # duplicate chunks, and the already-seen head of a chunk that re-captured
+  # the pane (a resync emits the whole buffer again).
+
+  def __init__(self) -> None:
+    self._seen: set[str] = set()
+    self._tail: list[str] = []
+
+  def feed(self, text: Optional[str], text_hash: Optional[str] = None) -> Optional[str]:
+    # The part of text not yet in the transcript, or None.
+    if not text:
+      return None
+    if text_hash:
+      if text_hash in self._seen:
+        return None
+      self._seen.add(text_hash)
+    lines = text.split("\n")
+    start = self._overlap(lines)
+    self._tail = (self._tail + lines)[-ANCHOR_LINES:]
+    out = lines[start:]
+    if not out:
+      return None
+    return "\n".join(out)
+
+  def _overlap(self, lines: list[str]) -> int:
+    # Index just past the last place the transcript's tail reappears in
+    # lines; 0 when it doesn't.
+    anchor = self._tail
+    if not any(line.strip() for line in anchor):
+      return 0
+    need = len(anchor)
+    for end in range(len(lines), need - 1, -1):
+      if lines[end - 1] == anchor[-1] and lines[end - need:end] == anchor:
+        return end
+    return 0
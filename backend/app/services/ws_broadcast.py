@@ -0,0 +1,428 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, FrozenSet, List, NamedTuple, Optional
+
+from fastapi import WebSocket
+
+from .queries import replay_events
+from ..config import WS_BATCH_MS, WS_CLIENT_QUEUE, WS_REPLAY_MAX, WS_SEND_TIMEOUT_MS, WS_TEXT_INLINE
+from ..db import BLOB_FIELDS, run_read
+
+# Live pane output: clients can refetch it from /api/events, so it is what a
+# slow client loses first. Everything else (dispatch, job status) is kept.
+_LOSSY_TYPES = ("pane_output", "controller_output")
+
+# Close code for a client dropped for not keeping up (RFC 6455 "try again later").
+_CLOSE_SLOW = 1013
+# Close code for a client dropped on any other failure, e.g. a replay query
+# that timed out (RFC 6455 "internal error").
+_CLOSE_ERROR = 1011
+
+# Per-minute wire stats kept for /api/metrics/ws.
+_MINUTES_KEPT = 15
+
+# Events per replay read/frame when a client resumes.
+_REPLAY_BATCH = 500
+
+_IDS = itertools.count(1)
+
+
+def _output_key(event: Dict[str, Any]) -> Optional[tuple]:
+  if event.get("type") in _LOSSY_TYPES and event.get("pane_id"):
+    return event["type"], event["pane_id"]
+  return None
+
+
+class EventFilter(NamedTuple):
+  # A client's subscription; an empty set matches everything.
+  agents: FrozenSet[str] = frozenset()
+  job_ids: FrozenSet[str] = frozenset()
+  types: FrozenSet[str] = frozenset()
+
+  @classmethod
+  def parse(cls, agents: Optional[str] = None, job_ids: Optional[str] = None, types: Optional[str] = None) -> "EventFilter":
+    def split(value: Optional[str]) -> FrozenSet[str]:
+      return frozenset(part.strip() for part in (value or "").split(",") if part.strip())
+
+    return cls(split(agents), split(job_ids), split(types))
+
+  @property
+  def everything(self) -> bool:
+    return not (self.agents or self.job_ids or self.types)
+
+  def matches(self, event: Dict[str, Any]) -> bool:
+    return (
+      (not self.agents or event.get("agent") in self.agents)
+      and (not self.job_ids or event.get("job_id") in self.job_ids)
+      and (not self.types or event.get("type") in self.types)
+    )
+
+  def describe(self) -> Dict[str, List[str]]:
+    return {"agents": sorted(self.agents), "job_ids": sorted(self.job_ids), "types": sorted(self.types)}
+
+
+def _encode(events: List[Dict[str, Any]]) -> str:
+  return json.dumps(events, ensure_ascii=False, separators=(",", ":"))
+
+
+def trim_event(event: Dict[str, Any]) -> tuple[Dict[str, Any], int]:
+  # The event as sent over the socket, and the characters left out. The raw
+  # payload never goes out; long text keeps its tail (the newest output) and
+  # a reference to the stored blob.
+  out = event
+  trimmed = 0
+  if "payload" in event:
+    out = dict(event)
+    trimmed += len(out.pop("payload") or "")
+  for field, ref in BLOB_FIELDS.items():
+    text = event.get(field)
+    if not isinstance(text, str) or len(text) <= WS_TEXT_INLINE or not event.get(ref):
+      continue
+    if out is event:
+      out = dict(event)
+    out[field] = text[-WS_TEXT_INLINE:]
+    out[f"{field}_truncated"] = True
+    out[f"{field}_chars"] = len(text)
+    trimmed += len(text) - WS_TEXT_INLINE
+  return out, trimmed
+
+
+class _Frame:
+  __slots__ = ("events", "data", "size", "queued")
+
+  def __init__(self, events: List[Dict[str, Any]], data: Optional[str], size: int) -> None:
+    self.events = events
+    self.data = data
+    self.size = size
+    self.queued = time.monotonic()
+
+
+class _Client:
+  # One socket's outbound queue of frames and the task draining it. A send
+  # that takes longer than WS_SEND_TIMEOUT_MS disconnects the client.
+
+  def __init__(self, websocket: WebSocket, filter: EventFilter, resume_after: Optional[int]) -> None:
+    self.id = next(_IDS)
+    self.websocket = websocket
+    self.filter = filter
+    # Live frames queue up while the gap after resume_after is replayed;
+    # events the replay already covered are skipped when they are sent.
+    self.resume_after = resume_after
+    self.replayed_to: Optional[int] = None
+    self.replayed = 0
+    self.queue: Deque[_Frame] = deque()
+    self.depth = 0
+    self.ready = asyncio.Event()
+    self.task: Optional[asyncio.Task] = None
+    self.connected_ts = int(time.time() * 1000)
+    self.sent = 0
+    self.frames = 0
+    self.bytes = 0
+    self.coalesced = 0
+    self.dropped = 0
+    self.max_depth = 0
+    self.last_lag_ms = 0.0
+    self.max_lag_ms = 0.0
+    self.last_send_ms = 0.0
+    self.max_send_ms = 0.0
+
+  def push(self, events: List[Dict[str, Any]], data: str, size: int) -> None:
+    self.queue.append(_Frame(events, data, size))
+    self.depth += len(events)
+    if self.depth > WS_CLIENT_QUEUE:
+      self._shed()
+    self.max_depth = max(self.max_depth, self.depth)
+    self.ready.set()
+
+  def _shed(self) -> None:
+    # Over capacity. Output queued for a pane is merged into that pane's
+    # oldest queued output; if that is not enough, the oldest output is
+    # dropped, and only then the oldest events of any kind. Frames this
+    # touches are re-encoded for this client alone.
+    merged: Dict[tuple, tuple[Dict[str, Any], _Frame]] = {}
+    for frame in self.queue:
+      events: List[Dict[str, Any]] = []
+      for event in frame.events:
+        key = _output_key(event)
+        if key is None:
+          events.append(event)
+        elif key not in merged:
+          # Copied: the original is shared with every other client.
+          merged[key] = (dict(event), frame)
+          events.append(merged[key][0])
+        else:
+          target, target_frame = merged[key]
+          text = "\n".join(t for t in (target.get("text"), event.get("text")) if t)
+          target.update(event)
+          target["text"] = text
+          # The merged text is no longer any one stored blob.
+          target.pop("text_hash", None)
+          target_frame.data = None
+          frame.data = None
+          self.coalesced += 1
+      frame.events = events
+    self.depth = sum(len(frame.events) for frame in self.queue)
+
+    for lossy_only in (True, False):
+      for frame in self.queue:
+        excess = self.depth - WS_CLIENT_QUEUE
+        if excess <= 0:
+          break
+        kept = []
+        for event in frame.events:
+          if excess > 0 and (not lossy_only or _output_key(event) is not None):
+            excess -= 1
+            continue
+          kept.append(event)
+        removed = len(frame.events) - len(kept)
+        if removed:
+          frame.events, frame.data = kept, None
+          self.depth -= removed
+          self.dropped += removed
+    self.queue = deque(frame for frame in self.queue if frame.events)
+
+  async def run(
+    self,
+    on_failure: Callable[["_Client", int], Awaitable[None]],
+    on_sent: Callable[[int], None],
+  ) -> None:
+    try:
+      if self.resume_after is not None:
+        await self._replay(on_sent)
+      while True:
+        await self.ready.wait()
+        self.ready.clear()
+        while self.queue:
+          frame = self.queue.popleft()
+          self.depth -= len(frame.events)
+          if self.replayed_to is not None:
+            self._skip_replayed(frame)
+            if not frame.events:
+              continue
+          await self._send(frame, on_sent)
+    except asyncio.CancelledError:
+      raise
+    except asyncio.TimeoutError:
+      await on_failure(self, _CLOSE_SLOW)
+    except Exception:
+      await on_failure(self, _CLOSE_ERROR)
+
+  async def _send(self, frame: _Frame, on_sent: Callable[[int], None]) -> None:
+    if frame.data is None:
+      frame.data = _encode(frame.events)
+      frame.size = len(frame.data.encode("utf-8"))
+    started = time.monotonic()
+    await asyncio.wait_for(self.websocket.send_text(frame.data), WS_SEND_TIMEOUT_MS / 1000.0)
+    done = time.monotonic()
+    self.sent += len(frame.events)
+    self.frames += 1
+    self.bytes += frame.size
+    on_sent(frame.size)
+    self.last_send_ms = (done - started) * 1000.0
+    self.max_send_ms = max(self.max_send_ms, self.last_send_ms)
+    self.last_lag_ms = (done - frame.queued) * 1000.0
+    self.max_lag_ms = max(self.max_lag_ms, self.last_lag_ms)
+
+  async def _replay(self, on_sent: Callable[[int], None]) -> None:
+    # Sends stored events after resume_after that match the filter, up to
+    # WS_REPLAY_MAX. A client that missed more gets a replay_gap marker
+    # and should reload from /api/events.
+    after = self.resume_after or 0
+    f = self.filter
+    while True:
+      rows = await run_read(replay_events, after, f.agents, f.job_ids, f.types, _REPLAY_BATCH)
+      if not rows:
+        break
+      after = rows[-1]["id"]
+      self.replayed += len(rows)
+      await self._send(_Frame([trim_event(row)[0] for row in rows], None, 0), on_sent)
+      if len(rows) < _REPLAY_BATCH:
+        break
+      if self.replayed >= WS_REPLAY_MAX:
+        gap = {"type": "replay_gap", "after_id": after, "ts": int(time.time() * 1000)}
+        await self._send(_Frame([gap], None, 0), on_sent)
+        break
+    self.replayed_to = after
+
+  def _skip_replayed(self, frame: _Frame) -> None:
+    # Once a frame starts past the replay, so does everything after it.
+    upto = self.replayed_to
+    kept = [e for e in frame.events if not isinstance(e.get("id"), int) or e["id"] > upto]
+    if len(kept) != len(frame.events):
+      frame.events, frame.data = kept, None
+    elif all(isinstance(e.get("id"), int) for e in kept):
+      self.replayed_to = None
+
+  def metrics(self) -> Dict[str, Any]:
+    oldest = self.queue[0].queued if self.queue else None
+    return {
+      "id": self.id,
+      "connected_ts": self.connected_ts,
+      "filter": self.filter.describe(),
+      "replayed": self.replayed,
+      "queue_depth": self.depth,
+      "queued_frames": len(self.queue),
+      "max_depth": self.max_depth,
+      "sent": self.sent,
+      "frames": self.frames,
+      "bytes": self.bytes,
+      "coalesced": self.coalesced,
+      "dropped": self.dropped,
+      # Age of the oldest undelivered event: how far behind the client is now.
+      "lag_ms": round((time.monotonic() - oldest) * 1000.0, 3) if oldest is not None else 0.0,
+      "last_lag_ms": round(self.last_lag_ms, 3),
+      "max_lag_ms": round(self.max_lag_ms, 3),
+      "last_send_ms": round(self.last_send_ms, 3),
+      "max_send_ms": round(self.max_send_ms, 3),
+    }
+
+
+class ConnectionManager:
+  # Fans committed events out to WebSocket clients as JSON-array frames.
+  # Events arriving within WS_BATCH_MS of the last frame are held and sent
+  # together; after a quiet spell the next frame goes out on the next loop
+  # iteration. Each frame is filtered and encoded once per distinct
+  # subscription and shared by every client with that subscription.
+  # broadcast() only queues, so neither the ingest pipeline nor one client's
+  # slow connection holds up delivery to anyone else.
+
+  def __init__(self) -> None:
+    self._clients: Dict[WebSocket, _Client] = {}
+    self._pending: List[Dict[str, Any]] = []
+    self._flush_handle: Optional[asyncio.Handle] = None
+    self._last_frame = 0.0
+    self._broadcasts = 0
+    self._frames = 0
+    self._framed_events = 0
+    self._frame_bytes = 0
+    self._trimmed_chars = 0
+    self._disconnected_slow = 0
+    self._disconnected = 0
+    # minute -> [frames, events, bytes encoded, bytes sent to all clients]
+    self._minutes: Dict[int, List[int]] = {}
+
+  @property
+  def active(self) -> List[WebSocket]:
+    return list(self._clients)
+
+  async def connect(
+    self,
+    websocket: WebSocket,
+    filter: EventFilter = EventFilter(),
+    resume_after: Optional[int] = None,
+  ) -> None:
+    await websocket.accept()
+    client = _Client(websocket, filter, resume_after)
+    self._clients[websocket] = client
+    client.task = asyncio.create_task(client.run(self._failed, self._sent))
+
+  def disconnect(self, websocket: WebSocket) -> None:
+    client = self._clients.pop(websocket, None)
+    if client is None:
+      return
+    self._disconnected += 1
+    if client.task is not None and client.task is not asyncio.current_task():
+      client.task.cancel()
+
+  async def _failed(self, client: _Client, code: int) -> None:
+    if self._clients.get(client.websocket) is not client:
+      return
+    self.disconnect(client.websocket)
+    if code == _CLOSE_SLOW:
+      self._disconnected_slow += 1
+    # Closed on every failure, so the browser sees it and reconnects rather
+    # than waiting on a socket nothing is sent to any more.
+    try:
+      await asyncio.wait_for(client.websocket.close(code=code), WS_SEND_TIMEOUT_MS / 1000.0)
+    except Exception:
+      pass
+
+  async def broadcast(self, message: Dict[str, Any]) -> None:
+    self._broadcasts += 1
+    if not self._clients:
+      return
+    event, trimmed = trim_event(message)
+    self._trimmed_chars += trimmed
+    self._pending.append(event)
+    if self._flush_handle is not None:
+      return
+    loop = asyncio.get_running_loop()
+    wait = self._last_frame + WS_BATCH_MS / 1000.0 - loop.time()
+    if wait <= 0:
+      # Still batches whatever else is broadcast in this loop iteration,
+      # e.g. the rest of an ingest batch.
+      self._flush_handle = loop.call_soon(self._flush)
+    else:
+      self._flush_handle = loop.call_later(wait, self._flush)
+
+  def _flush(self) -> None:
+    self._flush_handle = None
+    events, self._pending = self._pending, []
+    if not events or not self._clients:
+      return
+    self._last_frame = asyncio.get_running_loop().time()
+    stats = self._minute()
+    frames: Dict[EventFilter, tuple[List[Dict[str, Any]], str, int]] = {}
+    for client in self._clients.values():
+      frame = frames.get(client.filter)
+      if frame is None:
+        wanted = events if client.filter.everything else [e for e in events if client.filter.matches(e)]
+        data = _encode(wanted) if wanted else ""
+        size = len(data.encode("utf-8"))
+        frame = frames[client.filter] = (wanted, data, size)
+        if wanted:
+          self._frames += 1
+          self._framed_events += len(wanted)
+          self._frame_bytes += size
+          stats[0] += 1
+          stats[1] += len(wanted)
+          stats[2] += size
+      if frame[0]:
+        client.push(*frame)
+
+  def _sent(self, size: int) -> None:
+    self._minute()[3] += size
+
+  def _minute(self) -> List[int]:
+    minute = int(time.time() // 60 * 60000)
+    stats = self._minutes.get(minute)
+    if stats is None:
+      stats = self._minutes[minute] = [0, 0, 0, 0]
+      for old in sorted(self._minutes)[:-_MINUTES_KEPT]:
+        del self._minutes[old]
+    return stats
+
+  async def close(self) -> None:
+    if self._flush_handle is not None:
+      self._flush_handle.cancel()
+      self._flush()
+    for websocket in list(self._clients):
+      self.disconnect(websocket)
+
+  def metrics(self) -> Dict[str, Any]:
+    clients = [client.metrics() for client in self._clients.values()]
+    return {
+      "clients": len(clients),
+      "queue_capacity": WS_CLIENT_QUEUE,
+      "batch_ms": WS_BATCH_MS,
+      "broadcasts": self._broadcasts,
+      "frames": self._frames,
+      "events_per_frame": round(self._framed_events / self._frames, 3) if self._frames else 0.0,
+      "frame_bytes": self._frame_bytes,
+      "trimmed_chars": self._trimmed_chars,
+      "disconnected": self._disconnected,
+      "disconnected_slow": self._disconnected_slow,
+      "max_lag_ms": max((c["lag_ms"] for c in clients), default=0.0),
+      # Sizes are before permessage-deflate, which the server applies per
+      # frame when the browser negotiates it.
+      "per_minute": [
+        {"minute": minute, "frames": s[0], "events": s[1], "bytes_encoded": s[2], "bytes_sent": s[3]}
+        for minute, s in sorted(self._minutes.items())
+      ],
+      "per_client": clients,
+    }
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+# Events/sec for the SQLite write path.
+#
+#   cd backend && python -m bench.db_ingest [--events 2000]
+#
+# "legacy" replays the old per-call connect/PRAGMA/commit/close pattern,
+# "per-event" uses the pooled writer with one transaction per event and
+# "batched" commits a whole poll cycle per write_batch().
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+_TMP = tempfile.mkdtemp(prefix="codexdash-bench-")
+os.environ["CODEXDASH_DIR"] = _TMP
+
+from app import db  # noqa: E402
+from app.services.event_ingest import update_job_from_event  # noqa: E402
+from app.services.job_cache import job_cache  # noqa: E402
+
+
+def _events(n: int) -> list[dict]:
+  out = []
+  for i in range(n):
+    out.append({
+      "ts": 1_700_000_000_000 + i,
+      "type": "pane_output",
+      "agent": "fast",
+      "pane_id": "%1",
+      "window_name": "fast",
+      "job_id": f"job-{i // 50:08d}",
+      "text": f"line {i} " + "x" * 200,
+      "completion_tokens_est": 60,
+    })
+  return out
+
+
+def _reset(path: Path) -> None:
+  db.close_db()
+  job_cache.clear()
+  for suffix in ("", "-wal", "-shm"):
+    Path(f"{path}{suffix}").unlink(missing_ok=True)
+  db.init_db()
+
+
+def _legacy(events: list[dict]) -> None:
+  # Faithful copy of the pre-pooling behaviour: a fresh connection per call.
+  def run(sql: str, params: tuple) -> None:
+    with db._DB_LOCK:
+      conn = sqlite3.connect(db.DB_PATH, timeout=5)
+      try:
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA busy_timeout=5000;")
+        conn.execute(sql, params)
+        conn.commit()
+      finally:
+        conn.close()
+
+  for ev in events:
+    run(
+      "INSERT INTO events (ts, type, agent, pane_id, job_id, payload) VALUES (?, ?, ?, ?, ?, ?)",
+      (ev["ts"], ev["type"], ev["agent"], ev["pane_id"], ev["job_id"], ev["text"]),
+    )
+    run("SELECT started_ts FROM jobs WHERE job_id = ?", (ev["job_id"],))
+    run(
+      "INSERT INTO jobs (job_id, agent, status, updated_ts) VALUES (?, ?, 'running', ?) "
+      "ON CONFLICT(job_id) DO UPDATE SET updated_ts=excluded.updated_ts",
+      (ev["job_id"], ev["agent"], ev["ts"]),
+    )
+    run(
+      "INSERT INTO agents (agent, status, last_seen) VALUES (?, 'running', ?) "
+      "ON CONFLICT(agent) DO UPDATE SET last_seen=excluded.last_seen",
+      (ev["agent"], ev["ts"]),
+    )
+
+
+def _per_event(events: list[dict]) -> None:
+  for ev in events:
+    db.insert_event(ev)
+    update_job_from_event(ev)
+    job_cache.flush()
+
+
+def _batched(events: list[dict], cycle: int) -> None:
+  for start in range(0, len(events), cycle):
+    with db.write_batch():
+      for ev in events[start:start + cycle]:
+        db.insert_event(ev)
+        update_job_from_event(ev)
+      job_cache.flush()
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--events", type=int, default=2000)
+  parser.add_argument("--cycle", type=int, default=20, help="events per poll cycle when batched")
+  ns = parser.parse_args()
+
+  events = _events(ns.events)
+  runs = [
+    ("legacy", _legacy),
+    ("per-event", _per_event),
+    ("batched", lambda evs: _batched(evs, ns.cycle)),
+  ]
+  for name, fn in runs:
+    _reset(db.DB_PATH)
+    started = time.perf_counter()
+    fn([dict(ev) for ev in events])
+    elapsed = time.perf_counter() - started
+    print(f"{name:>10}: {len(events) / elapsed:10.0f} events/sec  ({elapsed:.2f}s)")
+  db.close_db()
+
+
+if __name__ == "__main__":
+  main()
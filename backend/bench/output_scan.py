@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+# Throughput of pane output classification.
+#
+#   cd backend && python -m bench.output_scan [--captures DIR] [--rounds 5]
+#
+# DIR holds recorded pane captures, one text file per capture, e.g.
+#   tmux capture-pane -p -J -S -2000 -t <pane> > DIR/fast-1.txt
+# Without it a synthetic corpus of agent-like output is used. "separate" runs
+# the original one-search-per-pattern helpers (kept below as the reference),
+# "single-pass" the keyword scan in services/output_scan; both must classify
+# every capture identically.
+
+import argparse
+import random
+import re
+import time
+from pathlib import Path
+from typing import Optional
+
+from app.services.output_scan import scan_output
+from app.services.tmux_probe import detect_auth_needed
+
+TOKEN_REGEX = re.compile(r"(prompt|completion|total)\s*tokens\s*[:=]\s*(\d+)", re.I)
+MODEL_REGEX = re.compile(r"model\s*[:=]\s*([\w\-\.]+)", re.I)
+SUB_AGENT_REGEX = re.compile(r"(sub-?agent|tool|thread)\s*[:#]\s*([\w\-\.]+)", re.I)
+JOB_REGEX = re.compile(r"\[JOB:([a-f0-9\\-]{8,})\]", re.I)
+DONE_REGEX = re.compile(r"\b(done|completed|success|finished)\b", re.I)
+ERROR_REGEX = re.compile(r"\b(error|failed|traceback|exception)\b", re.I)
+
+
+def parse_tokens(text: str) -> dict[str, Optional[int]]:
+  found = {"prompt": None, "completion": None, "total": None}
+  for key, val in TOKEN_REGEX.findall(text):
+    found[key.lower()] = int(val)
+  return found
+
+
+def detect_model(text: str) -> Optional[str]:
+  match = MODEL_REGEX.search(text)
+  return match.group(1) if match else None
+
+
+def detect_subagent(text: str) -> Optional[str]:
+  match = SUB_AGENT_REGEX.search(text)
+  if match:
+    return match.group(2)
+  return None
+
+
+def classify_status(text: str) -> Optional[str]:
+  if not text:
+    return None
+  if ERROR_REGEX.search(text):
+    return "error"
+  if detect_auth_needed(text):
+    return "blocked"
+  if DONE_REGEX.search(text):
+    return "done"
+  return None
+
+
+_WORDS = (
+  "the file was updated and tests run ok we then looked at module config path value "
+  "result context function class import return yield async await patch diff apply"
+).split()
+
+_EVENTS = [
+  "model: gpt-5-codex",
+  "prompt tokens: 1234",
+  "completion tokens = 456",
+  "total tokens: 1690",
+  "sub-agent: reviewer",
+  "[JOB:0f3a9c2e-77b1-4d0e-9a51-3c2b1e0f9d44] refactor the parser",
+  "Tests finished",
+  "Traceback (most recent call last):",
+  "Please sign in to continue",
+  "Open the OpenAI page in your browser",
+]
+
+
+def _synthetic(count: int) -> list[str]:
+  rng = random.Random(7)
+  out = []
+  for _ in range(count):
+    lines = []
+    for _ in range(rng.randint(5, 400)):
+      if rng.random() < 0.02:
+        lines.append(rng.choice(_EVENTS))
+      else:
+        lines.append(" ".join(rng.choice(_WORDS) for _ in range(rng.randint(3, 16))))
+    out.append("\n".join(lines))
+  return out
+
+
+def _load(directory: Path) -> list[str]:
+  return [
+    path.read_text(encoding="utf-8", errors="replace")
+    for path in sorted(directory.iterdir())
+    if path.is_file()
+  ]
+
+
+def _separate(text: str) -> tuple:
+  job = JOB_REGEX.search(text)
+  return (
+    job.group(1) if job else None,
+    parse_tokens(text),
+    detect_model(text),
+    classify_status(text),
+    detect_auth_needed(text),
+    detect_subagent(text),
+  )
+
+
+def _single_pass(text: str) -> tuple:
+  scan = scan_output(text)
+  return (scan.job_id, scan.tokens, scan.model, scan.status, scan.auth_needed, scan.sub_agent)
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--captures", type=Path, help="directory of recorded pane captures")
+  parser.add_argument("--synthetic", type=int, default=300, help="captures to generate without --captures")
+  parser.add_argument("--rounds", type=int, default=5)
+  ns = parser.parse_args()
+
+  texts = _load(ns.captures) if ns.captures else _synthetic(ns.synthetic)
+  total_bytes = sum(len(t.encode("utf-8")) for t in texts)
+
+  mismatched = [i for i, text in enumerate(texts) if _separate(text) != _single_pass(text)]
+  if mismatched:
+    raise SystemExit(f"classification differs for {len(mismatched)} captures, first #{mismatched[0]}")
+
+  print(f"{len(texts)} captures, {total_bytes / 1e6:.2f} MB per round")
+  for name, fn in (("separate", _separate), ("single-pass", _single_pass)):
+    started = time.perf_counter()
+    for _ in range(ns.rounds):
+      for text in texts:
+        fn(text)
+    elapsed = time.perf_counter() - started
+    mb = total_bytes * ns.rounds / 1e6
+    print(f"{name:>12}: {mb / elapsed:8.1f} MB/s  ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+# End-to-end latency from bin/codexdash's write_event() to the broadcast of
+# the committed event, for the polling and inotify tail modes.
+#
+#   cd backend && python -m bench.tail_latency [--events 200] [--gap-ms 20]
+
+import argparse
+import asyncio
+import importlib.machinery
+import importlib.util
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+_TMP = tempfile.mkdtemp(prefix="codexdash-bench-")
+os.environ["CODEXDASH_DIR"] = _TMP
+
+from app import db  # noqa: E402
+from app.services.event_ingest import Tailer  # noqa: E402
+from app.services.ingest_queue import IngestPipeline  # noqa: E402
+
+_CODEXDASH = Path(__file__).resolve().parents[2] / "bin" / "codexdash"
+
+
+def _load_writer():
+  loader = importlib.machinery.SourceFileLoader("codexdash_cli", str(_CODEXDASH))
+  spec = importlib.util.spec_from_loader(loader.name, loader)
+  module = importlib.util.module_from_spec(spec)
+  loader.exec_module(module)
+  return module
+
+
+async def _run(mode: str, cli, count: int, gap_ms: int) -> list[float]:
+  written: dict[str, float] = {}
+  latencies: list[float] = []
+  done = asyncio.Event()
+
+  async def on_commit(event: dict) -> None:
+    sent = written.pop(event.get("text"), None)
+    if sent is not None:
+      latencies.append((time.perf_counter() - sent) * 1000.0)
+      if len(latencies) == count:
+        done.set()
+
+  pipeline = IngestPipeline(on_commit)
+  tailer = Tailer(mode)
+  tasks = [asyncio.create_task(pipeline.run()), asyncio.create_task(tailer.run(pipeline.put))]
+  await asyncio.sleep(0.3)
+  for i in range(count):
+    text = f"{mode}-{i}"
+    written[text] = time.perf_counter()
+    # The CLI's own writer, as `codexdash send` streams controller output.
+    await asyncio.to_thread(cli.write_event, {
+      "ts": cli.now_ms(),
+      "type": "controller_output",
+      "job_id": "0123456789abcdef",
+      "text": text,
+    })
+    await asyncio.sleep(gap_ms / 1000.0)
+  await asyncio.wait_for(done.wait(), 10)
+  tailer.close()
+  for task in tasks:
+    task.cancel()
+  return latencies
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--events", type=int, default=200)
+  parser.add_argument("--gap-ms", type=int, default=20, help="pause between writes")
+  ns = parser.parse_args()
+
+  db.init_db()
+  cli = _load_writer()
+  for mode in ("poll", "inotify"):
+    latencies = asyncio.run(_run(mode, cli, ns.events, ns.gap_ms))
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+      f"{mode:>8}: p50 {statistics.median(latencies):7.2f} ms  "
+      f"p95 {p95:7.2f} ms  max {latencies[-1]:7.2f} ms"
+    )
+  db.close_db()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+# WebSocket bytes on the wire per minute of capture traffic.
+#
+#   cd backend && python -m bench.ws_frames [--agents 4] [--interval-ms 200] [--lines 3]
+#
+# Each poll cycle every agent emits one pane_output event of --lines new
+# lines, plus an occasional full-screen resync. "per-event" is the old
+# broadcast (one json.dumps and one frame per event, full text inline);
+# "batched" runs the events through services/ws_broadcast. Sizes include
+# the WebSocket frame header; the deflate column applies permessage-deflate
+# as the websockets server does (raw deflate, context kept across frames of
+# one connection).
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import types
+import zlib
+
+try:
+  import fastapi  # noqa: F401
+except ImportError:  # the broadcaster only needs the name for annotations
+  sys.modules["fastapi"] = types.SimpleNamespace(WebSocket=object)
+
+from app.services.ws_broadcast import ConnectionManager  # noqa: E402
+
+_WORDS = (
+  "reading file updating module running tests ok patch applied diff context "
+  "function class import return value config path result step"
+).split()
+
+
+def _line(rng: random.Random) -> str:
+  return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(4, 14)))
+
+
+def _cycles(agents: int, cycles: int, lines: int, seed: int = 7) -> list[list[dict]]:
+  rng = random.Random(seed)
+  out = []
+  for cycle in range(cycles):
+    batch = []
+    for n in range(agents):
+      resync = rng.random() < 0.02
+      text = "\n".join(_line(rng) for _ in range(200 if resync else lines))
+      batch.append({
+        "ts": 1_700_000_000_000 + cycle * 200,
+        "type": "pane_output",
+        "session": None,
+        "agent": f"agent-{n}",
+        "pane_id": f"%{n}",
+        "window_name": f"agent-{n}",
+        "job_id": f"job-{n}-{cycle // 300}",
+        "text": text,
+        "text_hash": f"{cycle:032x}{n:032x}",
+        "prompt_tokens_exact": None,
+        "completion_tokens_exact": None,
+        "total_tokens_exact": None,
+        "completion_tokens_est": len(text) // 4,
+        "model": "gpt-5-codex",
+        "status": None,
+      })
+    out.append(batch)
+  return out
+
+
+def _header(size: int) -> int:
+  # Server-to-client frames are unmasked.
+  return 2 if size < 126 else 4 if size < 65536 else 10
+
+
+class _Wire:
+  def __init__(self) -> None:
+    self.frames = 0
+    self.bytes = 0
+    self.deflated = 0
+    self._deflate = zlib.compressobj(6, zlib.DEFLATED, -15)
+
+  def send(self, data: str) -> None:
+    raw = data.encode("utf-8")
+    self.frames += 1
+    self.bytes += _header(len(raw)) + len(raw)
+    # A message ends with a sync flush whose 4-byte trailer is not sent.
+    size = len(self._deflate.compress(raw) + self._deflate.flush(zlib.Z_SYNC_FLUSH)) - 4
+    self.deflated += _header(size) + size
+
+
+class _Socket(_Wire):
+  async def accept(self) -> None:
+    return None
+
+  async def send_text(self, data: str) -> None:
+    self.send(data)
+
+
+def _per_event(cycles: list[list[dict]]) -> _Wire:
+  wire = _Wire()
+  for batch in cycles:
+    for event in batch:
+      wire.send(json.dumps(event, ensure_ascii=False))
+  return wire
+
+
+async def _batched(cycles: list[list[dict]]) -> _Socket:
+  manager = ConnectionManager()
+  sock = _Socket()
+  await manager.connect(sock)
+  for batch in cycles:
+    # One ingest batch commits a whole poll cycle, back to back.
+    for event in batch:
+      await manager.broadcast(event)
+    await asyncio.sleep(0.03)
+  await asyncio.sleep(0.05)
+  await manager.close()
+  return sock
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--agents", type=int, default=4)
+  parser.add_argument("--interval-ms", type=int, default=200, help="poll interval the traffic is scaled to")
+  parser.add_argument("--lines", type=int, default=3, help="new lines per capture")
+  parser.add_argument("--cycles", type=int, default=150)
+  ns = parser.parse_args()
+
+  cycles = _cycles(ns.agents, ns.cycles, ns.lines)
+  per_minute = 60000 / (ns.interval_ms * ns.cycles)
+  print(f"{ns.agents} agents, {ns.lines} lines per capture, every {ns.interval_ms} ms; per minute:")
+  for name, wire in (("per-event", _per_event(cycles)), ("batched", asyncio.run(_batched(cycles)))):
+    print(
+      f"{name:>10}: {wire.frames * per_minute:8.0f} frames  {wire.bytes * per_minute / 1024:9.1f} KiB"
+      f"  {wire.deflated * per_minute / 1024:9.1f} KiB deflated"
+    )
+
+
+if __name__ == "__main__":
+  main()
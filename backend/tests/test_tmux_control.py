@@ -0,0 +1,33 @@
+import asyncio
+
+from app.services.tmux_control import TmuxControlClient, _Request
+
+
+def _feed(client, lines):
+  for line in lines:
+    client._handle(line)
+
+
+def test_pane_text_resembling_end_does_not_close_block():
+  async def run():
+    client = TmuxControlClient()
+    loop = asyncio.get_running_loop()
+    capture = _Request(1, loop.create_future())
+    query = _Request(1, loop.create_future())
+    client._pending.extend([capture, query])
+    _feed(client, [
+      "%begin 1700000000 41 1",
+      "first line",
+      "%end 1 2 1",
+      "%error 1700000000 40 1",
+      "last line",
+      "%end 1700000000 41 1",
+      "%begin 1700000000 42 1",
+      "%1",
+      "%end 1700000000 42 1",
+    ])
+    assert capture.future.result() == (True, "first line\n%end 1 2 1\n%error 1700000000 40 1\nlast line")
+    assert query.future.result() == (True, "%1")
+    assert not client._pending
+
+  asyncio.run(run())
@@ -27,6 +27,11 @@ export type Job = {
   prompt_tokens_est: number | null;
   completion_tokens_est: number | null;
   total_tokens_est: number | null;
+  // Fan-out dispatches: children (and the completion policy) on the parent,
+  // parent_job_id on each per-agent child.
+  parent_job_id?: string | null;
+  completion?: string | null;
+  children?: number | null;
 };
 
 export type Event = {
@@ -40,7 +45,14 @@ export type Event = {
   job_id?: string | null;
   payload?: string;
   text?: string;
+  text_hash?: string | null;
+  // Set on live-stream events whose text was cut to its tail; the full text
+  // is at /api/blobs/{text_hash}.
+  text_truncated?: boolean;
+  text_chars?: number;
   prompt_text?: string | null;
+  prompt_text_truncated?: boolean;
+  prompt_text_chars?: number;
   prompt_hash?: string | null;
   prompt_bytes?: number | null;
   output_path?: string | null;
@@ -56,6 +68,28 @@ export type Event = {
   sub_agent?: string | null;
 };
 
+export type TokenPoint = {
+  start: number;
+  agent?: string;
+  model?: string;
+  events: number;
+  prompt_tokens_exact: number;
+  completion_tokens_exact: number;
+  total_tokens_exact: number;
+  prompt_tokens_est: number;
+  completion_tokens_est: number;
+  total_tokens_est: number;
+};
+
+export type TokenSeries = {
+  bucket: "minute" | "hour" | "day";
+  bucket_ms: number;
+  from: number;
+  to: number;
+  group: string;
+  series: TokenPoint[];
+};
+
 export async function getJSON<T>(url: string): Promise<T> {
   const res = await fetch(url);
   if (!res.ok) {
@@ -63,3 +97,21 @@ export async function getJSON<T>(url: string): Promise<T> {
   }
   return (await res.json()) as T;
 }
+
+export type Page<T> = { items: T[]; next: string | null };
+
+// List endpoints return one page and the cursor for the next in X-Next-Cursor.
+export async function getPage<T>(url: string): Promise<Page<T>> {
+  const res = await fetch(url);
+  if (!res.ok) {
+    throw new Error(`Request failed: ${res.status}`);
+  }
+  return { items: (await res.json()) as T[], next: res.headers.get("X-Next-Cursor") };
+}
+
+export const EVENT_LIST_FIELDS =
+  "id,ts,type,agent,job_id,text,prompt_text,total_tokens_exact,total_tokens_est";
+export const JOB_LIST_FIELDS =
+  "job_id,agent,status,started_ts,updated_ts,duration_ms,model," +
+  "prompt_tokens_exact,completion_tokens_exact,total_tokens_exact," +
+  "prompt_tokens_est,completion_tokens_est,total_tokens_est";
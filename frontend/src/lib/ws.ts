@@ -1,25 +1,92 @@
-import { useEffect, useRef, useState } from "react";
+import { useCallback, useEffect, useRef, useState } from "react";
 import type { Event } from "./api";
 
-export function useEventStream() {
+const RECONNECT_MS = 1000;
+
+export type StreamFilter = {
+  agents?: string[];
+  jobIds?: string[];
+  types?: string[];
+};
+
+function streamUrl(filter: StreamFilter, after: number | null) {
+  const params = new URLSearchParams();
+  if (filter.agents?.length) params.set("agents", filter.agents.join(","));
+  if (filter.jobIds?.length) params.set("job_ids", filter.jobIds.join(","));
+  if (filter.types?.length) params.set("types", filter.types.join(","));
+  if (after !== null) params.set("after", String(after));
+  const query = params.toString();
+  return `ws://${window.location.host}/ws/events${query ? `?${query}` : ""}`;
+}
+
+export function useEventStream(filter: StreamFilter = {}) {
   const [events, setEvents] = useState<Event[]>([]);
+  // Bumped when the server could not replay everything missed while
+  // disconnected; callers reload from /api/events.
+  const [resyncs, setResyncs] = useState(0);
   const wsRef = useRef<WebSocket | null>(null);
+  const lastIdRef = useRef<number | null>(null);
+  const key = JSON.stringify([filter.agents ?? [], filter.jobIds ?? [], filter.types ?? []]);
 
   useEffect(() => {
-    const ws = new WebSocket(`ws://${window.location.host}/ws/events`);
-    wsRef.current = ws;
-    ws.onmessage = (msg) => {
-      try {
-        const event = JSON.parse(msg.data) as Event;
-        setEvents((prev) => [event, ...prev].slice(0, 500));
-      } catch {
-        return;
-      }
+    let closed = false;
+    let timer: number | undefined;
+    lastIdRef.current = null;
+    setEvents([]);
+
+    const connect = () => {
+      // On reconnect the server replays what this filter missed since lastId.
+      const ws = new WebSocket(streamUrl(filter, lastIdRef.current));
+      wsRef.current = ws;
+      ws.onmessage = (msg) => {
+        try {
+          // Frames are arrays of events, oldest first.
+          const data = JSON.parse(msg.data) as Event[] | Event;
+          const batch = (Array.isArray(data) ? data : [data]).filter((event) => {
+            if (event.type === "replay_gap") {
+              setResyncs((n) => n + 1);
+              return false;
+            }
+            return true;
+          });
+          for (const event of batch) {
+            if (event.id !== undefined && (lastIdRef.current === null || event.id > lastIdRef.current)) {
+              lastIdRef.current = event.id;
+            }
+          }
+          if (batch.length) {
+            setEvents((prev) => [...batch.reverse(), ...prev].slice(0, 500));
+          }
+        } catch {
+          return;
+        }
+      };
+      // The server drops clients that fall too far behind (close code 1013)
+      // or that it failed to serve (1011); reconnect rather than going silent.
+      ws.onclose = () => {
+        if (!closed) {
+          timer = window.setTimeout(connect, RECONNECT_MS);
+        }
+      };
     };
+
+    connect();
     return () => {
-      ws.close();
+      closed = true;
+      window.clearTimeout(timer);
+      wsRef.current?.close();
     };
+  }, [key]);
+
+  // Starts the resume cursor from the events the caller loaded over REST, so
+  // a drop before the first live event still replays what it missed.
+  const seed = useCallback((loaded: Event[]) => {
+    for (const event of loaded) {
+      if (event.id !== undefined && (lastIdRef.current === null || event.id > lastIdRef.current)) {
+        lastIdRef.current = event.id;
+      }
+    }
   }, []);
 
-  return { events };
+  return { events, resyncs, seed };
 }
@@ -1,6 +1,6 @@
 import { useEffect, useMemo, useState } from "react";
 import { Card, Badge } from "../components/ui";
-import { getJSON, Agent, Event } from "../lib/api";
+import { getJSON, Agent, Event, EVENT_LIST_FIELDS } from "../lib/api";
 
 export default function Agents() {
   const [agents, setAgents] = useState<Agent[]>([]);
@@ -9,8 +9,15 @@ export default function Agents() {
 
   useEffect(() => {
     getJSON<Agent[]>("/api/agents").then(setAgents).catch(() => setAgents([]));
-    getJSON<Event[]>("/api/events?limit=200").then(setEvents).catch(() => setEvents([]));
-    getJSON<{ agents: any }>("/api/doctor").then(setDoctor).catch(() => setDoctor(null));
+    getJSON<Event[]>(`/api/events?limit=200&fields=${EVENT_LIST_FIELDS}`).then(setEvents).catch(() => setEvents([]));
+  }, []);
+
+  useEffect(() => {
+    // Served from the backend's in-memory snapshot, so polling is cheap.
+    const load = () => getJSON<{ agents: any; age_ms: number | null }>("/api/doctor").then(setDoctor).catch(() => setDoctor(null));
+    load();
+    const timer = setInterval(load, 5000);
+    return () => clearInterval(timer);
   }, []);
 
   const grouped = useMemo(() => {
@@ -27,7 +34,12 @@ export default function Agents() {
     <div className="space-y-6">
       {doctor ? (
         <Card>
-          <div className="mb-3 text-sm uppercase tracking-widest text-slate-400">Doctor</div>
+          <div className="mb-3 flex items-center justify-between">
+            <div className="text-sm uppercase tracking-widest text-slate-400">Doctor</div>
+            <div className="text-xs text-slate-500">
+              {doctor.age_ms == null ? "not sampled yet" : `sampled ${(doctor.age_ms / 1000).toFixed(1)}s ago`}
+            </div>
+          </div>
           <div className="grid gap-3 md:grid-cols-2">
             {Object.entries(doctor.agents || {}).map(([agent, info]: any) => (
               <div key={agent} className="rounded-xl border border-base-700 bg-base-700/30 p-3">
@@ -38,6 +50,10 @@ export default function Agents() {
                 <div className="mt-2 text-xs text-slate-400">Pane: {info.pane_id ?? "-"}</div>
                 <div className="text-xs text-slate-400">Mode: {info.mode ?? "unknown"}</div>
                 <div className="text-xs text-slate-400">Auth needed: {info.auth_needed ? "yes" : "no"}</div>
+                <div className="text-xs text-slate-400">
+                  Last output: {info.last_output_age_ms == null ? "-" : `${Math.round(info.last_output_age_ms / 1000)}s ago`}
+                </div>
+                <div className="text-xs text-slate-400">Capture: {info.capture_ms == null ? "-" : `${info.capture_ms} ms`}</div>
               </div>
             ))}
           </div>
@@ -1,7 +1,7 @@
 import { useEffect, useMemo, useState } from "react";
 import { CartesianGrid, Line, LineChart, ResponsiveContainer, Tooltip, XAxis, YAxis, Bar, BarChart } from "recharts";
 import { Card, Badge, Stat } from "../components/ui";
-import { getJSON, Agent, Job, Event } from "../lib/api";
+import { getJSON, Agent, Event, TokenPoint, TokenSeries, EVENT_LIST_FIELDS } from "../lib/api";
 import { useEventStream } from "../lib/ws";
 
 function formatTs(ts?: number | null) {
@@ -11,43 +11,70 @@ function formatTs(ts?: number | null) {
 
 export default function Dashboard() {
   const [agents, setAgents] = useState<Agent[]>([]);
-  const [jobs, setJobs] = useState<Job[]>([]);
-  const [events, setEvents] = useState<Event[]>([]);
-  const { events: wsEvents } = useEventStream();
+  const [byAgent, setByAgent] = useState<TokenPoint[]>([]);
+  const [overTime, setOverTime] = useState<TokenSeries | null>(null);
+  const [loaded, setLoaded] = useState<Event[]>([]);
+  const { events: wsEvents, resyncs, seed } = useEventStream();
 
   useEffect(() => {
     getJSON<Agent[]>("/api/agents").then(setAgents).catch(() => setAgents([]));
-    getJSON<Job[]>("/api/jobs?limit=20").then(setJobs).catch(() => setJobs([]));
-    getJSON<Event[]>("/api/events?limit=30").then(setEvents).catch(() => setEvents([]));
+    getJSON<TokenSeries>("/api/metrics/tokens?bucket=day&range=7d&group=agent")
+      .then((res) => setByAgent(res.series))
+      .catch(() => setByAgent([]));
+    getJSON<TokenSeries>("/api/metrics/tokens?bucket=minute&range=60m&group=none")
+      .then(setOverTime)
+      .catch(() => setOverTime(null));
   }, []);
 
   useEffect(() => {
-    if (wsEvents.length === 0) return;
-    setEvents((prev) => [wsEvents[0], ...prev].slice(0, 50));
-  }, [wsEvents]);
+    getJSON<Event[]>(`/api/events?limit=30&fields=${EVENT_LIST_FIELDS}`)
+      .then((page) => {
+        setLoaded(page);
+        seed(page);
+      })
+      .catch(() => setLoaded([]));
+  }, [resyncs, seed]);
 
+  // Live events (newest first) ahead of the initial page, without repeats.
+  const events = useMemo(() => {
+    const seen = new Set<number>();
+    const out: Event[] = [];
+    for (const event of [...wsEvents, ...loaded]) {
+      if (event.id !== undefined) {
+        if (seen.has(event.id)) continue;
+        seen.add(event.id);
+      }
+      out.push(event);
+      if (out.length >= 50) break;
+    }
+    return out;
+  }, [wsEvents, loaded]);
+
+  // Exact counts when the agent printed them, otherwise the estimate.
   const tokensByAgent = useMemo(() => {
     const map: Record<string, { agent: string; prompt: number; completion: number }> = {};
-    for (const job of jobs) {
-      const name = job.agent || "unknown";
+    for (const point of byAgent) {
+      const name = point.agent || "unknown";
       if (!map[name]) map[name] = { agent: name, prompt: 0, completion: 0 };
-      map[name].prompt += job.prompt_tokens_exact ?? job.prompt_tokens_est ?? 0;
-      map[name].completion += job.completion_tokens_exact ?? job.completion_tokens_est ?? 0;
+      map[name].prompt += point.prompt_tokens_exact || point.prompt_tokens_est;
+      map[name].completion += point.completion_tokens_exact || point.completion_tokens_est;
     }
     return Object.values(map);
-  }, [jobs]);
+  }, [byAgent]);
 
   const tokensOverTime = useMemo(() => {
-    const points = events
-      .filter((ev) => ev.type && ev.ts)
-      .slice(0, 40)
-      .map((ev) => ({
-        ts: new Date(ev.ts).toLocaleTimeString(),
-        tokens: (ev.total_tokens_exact ?? ev.total_tokens_est) ?? 0
-      }))
-      .reverse();
+    if (!overTime) return [];
+    const byStart = new Map(overTime.series.map((point) => [point.start, point]));
+    const points = [];
+    for (let start = overTime.from; start < overTime.to; start += overTime.bucket_ms) {
+      const point = byStart.get(start);
+      points.push({
+        ts: new Date(start).toLocaleTimeString(),
+        tokens: point ? point.total_tokens_exact || point.prompt_tokens_est + point.completion_tokens_est : 0
+      });
+    }
     return points;
-  }, [events]);
+  }, [overTime]);
 
   return (
     <div className="space-y-8">
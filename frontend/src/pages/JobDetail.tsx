@@ -1,5 +1,5 @@
 import { useEffect, useMemo, useState } from "react";
-import { useParams } from "react-router-dom";
+import { Link, useParams } from "react-router-dom";
 import { Badge, Button, Card, Stat } from "../components/ui";
 import { getJSON, Job, Event } from "../lib/api";
 
@@ -7,12 +7,14 @@ export default function JobDetail() {
   const { jobId } = useParams();
   const [job, setJob] = useState<Job | null>(null);
   const [events, setEvents] = useState<Event[]>([]);
+  const [children, setChildren] = useState<Job[]>([]);
 
   useEffect(() => {
     if (!jobId) return;
-    getJSON<{ job: Job; events: Event[] }>(`/api/jobs/${jobId}`).then((data) => {
+    getJSON<{ job: Job; events: Event[]; children?: Job[] }>(`/api/jobs/${jobId}`).then((data) => {
       setJob(data.job);
       setEvents(data.events);
+      setChildren(data.children ?? []);
     });
   }, [jobId]);
 
@@ -32,13 +34,12 @@ export default function JobDetail() {
   }, [events]);
 
   const download = () => {
-    const blob = new Blob([transcript], { type: "text/plain;charset=utf-8" });
-    const url = URL.createObjectURL(blob);
+    // Assembled server-side from the stored chunks (deduplicated, and
+    // including output already rolled up by retention).
     const a = document.createElement("a");
-    a.href = url;
+    a.href = `/api/jobs/${jobId}/stream?format=transcript`;
     a.download = `${jobId}-transcript.txt`;
     a.click();
-    URL.revokeObjectURL(url);
   };
 
   if (!job) {
@@ -67,6 +68,35 @@ export default function JobDetail() {
             {job.prompt_text ?? job.prompt_hash ?? "(not captured)"}
           </pre>
         </div>
+        {children.length ? (
+          <div>
+            <div className="mb-2 text-xs uppercase tracking-widest text-slate-400">
+              Agents ({children.filter((c) => c.status === "done").length}/{children.length} done
+              {job.completion ? `, completes on ${job.completion}` : ""})
+            </div>
+            <table className="min-w-full text-sm">
+              <tbody>
+                {children.map((child) => (
+                  <tr key={child.job_id} className="border-t border-base-700/60">
+                    <td className="py-2">
+                      <Link className="text-accent-cyan hover:underline" to={`/jobs/${child.job_id}`}>
+                        {child.agent ?? child.job_id.slice(0, 8)}
+                      </Link>
+                    </td>
+                    <td className="py-2">
+                      <Badge
+                        text={child.status ?? "unknown"}
+                        tone={child.status === "running" ? "cyan" : child.status === "error" ? "pink" : "slate"}
+                      />
+                    </td>
+                    <td className="py-2">{child.duration_ms ? `${(child.duration_ms / 1000).toFixed(1)}s` : "-"}</td>
+                    <td className="py-2">{child.total_tokens_exact ?? child.total_tokens_est ?? 0} tokens</td>
+                  </tr>
+                ))}
+              </tbody>
+            </table>
+          </div>
+        ) : null}
         {subAgents.length ? (
           <div>
             <div className="mb-2 text-xs uppercase tracking-widest text-slate-400">Sub-agents</div>
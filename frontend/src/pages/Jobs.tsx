@@ -1,7 +1,7 @@
 import { useEffect, useMemo, useState } from "react";
 import { Link } from "react-router-dom";
 import { Badge, Card } from "../components/ui";
-import { getJSON, Job } from "../lib/api";
+import { getPage, Job, JOB_LIST_FIELDS } from "../lib/api";
 
 function formatDuration(ms?: number | null) {
   if (!ms) return "-";
@@ -20,13 +20,24 @@ export default function Jobs() {
   const [jobs, setJobs] = useState<Job[]>([]);
   const [status, setStatus] = useState<string>("");
   const [agent, setAgent] = useState<string>("");
+  const [next, setNext] = useState<string | null>(null);
 
-  const load = () => {
+  const load = (cursor?: string) => {
     const params = new URLSearchParams();
     params.set("limit", "100");
+    params.set("fields", JOB_LIST_FIELDS);
     if (status) params.set("status", status);
     if (agent) params.set("agent", agent);
-    getJSON<Job[]>(`/api/jobs?${params.toString()}`).then(setJobs).catch(() => setJobs([]));
+    if (cursor) params.set("cursor", cursor);
+    getPage<Job>(`/api/jobs?${params.toString()}`)
+      .then((page) => {
+        setJobs((prev) => (cursor ? [...prev, ...page.items] : page.items));
+        setNext(page.next);
+      })
+      .catch(() => {
+        if (!cursor) setJobs([]);
+        setNext(null);
+      });
   };
 
   useEffect(() => {
@@ -50,6 +61,7 @@ export default function Jobs() {
             <option value="done">Done</option>
             <option value="blocked">Blocked</option>
             <option value="error">Error</option>
+            <option value="timeout">Timeout</option>
           </select>
           <select
             className="rounded-lg border border-base-700 bg-base-700/50 px-3 py-2 text-sm"
@@ -65,7 +77,7 @@ export default function Jobs() {
           </select>
           <button
             className="rounded-lg border border-base-700 bg-base-700/40 px-3 py-2 text-sm"
-            onClick={load}
+            onClick={() => load()}
           >
             Refresh
           </button>
@@ -112,6 +124,16 @@ export default function Jobs() {
           </tbody>
         </table>
       </div>
+      {next && (
+        <div className="mt-4 flex justify-center">
+          <button
+            className="rounded-lg border border-base-700 bg-base-700/40 px-3 py-2 text-sm"
+            onClick={() => load(next)}
+          >
+            Load more
+          </button>
+        </div>
+      )}
     </Card>
   );
 }